@@ -0,0 +1,48 @@
+"""
+Compares reading the layers of a file through a memory mapping against reading
+them into memory, for a single layer image and for the layer area table. Run it
+from the repository root with:
+
+    poetry run python benchmarks/layer_reading.py
+"""
+
+import pathlib
+import timeit
+from typing import Callable
+from unittest.mock import patch
+
+from mariner.file_formats.ctb import CTBFile
+
+
+def report(name: str, function: Callable[[], object], number: int) -> None:
+    secs = timeit.timeit(function, number=number)
+    print(f"{name}: {1000.0 * secs / number:.1f} ms")
+
+
+def main() -> None:
+    path = (
+        pathlib.Path(__file__).parent.parent
+        / "mariner"
+        / "file_formats"
+        / "tests"
+        / "stairs.ctb"
+    )
+
+    # files that can't be mapped are read into memory instead
+    read_instead = patch("mariner.file_formats.mmap.mmap", side_effect=ValueError)
+
+    number = 20
+    print("layer image:")
+    report("  mapped", lambda: CTBFile.read_layer_image(path, 200), number)
+    with read_instead:
+        report("  read", lambda: CTBFile.read_layer_image(path, 200), number)
+
+    number = 3
+    print("layer area table:")
+    report("  mapped", lambda: CTBFile.read_layer_area_table(path), number)
+    with read_instead:
+        report("  read", lambda: CTBFile.read_layer_area_table(path), number)
+
+
+if __name__ == "__main__":
+    main()
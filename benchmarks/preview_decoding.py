@@ -0,0 +1,86 @@
+"""
+Compares the shared RGB15 preview decoder against the per-pixel loop that each
+file format used to carry. Run it from the repository root with:
+
+    poetry run python benchmarks/preview_decoding.py
+"""
+
+import pathlib
+import struct
+import timeit
+from typing import List
+
+import png
+
+from mariner.file_formats.ctb import CTBHeader, CTBPreview
+from mariner.file_formats.rle import REPEAT_RGB15_MASK, read_rgb15_image
+
+
+def read_image_per_pixel(width: int, height: int, data: bytes) -> png.Image:
+    array: List[List[int]] = [[]]
+
+    (i, x) = (0, 0)
+    while i < len(data):
+        color16 = int(struct.unpack_from("<H", data, i)[0])
+        i += 2
+        repeat = 1
+        if color16 & REPEAT_RGB15_MASK:
+            repeat += int(struct.unpack_from("<H", data, i)[0]) & 0xFFF
+            i += 2
+
+        (r, g, b) = (
+            (color16 >> 0) & 0x1F,
+            (color16 >> 6) & 0x1F,
+            (color16 >> 11) & 0x1F,
+        )
+
+        while repeat > 0:
+            array[-1] += [r, g, b]
+            repeat -= 1
+
+            x += 1
+            if x == width:
+                x = 0
+                array.append([])
+
+    array.pop()
+
+    return png.from_array(array, "RGB;5")
+
+
+def main() -> None:
+    path = (
+        pathlib.Path(__file__).parent.parent
+        / "mariner"
+        / "file_formats"
+        / "tests"
+        / "stairs.ctb"
+    )
+    with open(str(path), "rb") as file:
+        header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+        file.seek(header.high_res_preview_offset)
+        preview = CTBPreview.unpack(file.read(CTBPreview.get_size()))
+        file.seek(preview.image_offset)
+        data = file.read(preview.image_length)
+
+    (width, height) = (preview.resolution_x, preview.resolution_y)
+    expected_image = read_image_per_pixel(width, height, data)
+    actual_image = read_rgb15_image(width, height, data)
+    assert [list(row) for row in expected_image.rows] == [
+        list(row) for row in actual_image.rows
+    ]
+
+    number = 20
+    for (name, decoder) in [
+        ("per-pixel loop", read_image_per_pixel),
+        ("shared decoder", read_rgb15_image),
+    ]:
+        # images may decode their rows lazily, so we consume them all
+        secs = timeit.timeit(
+            lambda: list(decoder(width, height, data).rows), number=number
+        )
+        print(f"{name}: {1000.0 * secs / number:.2f} ms per {width}x{height} preview")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares parsing headers and layer tables through the compiled struct codecs
+against typedstruct's per-call format building and dataclass construction. Run
+it from the repository root with:
+
+    poetry run python benchmarks/struct_parsing.py
+"""
+
+import pathlib
+import timeit
+from typing import Callable, List, Type
+
+import typedstruct
+
+from mariner.file_formats import LayerTable, unpack_layer_table_from
+from mariner.file_formats.ctb import CTBHeader, CTBLayerDef
+from mariner.file_formats.structs import TStruct
+
+
+def unpack_with_typedstruct(cls: Type[TStruct], data: bytes) -> TStruct:
+    return typedstruct.LittleEndianStruct.unpack.__func__(cls, data)  # type: ignore
+
+
+def unpack_layer_defs_with_typedstruct(
+    data: bytes, layer_count: int
+) -> List[CTBLayerDef]:
+    size = typedstruct.LittleEndianStruct.get_size.__func__(CTBLayerDef)  # type: ignore
+    layer_defs = []
+    for offset in range(0, layer_count * size, size):
+        end = offset + size
+        layer_defs.append(unpack_with_typedstruct(CTBLayerDef, data[offset:end]))
+    return layer_defs
+
+
+def unpack_layer_defs_compiled(data: bytes, layer_count: int) -> List[CTBLayerDef]:
+    size = CTBLayerDef.get_size()
+    return [
+        CTBLayerDef.unpack_from(data, offset)
+        for offset in range(0, layer_count * size, size)
+    ]
+
+
+def unpack_layer_table(data: bytes, layer_count: int) -> LayerTable:
+    return unpack_layer_table_from(data, 0, layer_count, CTBLayerDef)
+
+
+def report(name: str, function: Callable[[], object], number: int) -> None:
+    secs = timeit.timeit(function, number=number)
+    print(f"{name}: {1000000.0 * secs / number:.1f} us")
+
+
+def main() -> None:
+    path = (
+        pathlib.Path(__file__).parent.parent
+        / "mariner"
+        / "file_formats"
+        / "tests"
+        / "stairs.ctb"
+    )
+    with open(str(path), "rb") as file:
+        data = file.read()
+    header = CTBHeader.unpack(data[: CTBHeader.get_size()])
+    assert unpack_with_typedstruct(CTBHeader, data[: CTBHeader.get_size()]) == header
+
+    layer_count = header.layer_count
+    layer_defs_end = header.layer_defs_offset + layer_count * CTBLayerDef.get_size()
+    layer_defs = data[header.layer_defs_offset:layer_defs_end]
+    expected_layer_defs = unpack_layer_defs_with_typedstruct(layer_defs, layer_count)
+    assert unpack_layer_defs_compiled(layer_defs, layer_count) == expected_layer_defs
+    layer_table = unpack_layer_table(layer_defs, layer_count)
+    assert [layer_def.image_offset for layer_def in expected_layer_defs] == list(
+        layer_table.image_offset
+    )
+
+    header_data = data[: CTBHeader.get_size()]
+    number = 10000
+    print(f"header ({len(header_data)} bytes):")
+    report(
+        "  typedstruct",
+        lambda: unpack_with_typedstruct(CTBHeader, header_data),
+        number,
+    )
+    report("  compiled", lambda: CTBHeader.unpack(header_data), number)
+
+    number = 100
+    print(f"layer definitions one by one ({layer_count} layers):")
+    report(
+        "  typedstruct",
+        lambda: unpack_layer_defs_with_typedstruct(layer_defs, layer_count),
+        number,
+    )
+    report(
+        "  compiled",
+        lambda: unpack_layer_defs_compiled(layer_defs, layer_count),
+        number,
+    )
+    print(f"layer table ({layer_count} layers):")
+    report(
+        "  compiled, by column",
+        lambda: unpack_layer_table(layer_defs, layer_count),
+        number,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,10 @@ export interface CommandAPIResponse {
   success: boolean;
 }
 
+export interface UploadFileAPIResponse extends CommandAPIResponse {
+  duplicates: Array<string>;
+}
+
 export interface PrintStatusAPIResponse {
   state: string;
   selected_file: string;
@@ -15,6 +19,7 @@ export interface PrintStatusAPIResponse {
   layer_count?: number;
   print_time_secs?: number;
   time_left_secs?: number;
+  resin_used_percent?: number;
 }
 
 export interface DirectoryAPIResponse {
@@ -26,11 +31,43 @@ export interface FileAPIResponse {
   path: string;
   print_time_secs?: number;
   can_be_printed: boolean;
+  pending?: boolean;
 }
 
 export interface FileListAPIResponse {
   directories: [DirectoryAPIResponse];
   files: [FileAPIResponse];
+  next_cursor?: string | null;
+}
+
+export interface SearchFilesParams {
+  printer_name?: string;
+  resolution?: string;
+  name?: string;
+  min_layer_height_mm?: number;
+  max_layer_height_mm?: number;
+  min_print_time_secs?: number;
+  max_print_time_secs?: number;
+  sort_by?: string;
+  order?: "asc" | "desc";
+  cursor?: string;
+  limit?: number;
+}
+
+export interface SearchFilesAPIResponse {
+  files: Array<{
+    filename: string;
+    path: string;
+    mtime_ns: number;
+    size: number;
+    print_time_secs: number;
+    printer_name: string;
+    resolution: [number, number];
+    layer_height_mm: number;
+    layer_count: number;
+    height_mm: number;
+  }>;
+  next_cursor: string | null;
 }
 
 export interface FileDetailsAPIResponse {
@@ -42,6 +79,37 @@ export interface FileDetailsAPIResponse {
   layer_height_mm: number;
   resolution: [number, number];
   print_time_secs: number;
+  integrity: {
+    is_valid: boolean;
+    errors: string[];
+    checked_layer_pixels: boolean;
+  };
+}
+
+export interface FileDetailsErrorAPIResponse {
+  path: string;
+  error: {
+    title: string;
+    description: string;
+  };
+}
+
+export interface BatchFileDetailsAPIResponse {
+  files: Array<FileDetailsAPIResponse | FileDetailsErrorAPIResponse>;
+}
+
+export interface FileOperationResult {
+  path: string;
+  success: boolean;
+  new_path?: string;
+  error?: {
+    title: string;
+    description: string;
+  };
+}
+
+export interface FileOperationsAPIResponse {
+  results: FileOperationResult[];
 }
 
 function isAxiosError(error: Error): error is AxiosError {
@@ -73,6 +141,32 @@ export class API {
     }
   }
 
+  async searchFiles(
+    params: SearchFilesParams
+  ): Promise<SearchFilesAPIResponse | undefined> {
+    try {
+      const response: AxiosResponse<SearchFilesAPIResponse> = await axios.get(
+        "api/files/search",
+        { params }
+      );
+      return response.data;
+    } catch (error) {
+      this._handleError(error);
+    }
+  }
+
+  async batchFileDetails(
+    paths: string[]
+  ): Promise<BatchFileDetailsAPIResponse | undefined> {
+    try {
+      const response: AxiosResponse<BatchFileDetailsAPIResponse> =
+        await axios.post("api/file_details/batch", { filenames: paths });
+      return response.data;
+    } catch (error) {
+      this._handleError(error);
+    }
+  }
+
   async fileDetails(path: string): Promise<FileDetailsAPIResponse | undefined> {
     try {
       const response: AxiosResponse<FileDetailsAPIResponse> = await axios.get(
@@ -88,11 +182,11 @@ export class API {
   async uploadFile(
     file: File,
     progress: (event: ProgressEvent) => void
-  ): Promise<CommandAPIResponse | undefined> {
+  ): Promise<UploadFileAPIResponse | undefined> {
     try {
       const formData = new FormData();
       formData.append("file", file);
-      const response: AxiosResponse<CommandAPIResponse> = await axios.post(
+      const response: AxiosResponse<UploadFileAPIResponse> = await axios.post(
         "api/upload_file",
         formData,
         { onUploadProgress: progress }
@@ -129,6 +223,43 @@ export class API {
     }
   }
 
+  async deleteFiles(
+    paths: string[]
+  ): Promise<FileOperationsAPIResponse | undefined> {
+    try {
+      const response: AxiosResponse<FileOperationsAPIResponse> =
+        await axios.post("api/files/delete", { paths });
+      return response.data;
+    } catch (error) {
+      this._handleError(error);
+    }
+  }
+
+  async moveFiles(
+    paths: string[],
+    destination: string
+  ): Promise<FileOperationsAPIResponse | undefined> {
+    try {
+      const response: AxiosResponse<FileOperationsAPIResponse> =
+        await axios.post("api/files/move", { paths, destination });
+      return response.data;
+    } catch (error) {
+      this._handleError(error);
+    }
+  }
+
+  async renameFiles(
+    renames: Array<{ path: string; name: string }>
+  ): Promise<FileOperationsAPIResponse | undefined> {
+    try {
+      const response: AxiosResponse<FileOperationsAPIResponse> =
+        await axios.post("api/files/rename", { renames });
+      return response.data;
+    } catch (error) {
+      this._handleError(error);
+    }
+  }
+
   async cancelPrint(): Promise<CommandAPIResponse | undefined> {
     try {
       const response: AxiosResponse<CommandAPIResponse> = await axios.post(
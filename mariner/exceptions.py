@@ -20,3 +20,69 @@ class UnexpectedPrinterResponse(MarinerException):
 
     def get_description(self) -> str:
         return f"The printer returned an unexpected response: {repr(self.response)}"
+
+
+class UnsupportedLayerEncoding(MarinerException):
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+
+    def get_title(self) -> str:
+        return "Unsupported Layer Encoding"
+
+    def get_description(self) -> str:
+        return f"The layer images of {self.filename} can't be decoded yet."
+
+
+class UnsupportedFileFormat(MarinerException):
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+
+    def get_title(self) -> str:
+        return "Unsupported File Format"
+
+    def get_description(self) -> str:
+        return f"{self.filename} is not a sliced model file that can be printed."
+
+
+class ReadOnlyFileFormat(MarinerException):
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+
+    def get_title(self) -> str:
+        return "Read-Only File Format"
+
+    def get_description(self) -> str:
+        return f"The print settings of {self.filename} can't be changed."
+
+
+class InvalidPath(MarinerException):
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_title(self) -> str:
+        return "Invalid Path"
+
+    def get_description(self) -> str:
+        return f"{self.path} is not a valid path under the files directory."
+
+
+class PathNotFound(MarinerException):
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_title(self) -> str:
+        return "File Not Found"
+
+    def get_description(self) -> str:
+        return f"{self.path} doesn't exist."
+
+
+class PathAlreadyExists(MarinerException):
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_title(self) -> str:
+        return "File Already Exists"
+
+    def get_description(self) -> str:
+        return f"{self.path} already exists, and won't be overwritten."
@@ -1,13 +1,35 @@
+import io
+import math
+import mmap
 import pathlib
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Sequence, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from itertools import accumulate, compress, count
+from typing import (
+    BinaryIO,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
 import png
 
+from mariner.file_formats.structs import LittleEndianStruct
+
 
 @dataclass(frozen=True)
-class SlicedModelFile(ABC):
+class SlicedModelFileSummary:
     filename: str
     bed_size_mm: Tuple[float, float, float]
     height_mm: float
@@ -15,16 +37,716 @@ class SlicedModelFile(ABC):
     layer_count: int
     resolution: Tuple[int, int]
     print_time_secs: int
+    printer_name: str
+
+
+@dataclass(frozen=True)
+class LayerTable:
+    layer_height_mm: Sequence[float]
+    layer_exposure: Sequence[float]
+    layer_off_time: Sequence[float]
+    image_offset: Sequence[int]
+    image_length: Sequence[int]
+
+    def get_end_byte_offsets(self) -> List[int]:
+        return [
+            offset + length
+            for (offset, length) in zip(self.image_offset, self.image_length)
+        ]
+
+
+@dataclass(frozen=True)
+class LayerImage:
+    width: int
+    height: int
+    # one 8-bit grayscale value per pixel, row by row
+    pixels: bytearray
+
+    def iter_rows(self) -> Iterator[memoryview]:
+        pixels = memoryview(self.pixels)
+        for start in range(0, self.width * self.height, self.width):
+            end = start + self.width
+            yield pixels[start:end]
+
+    def to_png(self) -> png.Image:
+        return png.from_array(
+            self.iter_rows(), "L", info={"width": self.width, "height": self.height}
+        )
+
+
+@dataclass(frozen=True)
+class LayerArea:
+    lit_pixel_count: int
+    # anti-aliased pixels only count partially towards the area
+    area_px: float
+    # (min_x, min_y, max_x, max_y) of the lit pixels, all inclusive
+    bounding_box: Optional[Tuple[int, int, int, int]]
+
+
+@dataclass(frozen=True)
+class LayerAreaTable:
+    """
+    The area covered by every layer, stored column by column. Empty layers have
+    a bounding box of -1 in every column.
+    """
+
+    pixel_area_mm2: float
+    lit_pixel_count: Sequence[int]
+    area_px: Sequence[float]
+    volume_mm3: Sequence[float]
+    min_x: Sequence[int]
+    min_y: Sequence[int]
+    max_x: Sequence[int]
+    max_y: Sequence[int]
+
+    def get_area_mm2(self, layer: int) -> float:
+        return self.area_px[layer] * self.pixel_area_mm2
+
+    def get_total_volume_ml(self) -> float:
+        return sum(self.volume_mm3) / 1000.0
+
+    def get_used_volume_fraction(self, printed_layer_count: int) -> float:
+        total_volume_mm3 = sum(self.volume_mm3)
+        if total_volume_mm3 == 0.0:
+            return 0.0
+        return sum(self.volume_mm3[:printed_layer_count]) / total_volume_mm3
+
+
+def build_layer_area_table(
+    summary: SlicedModelFileSummary,
+    layer_table: LayerTable,
+    layer_areas: Iterable[LayerArea],
+) -> LayerAreaTable:
+    (bed_size_x_mm, bed_size_y_mm, _) = summary.bed_size_mm
+    (resolution_x, resolution_y) = summary.resolution
+    pixel_area_mm2 = (bed_size_x_mm / max(1, resolution_x)) * (
+        bed_size_y_mm / max(1, resolution_y)
+    )
+    lit_pixel_count: List[int] = []
+    area_px: List[float] = []
+    volume_mm3: List[float] = []
+    bounding_boxes: List[Tuple[int, int, int, int]] = []
+    previous_height_mm = 0.0
+    for (layer_area, height_mm) in zip(layer_areas, layer_table.layer_height_mm):
+        # the layer table stores the height of the top of every layer
+        thickness_mm = max(0.0, height_mm - previous_height_mm)
+        previous_height_mm = height_mm
+        lit_pixel_count.append(layer_area.lit_pixel_count)
+        area_px.append(layer_area.area_px)
+        volume_mm3.append(layer_area.area_px * pixel_area_mm2 * thickness_mm)
+        bounding_boxes.append(layer_area.bounding_box or (-1, -1, -1, -1))
+    return LayerAreaTable(
+        pixel_area_mm2=pixel_area_mm2,
+        lit_pixel_count=tuple(lit_pixel_count),
+        area_px=tuple(area_px),
+        volume_mm3=tuple(volume_mm3),
+        min_x=tuple(bounding_box[0] for bounding_box in bounding_boxes),
+        min_y=tuple(bounding_box[1] for bounding_box in bounding_boxes),
+        max_x=tuple(bounding_box[2] for bounding_box in bounding_boxes),
+        max_y=tuple(bounding_box[3] for bounding_box in bounding_boxes),
+    )
+
+
+@dataclass(frozen=True)
+class MotionProfile:
+    bottom_layer_count: int
+    bottom_lift_height_mm: float
+    bottom_lift_speed_mm_per_min: float
+    lift_height_mm: float
+    lift_speed_mm_per_min: float
+    retract_speed_mm_per_min: float
+    bottom_light_off_time_secs: float
+    light_off_time_secs: float
+    # some formats store the moves of every layer as well, which win over the
+    # values above wherever they aren't 0
+    layer_lift_height_mm: Sequence[float] = ()
+    layer_lift_speed_mm_per_min: Sequence[float] = ()
+    layer_retract_speed_mm_per_min: Sequence[float] = ()
+
+
+def read_param_motion_profile(
+    file: BinaryIO,
+    param_offset: int,
+    param_size: int,
+    param_struct: Type[LittleEndianStruct],
+    bottom_layer_count: int,
+    light_off_time_secs: float,
+) -> MotionProfile:
+    """
+    Reads the motion profile from the print parameters that .ctb, .cbddlp and
+    .photon files store in the same layout, falling back to the bottom layer
+    count and light off time of the header when the file has none.
+    """
+    if param_offset == 0 or param_size < param_struct.get_size():
+        # without print parameters, all we know is how many bottom layers there
+        # are and how long the light stays off
+        return MotionProfile(
+            bottom_layer_count=bottom_layer_count,
+            bottom_lift_height_mm=0.0,
+            bottom_lift_speed_mm_per_min=0.0,
+            lift_height_mm=0.0,
+            lift_speed_mm_per_min=0.0,
+            retract_speed_mm_per_min=0.0,
+            bottom_light_off_time_secs=light_off_time_secs,
+            light_off_time_secs=light_off_time_secs,
+        )
+
+    file.seek(param_offset)
+    param = param_struct.unpack(file.read(param_struct.get_size()))
+    return MotionProfile(
+        bottom_layer_count=getattr(param, "bottom_layer_count"),
+        bottom_lift_height_mm=getattr(param, "bottom_lift_height"),
+        bottom_lift_speed_mm_per_min=getattr(param, "bottom_lift_speed"),
+        lift_height_mm=getattr(param, "lift_height"),
+        lift_speed_mm_per_min=getattr(param, "lift_speed"),
+        retract_speed_mm_per_min=getattr(param, "retract_speed"),
+        bottom_light_off_time_secs=getattr(param, "bottom_lift_off_time"),
+        light_off_time_secs=getattr(param, "light_off_time"),
+    )
+
+
+@dataclass(frozen=True)
+class PrintTimeline:
+    """
+    How long every step of printing each layer takes, stored column by column.
+    The build plate is lifted out of the vat and retracted back down after every
+    layer is exposed, and the light stays off for a while before the next one.
+    """
+
+    exposure_secs: Sequence[float]
+    light_off_secs: Sequence[float]
+    lift_secs: Sequence[float]
+    retract_secs: Sequence[float]
+    # seconds since the start of the print at which every layer is done
+    layer_end_secs: Sequence[float]
+
+    def get_total_secs(self) -> float:
+        return self.layer_end_secs[-1] if self.layer_end_secs else 0.0
+
+    def get_time_left_secs(self, printed_layer_count: int) -> float:
+        if printed_layer_count <= 0:
+            return self.get_total_secs()
+        printed_layer_count = min(printed_layer_count, len(self.layer_end_secs))
+        return self.get_total_secs() - self.layer_end_secs[printed_layer_count - 1]
+
+
+def _get_move_secs(distance_mm: float, speed_mm_per_min: float) -> float:
+    if speed_mm_per_min <= 0.0:
+        return 0.0
+    return 60.0 * distance_mm / speed_mm_per_min
+
+
+def build_print_timeline(
+    motion_profile: MotionProfile, layer_table: LayerTable
+) -> PrintTimeline:
+    layer_count = len(layer_table.layer_exposure)
+    bottom_layer_count = max(0, min(layer_count, motion_profile.bottom_layer_count))
+    layer_counts = (bottom_layer_count, layer_count - bottom_layer_count)
+
+    # the motion is the same for every bottom layer and for every other layer,
+    # so the columns are built by repeating two values instead of layer by layer
+    def repeat(bottom_value: float, value: float) -> List[float]:
+        return [bottom_value] * layer_counts[0] + [value] * layer_counts[1]
+
+    # layers without a value of their own use the one of the profile
+    def override(column: List[float], layer_values: Sequence[float]) -> List[float]:
+        if not layer_values:
+            return column
+        return [
+            layer_value or value for (layer_value, value) in zip(layer_values, column)
+        ]
+
+    lift_height_mm = override(
+        repeat(motion_profile.bottom_lift_height_mm, motion_profile.lift_height_mm),
+        motion_profile.layer_lift_height_mm,
+    )
+    lift_speed_mm_per_min = override(
+        repeat(
+            motion_profile.bottom_lift_speed_mm_per_min,
+            motion_profile.lift_speed_mm_per_min,
+        ),
+        motion_profile.layer_lift_speed_mm_per_min,
+    )
+    retract_speed_mm_per_min = override(
+        [motion_profile.retract_speed_mm_per_min] * layer_count,
+        motion_profile.layer_retract_speed_mm_per_min,
+    )
+    # the plate is retracted by as much as it was lifted
+    lift_secs = list(map(_get_move_secs, lift_height_mm, lift_speed_mm_per_min))
+    retract_secs = list(map(_get_move_secs, lift_height_mm, retract_speed_mm_per_min))
+    light_off_secs = override(
+        repeat(
+            motion_profile.bottom_light_off_time_secs,
+            motion_profile.light_off_time_secs,
+        ),
+        layer_table.layer_off_time,
+    )
+    exposure_secs = tuple(layer_table.layer_exposure)
+    layer_secs = map(sum, zip(exposure_secs, light_off_secs, lift_secs, retract_secs))
+    return PrintTimeline(
+        exposure_secs=exposure_secs,
+        light_off_secs=tuple(light_off_secs),
+        lift_secs=tuple(lift_secs),
+        retract_secs=tuple(retract_secs),
+        layer_end_secs=tuple(accumulate(layer_secs)),
+    )
+
+
+@dataclass(frozen=True)
+class PrintSettingsPatch:
+    """
+    New values for the print settings of a file, with None keeping the current
+    value. The settings of every layer are changed along with the defaults in
+    the header, unless layer_range is given, in which case only the layers in
+    [first, last) are changed. Only the exposure and light off time can be
+    changed for a range of layers.
+    """
+
+    exposure_secs: Optional[float] = None
+    bottom_exposure_secs: Optional[float] = None
+    light_off_time_secs: Optional[float] = None
+    bottom_light_off_time_secs: Optional[float] = None
+    lift_height_mm: Optional[float] = None
+    lift_speed_mm_per_min: Optional[float] = None
+    bottom_lift_height_mm: Optional[float] = None
+    bottom_lift_speed_mm_per_min: Optional[float] = None
+    retract_speed_mm_per_min: Optional[float] = None
+    layer_range: Optional[Tuple[int, int]] = None
+
+
+def _patch_layer_table_column(
+    file: BinaryIO,
+    layer_defs_offset: int,
+    layer_def: Type[LittleEndianStruct],
+    layers: range,
+    field_name: str,
+    value: float,
+) -> None:
+    # the layer definitions are read and written back as a single block, with
+    # the field of every layer replaced through strided slice assignments
+    # rather than layer by layer
+    if not layers:
+        return
+    layer_def_size = layer_def.get_size()
+    start = layer_defs_offset + layers.start * layer_def_size
+    file.seek(start)
+    block = bytearray(file.read(len(layers) * layer_def_size))
+    packed_value = layer_def.pack_field(field_name, value)
+    field_offset = layer_def.get_field_offset(field_name)
+    for (index, byte) in enumerate(packed_value, field_offset):
+        block[index::layer_def_size] = bytes([byte]) * len(layers)
+    file.seek(start)
+    file.write(block)
+
+
+# the settings that every layer may have a value of its own for, each along with
+# the setting that applies to the bottom layers instead
+_LAYER_SETTINGS: Dict[str, str] = {
+    "exposure_secs": "bottom_exposure_secs",
+    "light_off_time_secs": "bottom_light_off_time_secs",
+    "lift_height_mm": "bottom_lift_height_mm",
+    "lift_speed_mm_per_min": "bottom_lift_speed_mm_per_min",
+    "retract_speed_mm_per_min": "retract_speed_mm_per_min",
+}
+# the settings that layer tables have a column for
+_LAYER_TABLE_FIELDS: Dict[str, str] = {
+    "exposure_secs": "layer_exposure",
+    "light_off_time_secs": "layer_off_time",
+}
+
+
+def get_layer_setting_patches(
+    patch: PrintSettingsPatch, layer_count: int, bottom_layer_count: int
+) -> List[Tuple[range, str, float]]:
+    """
+    Works out which layers get which new value, as (layers, setting, value)
+    tuples where setting names the value of the layers that aren't bottom
+    layers. Raises IndexError for layer ranges out of bounds, and ValueError
+    for layer ranges along with settings that only the header has.
+    """
+    layer_range = patch.layer_range
+    if layer_range is not None:
+        (first_layer, last_layer) = layer_range
+        if first_layer < 0 or last_layer > layer_count or first_layer > last_layer:
+            raise IndexError(
+                f"Invalid layer range [{first_layer}, {last_layer}) "
+                + f"({layer_count} layers)"
+            )
+        # layer tables only have a column for some of the settings
+        range_settings = {"layer_range"}
+        for setting in _LAYER_TABLE_FIELDS:
+            range_settings |= {setting, _LAYER_SETTINGS[setting]}
+        header_settings = [
+            field.name
+            for field in fields(patch)
+            if field.name not in range_settings
+            and getattr(patch, field.name) is not None
+        ]
+        if header_settings:
+            raise ValueError(
+                "These settings can't be changed for a range of layers: "
+                + ", ".join(header_settings)
+            )
+    else:
+        (first_layer, last_layer) = (0, layer_count)
+
+    bottom_layer_count = max(0, min(layer_count, bottom_layer_count))
+    bottom_layers = range(first_layer, min(last_layer, bottom_layer_count))
+    layers = range(max(first_layer, bottom_layer_count), last_layer)
+    setting_patches = []
+    for (setting, bottom_setting) in _LAYER_SETTINGS.items():
+        for (setting_layers, value) in [
+            (bottom_layers, getattr(patch, bottom_setting)),
+            (layers, getattr(patch, setting)),
+        ]:
+            if value is not None and setting_layers:
+                setting_patches.append((setting_layers, setting, value))
+    return setting_patches
+
+
+def patch_struct_field(
+    file: BinaryIO,
+    struct_offset: int,
+    struct_type: Type[LittleEndianStruct],
+    field_name: str,
+    value: float,
+) -> None:
+    file.seek(struct_offset + struct_type.get_field_offset(field_name))
+    file.write(struct_type.pack_field(field_name, value))
+
+
+def patch_print_settings_in_place(
+    file: BinaryIO,
+    patch: PrintSettingsPatch,
+    structs: Sequence[Tuple[int, Type[LittleEndianStruct], Mapping[str, str]]],
+    layer_defs_offsets: Sequence[int],
+    layer_def: Type[LittleEndianStruct],
+    layer_count: int,
+    bottom_layer_count: int,
+) -> None:
+    """
+    Overwrites the fields that hold the patched settings, and nothing else.
+    Every struct is given as its offset, its type and a map from the names of
+    the PrintSettingsPatch fields to the names of its own fields. The layer
+    table is repeated at every offset in layer_defs_offsets.
+    """
+    setting_patches = get_layer_setting_patches(patch, layer_count, bottom_layer_count)
+    if patch.layer_range is None:
+        for (struct_offset, struct_type, field_names) in structs:
+            for (setting, field_name) in field_names.items():
+                value = getattr(patch, setting)
+                if value is not None:
+                    patch_struct_field(
+                        file, struct_offset, struct_type, field_name, value
+                    )
+
+    for (layers, setting, value) in setting_patches:
+        if setting not in _LAYER_TABLE_FIELDS:
+            continue
+        for layer_defs_offset in layer_defs_offsets:
+            _patch_layer_table_column(
+                file,
+                layer_defs_offset,
+                layer_def,
+                layers,
+                _LAYER_TABLE_FIELDS[setting],
+                value,
+            )
+
+
+@dataclass(frozen=True)
+class IntegrityReport:
+    # everything found to be wrong with the file, in a human readable form
+    errors: Sequence[str]
+    # whether the runs of every layer were counted, rather than only checking
+    # that every layer lies within the file
+    checked_layer_pixels: bool
+
+    def is_valid(self) -> bool:
+        return len(self.errors) == 0
+
+
+def check_summary(summary: SlicedModelFileSummary) -> List[str]:
+    errors = []
+    (resolution_x, resolution_y) = summary.resolution
+    if resolution_x <= 0 or resolution_y <= 0:
+        errors.append(f"Invalid resolution {resolution_x}x{resolution_y}")
+    if summary.layer_count <= 0:
+        errors.append("The file has no layers")
+    if not math.isfinite(summary.layer_height_mm) or summary.layer_height_mm <= 0:
+        errors.append(f"Invalid layer height {summary.layer_height_mm} mm")
+    return errors
+
+
+def check_byte_range(
+    description: str, offset: int, length: int, file_size: int
+) -> List[str]:
+    end = offset + length
+    if offset < 0 or length < 0 or end > file_size:
+        return [
+            f"The {description} at [{offset}, {end}) is past the end of the file "
+            + f"({file_size} bytes)"
+        ]
+    return []
+
+
+def check_layer_table_bounds(layer_table: LayerTable, file_size: int) -> List[str]:
+    # the comparison is mapped over the whole column at once, and only the
+    # truncated layers ever make it to Python code
+    truncated_layers = list(
+        compress(count(), map(file_size.__lt__, layer_table.get_end_byte_offsets()))
+    )
+    if not truncated_layers:
+        return []
+    return [
+        f"{len(truncated_layers)} layers end past the end of the file "
+        + f"({file_size} bytes), starting with layer {truncated_layers[0]}"
+    ]
+
+
+def check_file_bounds(
+    file: BinaryIO,
+    file_size: int,
+    preview_offsets: Mapping[str, int],
+    preview_struct: Type[LittleEndianStruct],
+    layer_defs_offsets: Sequence[int],
+    layer_count: int,
+    layer_def: Type[LittleEndianStruct],
+) -> List[str]:
+    """
+    Checks that the previews and every layer of the given layer tables lie
+    within the file. Previews are described by a struct with image_offset and
+    image_length fields, at the offsets given by their description.
+    """
+    errors = []
+    for (description, preview_offset) in preview_offsets.items():
+        preview_size = preview_struct.get_size()
+        preview_errors = check_byte_range(
+            f"{description} header", preview_offset, preview_size, file_size
+        )
+        if not preview_errors:
+            file.seek(preview_offset)
+            preview = dict(
+                zip(
+                    preview_struct.get_field_names(),
+                    preview_struct.get_codec().unpack(file.read(preview_size)),
+                )
+            )
+            preview_errors = check_byte_range(
+                description,
+                preview["image_offset"],
+                preview["image_length"],
+                file_size,
+            )
+        errors += preview_errors
+
+    for layer_defs_offset in layer_defs_offsets:
+        layer_defs_size = layer_count * layer_def.get_size()
+        table_errors = check_byte_range(
+            "layer table", layer_defs_offset, layer_defs_size, file_size
+        )
+        if not table_errors:
+            layer_table = unpack_layer_table(
+                file, layer_defs_offset, layer_count, layer_def
+            )
+            table_errors = check_layer_table_bounds(layer_table, file_size)
+        errors += table_errors
+    return errors
+
+
+def check_layer_pixel_counts(
+    summary: SlicedModelFileSummary,
+    count_layer_pixels: Callable[[int], Sequence[int]],
+) -> List[str]:
+    """
+    Checks that the runs of every layer add up to exactly one pixel per pixel of
+    the screen, given the number of pixels in every plane of each layer.
+    """
+    (resolution_x, resolution_y) = summary.resolution
+    expected_pixel_count = resolution_x * resolution_y
+    invalid_layers: List[int] = []
+    first_error = ""
+    for layer in range(summary.layer_count):
+        try:
+            pixel_counts = count_layer_pixels(layer)
+            error = next(
+                (
+                    f"{pixel_count} pixels instead of {expected_pixel_count}"
+                    for pixel_count in pixel_counts
+                    if pixel_count != expected_pixel_count
+                ),
+                None,
+            )
+        except ValueError as exception:
+            error = str(exception)
+        if error is None:
+            continue
+        if not invalid_layers:
+            first_error = f"layer {layer}: {error}"
+        invalid_layers.append(layer)
+    if not invalid_layers:
+        return []
+    return [
+        f"{len(invalid_layers)} layers have invalid runs, starting with "
+        + first_error
+    ]
+
+
+# the contents of a file, either mapped into memory or read into it
+FileBuffer = Union[bytes, mmap.mmap]
+
+
+@contextmanager
+def map_file(path: pathlib.Path) -> Iterator[FileBuffer]:
+    """
+    Maps a whole file read-only into memory, so that reading its layers takes no
+    system calls and every process reading the same file shares its pages.
+    Slicing the mapping copies just the slice, and structs are unpacked straight
+    from it. Empty files, and file objects that aren't backed by the operating
+    system, like the fake ones of the tests, are read into memory instead. The
+    mapping must not be used after the block ends, and the file must not be
+    truncated while it's mapped.
+    """
+    with open(str(path), "rb") as file:
+        mapping = None
+        if isinstance(file, io.BufferedReader):
+            try:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # files can't be mapped when they're empty
+                pass
+        if mapping is None:
+            yield file.read()
+            return
+        with mapping:
+            yield mapping
+
+
+def unpack_layer_table_from(
+    buffer: FileBuffer,
+    offset: int,
+    layer_count: int,
+    layer_def: Type[LittleEndianStruct],
+) -> LayerTable:
+    end = offset + layer_count * layer_def.get_size()
+    rows = layer_def.get_codec().iter_unpack(buffer[offset:end])
+    columns = dict(zip(layer_def.get_field_names(), zip(*rows)))
+    return LayerTable(
+        layer_height_mm=columns.get("layer_height_mm", ()),
+        layer_exposure=columns.get("layer_exposure", ()),
+        layer_off_time=columns.get("layer_off_time", ()),
+        image_offset=columns.get("image_offset", ()),
+        image_length=columns.get("image_length", ()),
+    )
+
+
+def unpack_layer_table(
+    file: BinaryIO, offset: int, layer_count: int, layer_def: Type[LittleEndianStruct]
+) -> LayerTable:
+    # all layer definitions are stored back to back, so we read the whole table
+    # at once and decode it column by column instead of seeking to every layer
+    file.seek(offset)
+    data = file.read(layer_count * layer_def.get_size())
+    return unpack_layer_table_from(data, 0, layer_count, layer_def)
+
+
+@dataclass(frozen=True)
+class SlicedModelFile(SlicedModelFileSummary, ABC):
+    # the values of the 32-bit little endian magic number at the start of files
+    # in this format, which is how we tell formats apart
+    MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset()
+
     end_byte_offset_by_layer: Sequence[int]
     slicer_version: str
-    printer_name: str
 
     @classmethod
     @abstractmethod
     def read(self, path: pathlib.Path) -> "SlicedModelFile":
         ...
 
+    @classmethod
+    @abstractmethod
+    def read_summary(cls, path: pathlib.Path) -> SlicedModelFileSummary:
+        """
+        Reads only the fixed-size header of the file and the printer name it
+        points to, which is enough for listing and indexing files but doesn't
+        include anything about individual layers.
+        """
+        ...
+
+    @classmethod
+    @abstractmethod
+    def read_layer_table(cls, path: pathlib.Path) -> LayerTable:
+        ...
+
     @classmethod
     @abstractmethod
     def read_preview(cls, path: pathlib.Path) -> png.Image:
         ...
+
+    @classmethod
+    @abstractmethod
+    def read_thumbnail(cls, path: pathlib.Path) -> png.Image:
+        """
+        Reads the small preview embedded in the file, which is much cheaper to
+        decode and transfer than the full preview.
+        """
+        ...
+
+    @classmethod
+    @abstractmethod
+    def read_layer_area_table(cls, path: pathlib.Path) -> LayerAreaTable:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def read_layer_image(cls, path: pathlib.Path, layer: int) -> LayerImage:
+        """
+        Decodes the image projected for the given (zero-based) layer. Raises
+        IndexError if the file has no such layer.
+        """
+        ...
+
+    @classmethod
+    @abstractmethod
+    def read_motion_profile(cls, path: pathlib.Path) -> MotionProfile:
+        ...
+
+    @classmethod
+    def simulate_print(cls, path: pathlib.Path) -> PrintTimeline:
+        """
+        Works out how long every layer takes to print from its exposure and the
+        moves of the build plate, which is more accurate than the estimate the
+        slicer stores in the header.
+        """
+        return build_print_timeline(
+            cls.read_motion_profile(path), cls.read_layer_table(path)
+        )
+
+    @classmethod
+    @abstractmethod
+    def patch_print_settings(
+        cls, path: pathlib.Path, patch: PrintSettingsPatch
+    ) -> None:
+        """
+        Changes print settings by overwriting their fields in place, so only a
+        few bytes of the file are rewritten. The print time in the header is
+        replaced with the simulated one, since it depends on the settings and
+        is what gets shown for the file. Raises IndexError for layer ranges
+        out of bounds, and ValueError for layer ranges along with settings that
+        can't be changed for a range of layers.
+        """
+        ...
+
+    @classmethod
+    @abstractmethod
+    def validate(
+        cls, path: pathlib.Path, check_layer_pixels: bool = False
+    ) -> IntegrityReport:
+        """
+        Checks that the header makes sense and that the previews and every
+        layer lie within the file, which catches truncated uploads that would
+        otherwise only fail once the printer reaches the missing layers. With
+        check_layer_pixels, the runs of every layer are counted as well.
+        """
+        ...
@@ -0,0 +1,331 @@
+import os
+import pathlib
+import re
+import zipfile
+import zlib
+from dataclasses import asdict, dataclass
+from typing import ClassVar, Dict, FrozenSet, List, Pattern
+
+import png
+
+from mariner.exceptions import ReadOnlyFileFormat, UnsupportedFileFormat
+from mariner.file_formats import (
+    IntegrityReport,
+    LayerArea,
+    LayerAreaTable,
+    LayerImage,
+    LayerTable,
+    MotionProfile,
+    PrintSettingsPatch,
+    SlicedModelFile,
+    SlicedModelFileSummary,
+    build_layer_area_table,
+    check_layer_pixel_counts,
+    check_layer_table_bounds,
+    check_summary,
+)
+from mariner.file_formats.rle import get_grayscale_layer_area
+
+
+# zip jobs, as exported by ChiTuBox and Lychee, hold the print settings in the
+# header comments of run.gcode and every layer as a separate PNG image
+ZIP_MAGIC: int = 0x04034B50
+
+_GCODE_FILENAME: str = "run.gcode"
+_PREVIEW_FILENAME: str = "preview.png"
+_THUMBNAIL_FILENAME: str = "preview_cropping.png"
+_LAYER_FILENAME: Pattern[str] = re.compile(r"(\d+)\.png")
+_GCODE_HEADER_END: str = ";START_GCODE_BEGIN"
+# the header comments are at the very start of the gcode, which may well be
+# several megabytes long, so we never read more than this much of it
+_MAX_GCODE_HEADER_SIZE: int = 64 * 1024
+# the fixed-size part of the local file header that precedes every member
+_ZIP_LOCAL_HEADER_SIZE: int = 30
+
+
+def _open_archive(path: pathlib.Path) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(str(path))
+    except zipfile.BadZipFile:
+        # every zip archive starts with the same magic number, including
+        # truncated uploads that are missing their central directory
+        raise UnsupportedFileFormat(path.name)
+
+
+def _read_gcode_header(archive: zipfile.ZipFile, path: pathlib.Path) -> Dict[str, str]:
+    # plain archives that happen to be in the files directory have no gcode, and
+    # corrupt ones fail as soon as we read it
+    try:
+        with archive.open(_GCODE_FILENAME) as gcode:
+            data = gcode.read(_MAX_GCODE_HEADER_SIZE).decode("utf-8", "replace")
+    except (KeyError, zipfile.BadZipFile, zlib.error):
+        raise UnsupportedFileFormat(path.name)
+    header = {}
+    for line in data.splitlines():
+        line = line.strip()
+        if not line.startswith(";") or line == _GCODE_HEADER_END:
+            break
+        (key, separator, value) = line[1:].partition(":")
+        if separator:
+            header[key.strip()] = value.strip()
+    return header
+
+
+def _get_float(header: Dict[str, str], key: str, default: float = 0.0) -> float:
+    try:
+        return float(header[key])
+    except (KeyError, ValueError):
+        return default
+
+
+def _get_int(header: Dict[str, str], key: str, default: int = 0) -> int:
+    return round(_get_float(header, key, default))
+
+
+def _get_layer_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    # layers are numbered from 1 and stored as 1.png, 2.png, ...
+    layer_members = []
+    for member in archive.infolist():
+        match = _LAYER_FILENAME.fullmatch(member.filename)
+        if match is not None:
+            layer_members.append((int(match.group(1)), member))
+    return [member for (_, member) in sorted(layer_members, key=lambda t: t[0])]
+
+
+def _get_summary(
+    path: pathlib.Path, header: Dict[str, str], layer_count: int
+) -> SlicedModelFileSummary:
+    layer_height_mm = _get_float(header, "layerHeight")
+    layer_count = _get_int(header, "totalLayer", layer_count)
+    return SlicedModelFileSummary(
+        filename=path.name,
+        bed_size_mm=(
+            round(_get_float(header, "machineX"), 4),
+            round(_get_float(header, "machineY"), 4),
+            round(_get_float(header, "machineZ"), 4),
+        ),
+        height_mm=round(layer_count * layer_height_mm, 4),
+        layer_height_mm=layer_height_mm,
+        layer_count=layer_count,
+        resolution=(
+            _get_int(header, "resolutionX"),
+            _get_int(header, "resolutionY"),
+        ),
+        print_time_secs=_get_int(header, "estimatedPrintTime"),
+        printer_name=header.get("machineType", ""),
+    )
+
+
+def _get_motion_profile(header: Dict[str, str]) -> MotionProfile:
+    return MotionProfile(
+        bottom_layer_count=_get_int(header, "bottomLayerCount"),
+        bottom_lift_height_mm=_get_float(header, "bottomLayerLiftHeight"),
+        bottom_lift_speed_mm_per_min=_get_float(header, "bottomLayerLiftSpeed"),
+        lift_height_mm=_get_float(header, "normalLayerLiftHeight"),
+        lift_speed_mm_per_min=_get_float(header, "normalLayerLiftSpeed"),
+        retract_speed_mm_per_min=_get_float(header, "normalDropSpeed"),
+        bottom_light_off_time_secs=_get_float(header, "bottomLightOffTime"),
+        light_off_time_secs=_get_float(header, "lightOffTime"),
+    )
+
+
+def _get_layer_table(
+    header: Dict[str, str], layer_members: List[zipfile.ZipInfo]
+) -> LayerTable:
+    """
+    Builds the layer table from the central directory alone, so nothing is
+    extracted. The offset of every layer points to its compressed data, which
+    the central directory doesn't give away directly, so we assume the local
+    header of every member holds the same extra field as the central one.
+    """
+    layer_height_mm = _get_float(header, "layerHeight")
+    bottom_layer_count = _get_int(header, "bottomLayerCount")
+    layer_count = len(layer_members)
+    bottom_count = max(0, min(layer_count, bottom_layer_count))
+    return LayerTable(
+        layer_height_mm=tuple(
+            (layer + 1) * layer_height_mm for layer in range(layer_count)
+        ),
+        layer_exposure=tuple(
+            [_get_float(header, "bottomLayerExposureTime")] * bottom_count
+            + [_get_float(header, "normalExposureTime")] * (layer_count - bottom_count)
+        ),
+        layer_off_time=tuple(
+            [_get_float(header, "bottomLightOffTime")] * bottom_count
+            + [_get_float(header, "lightOffTime")] * (layer_count - bottom_count)
+        ),
+        image_offset=tuple(
+            member.header_offset
+            + _ZIP_LOCAL_HEADER_SIZE
+            + len(member.filename.encode("utf-8"))
+            + len(member.extra)
+            for member in layer_members
+        ),
+        image_length=tuple(member.compress_size for member in layer_members),
+    )
+
+
+def _check_layer_index(
+    path: pathlib.Path, layer_members: List[zipfile.ZipInfo], layer: int
+) -> None:
+    if layer < 0 or layer >= len(layer_members):
+        raise IndexError(
+            f"{path.name} has no layer {layer} ({len(layer_members)} layers)"
+        )
+
+
+def _decode_layer_image(data: bytes) -> LayerImage:
+    (width, height, rows, info) = png.Reader(bytes=data).asDirect()
+    if info["bitdepth"] != 8:
+        (width, height, rows, info) = png.Reader(bytes=data).asRGBA8()
+    # layers are usually stored as grayscale, but some slicers store them as
+    # RGB with the same value in every channel, so we keep the first one
+    planes = info["planes"]
+    pixels = bytearray()
+    for row in rows:
+        pixels += bytes(row[::planes])
+    return LayerImage(width=width, height=height, pixels=pixels)
+
+
+def _read_preview(archive: zipfile.ZipFile, filenames: List[str]) -> png.Image:
+    for filename in filenames:
+        try:
+            data = archive.read(filename)
+        except KeyError:
+            continue
+        # previews may or may not have an alpha channel, which we drop
+        (width, height, rows, _) = png.Reader(bytes=data).asRGBA8()
+        rgb_rows = []
+        for row in rows:
+            rgba = bytes(row)
+            rgb = bytearray(3 * width)
+            for channel in range(3):
+                rgb[channel::3] = rgba[channel::4]
+            rgb_rows.append(rgb)
+        return png.from_array(
+            rgb_rows, "RGB;8", info={"width": width, "height": height}
+        )
+    raise KeyError(f"There is no preview in {archive.filename}")
+
+
+@dataclass(frozen=True)
+class ZIPFile(SlicedModelFile):
+    MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset([ZIP_MAGIC])
+
+    @classmethod
+    def read(self, path: pathlib.Path) -> "ZIPFile":
+        with _open_archive(path) as archive:
+            header = _read_gcode_header(archive, path)
+            layer_members = _get_layer_members(archive)
+            layer_table = _get_layer_table(header, layer_members)
+            return ZIPFile(
+                **asdict(_get_summary(path, header, len(layer_members))),
+                end_byte_offset_by_layer=layer_table.get_end_byte_offsets(),
+                slicer_version=header.get("version", ""),
+            )
+
+    @classmethod
+    def read_summary(cls, path: pathlib.Path) -> SlicedModelFileSummary:
+        with _open_archive(path) as archive:
+            header = _read_gcode_header(archive, path)
+            return _get_summary(path, header, len(_get_layer_members(archive)))
+
+    @classmethod
+    def read_layer_table(cls, path: pathlib.Path) -> LayerTable:
+        with _open_archive(path) as archive:
+            header = _read_gcode_header(archive, path)
+            return _get_layer_table(header, _get_layer_members(archive))
+
+    @classmethod
+    def read_preview(cls, path: pathlib.Path) -> png.Image:
+        with _open_archive(path) as archive:
+            return _read_preview(archive, [_PREVIEW_FILENAME])
+
+    @classmethod
+    def read_thumbnail(cls, path: pathlib.Path) -> png.Image:
+        with _open_archive(path) as archive:
+            return _read_preview(archive, [_THUMBNAIL_FILENAME, _PREVIEW_FILENAME])
+
+    @classmethod
+    def read_layer_image(cls, path: pathlib.Path, layer: int) -> LayerImage:
+        with _open_archive(path) as archive:
+            layer_members = _get_layer_members(archive)
+            _check_layer_index(path, layer_members, layer)
+            return _decode_layer_image(archive.read(layer_members[layer]))
+
+    @classmethod
+    def read_layer_area_table(cls, path: pathlib.Path) -> LayerAreaTable:
+        with _open_archive(path) as archive:
+            header = _read_gcode_header(archive, path)
+            layer_members = _get_layer_members(archive)
+
+            def get_layer_area(member: zipfile.ZipInfo) -> LayerArea:
+                image = _decode_layer_image(archive.read(member))
+                return get_grayscale_layer_area(image.width, image.pixels)
+
+            return build_layer_area_table(
+                _get_summary(path, header, len(layer_members)),
+                _get_layer_table(header, layer_members),
+                map(get_layer_area, layer_members),
+            )
+
+    @classmethod
+    def read_motion_profile(cls, path: pathlib.Path) -> MotionProfile:
+        with _open_archive(path) as archive:
+            return _get_motion_profile(_read_gcode_header(archive, path))
+
+    @classmethod
+    def patch_print_settings(
+        cls, path: pathlib.Path, patch: PrintSettingsPatch
+    ) -> None:
+        # the settings live in compressed gcode, which can't be changed without
+        # rewriting the archive
+        raise ReadOnlyFileFormat(path.name)
+
+    @classmethod
+    def validate(
+        cls, path: pathlib.Path, check_layer_pixels: bool = False
+    ) -> IntegrityReport:
+        file_size = os.path.getsize(path)
+        try:
+            archive = zipfile.ZipFile(str(path))
+        except zipfile.BadZipFile as error:
+            return IntegrityReport(errors=[str(error)], checked_layer_pixels=False)
+        with archive:
+            try:
+                header = _read_gcode_header(archive, path)
+            except UnsupportedFileFormat:
+                return IntegrityReport(
+                    errors=[f"{_GCODE_FILENAME} is missing or can't be read"],
+                    checked_layer_pixels=False,
+                )
+            layer_members = _get_layer_members(archive)
+            summary = _get_summary(path, header, len(layer_members))
+            errors = check_summary(summary)
+            if len(layer_members) != summary.layer_count:
+                errors.append(
+                    f"The file has {len(layer_members)} layer images instead of "
+                    + f"{summary.layer_count}"
+                )
+            errors += check_layer_table_bounds(
+                _get_layer_table(header, layer_members), file_size
+            )
+            if not check_layer_pixels or errors:
+                return IntegrityReport(errors=errors, checked_layer_pixels=False)
+
+            def count_layer_pixels(layer: int) -> List[int]:
+                # reading a member checks its CRC, and decoding the image
+                # checks the PNG itself
+                try:
+                    image = _decode_layer_image(archive.read(layer_members[layer]))
+                except (zipfile.BadZipFile, png.Error) as error:
+                    raise ValueError(str(error))
+                if (image.width, image.height) != summary.resolution:
+                    raise ValueError(
+                        f"{image.width}x{image.height} image instead of "
+                        + "{}x{}".format(*summary.resolution)
+                    )
+                return [len(image.pixels)]
+
+            errors += check_layer_pixel_counts(summary, count_layer_pixels)
+            return IntegrityReport(errors=errors, checked_layer_pixels=True)
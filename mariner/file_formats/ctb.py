@@ -1,14 +1,63 @@
+import os
 import pathlib
 import struct
-from dataclasses import dataclass
-from typing import List
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import (
+    BinaryIO,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import png
-from typedstruct import LittleEndianStruct, StructType
-
-from mariner.file_formats import SlicedModelFile
-
-
+from typedstruct import StructType
+
+from mariner.exceptions import UnsupportedLayerEncoding
+from mariner.file_formats import (
+    FileBuffer,
+    IntegrityReport,
+    LayerArea,
+    LayerAreaTable,
+    LayerImage,
+    LayerTable,
+    MotionProfile,
+    PrintSettingsPatch,
+    SlicedModelFile,
+    SlicedModelFileSummary,
+    build_layer_area_table,
+    check_file_bounds,
+    check_layer_pixel_counts,
+    check_summary,
+    get_layer_setting_patches,
+    map_file,
+    patch_print_settings_in_place,
+    patch_struct_field,
+    read_param_motion_profile,
+    unpack_layer_table,
+    unpack_layer_table_from,
+)
+from mariner.file_formats.rle import (
+    count_bit_plane_pixels,
+    count_rle7_pixels,
+    decode_bit_planes,
+    decode_rle7_layer,
+    get_bit_plane_layer_area,
+    get_rle7_layer_area,
+    read_rgb15_image,
+)
+from mariner.file_formats.structs import LittleEndianStruct, compiled_struct
+
+
+CTB_MAGIC: int = 0x12FD0086
+CBDDLP_MAGIC: int = 0x12FD0019
+
+
+@compiled_struct
 @dataclass(frozen=True)
 class CTBHeader(LittleEndianStruct):
     magic: int = StructType.uint32()
@@ -42,6 +91,7 @@ class CTBHeader(LittleEndianStruct):
     slicer_size: int = StructType.uint32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class CTBParam(LittleEndianStruct):
     bottom_lift_height: float = StructType.float32()  # 00:
@@ -61,6 +111,7 @@ class CTBParam(LittleEndianStruct):
     unknown_04: int = StructType.uint32()  # 38:
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class CTBSlicer(LittleEndianStruct):
     skip_0: int = StructType.uint32()
@@ -73,7 +124,7 @@ class CTBSlicer(LittleEndianStruct):
     machine_offset: int = StructType.uint32()
     machine_size: int = StructType.uint32()
     encryption_mode: int = StructType.uint32()
-    time_seconds: int = StructType.uint32()
+    modified_timestamp_minutes: int = StructType.uint32()
     unknown_01: int = StructType.uint32()
     version_patch: int = StructType.unsigned_char()
     version_minor: int = StructType.unsigned_char()
@@ -87,6 +138,7 @@ class CTBSlicer(LittleEndianStruct):
     unknown_07: float = StructType.float32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class CTBLayerDef(LittleEndianStruct):
     layer_height_mm: float = StructType.float32()
@@ -100,6 +152,26 @@ class CTBLayerDef(LittleEndianStruct):
     unknown_03: int = StructType.uint32()
 
 
+@compiled_struct
+@dataclass(frozen=True)
+class CTBLayerDefEx(CTBLayerDef):
+    # starting with version 3, every layer image is preceded by a copy of its
+    # layer definition followed by the moves of the build plate for the layer
+    total_size: int = StructType.uint32()
+    lift_height: float = StructType.float32()
+    lift_speed: float = StructType.float32()
+    lift_height2: float = StructType.float32()
+    lift_speed2: float = StructType.float32()
+    retract_speed: float = StructType.float32()
+    retract_height2: float = StructType.float32()
+    retract_speed2: float = StructType.float32()
+    rest_before_lift: float = StructType.float32()
+    rest_after_lift: float = StructType.float32()
+    rest_after_retract: float = StructType.float32()
+    light_pwm: float = StructType.float32()
+
+
+@compiled_struct
 @dataclass(frozen=True)
 class CTBPreview(LittleEndianStruct):
     resolution_x: int = StructType.uint32()
@@ -108,75 +180,267 @@ class CTBPreview(LittleEndianStruct):
     image_length: int = StructType.uint32()
 
 
-REPEAT_RGB15_MASK: int = 1 << 5
-
-
-def _read_image(width: int, height: int, data: bytes) -> png.Image:
-    array: List[List[int]] = [[]]
-
-    (i, x) = (0, 0)
-    while i < len(data):
-        color16 = int(struct.unpack_from("<H", data, i)[0])
-        i += 2
-        repeat = 1
-        if color16 & REPEAT_RGB15_MASK:
-            repeat += int(struct.unpack_from("<H", data, i)[0]) & 0xFFF
-            i += 2
-
-        (r, g, b) = (
-            (color16 >> 0) & 0x1F,
-            (color16 >> 6) & 0x1F,
-            (color16 >> 11) & 0x1F,
+def _read_preview_at(file: BinaryIO, preview_offset: int) -> png.Image:
+    file.seek(preview_offset)
+    preview = CTBPreview.unpack(file.read(CTBPreview.get_size()))
+
+    file.seek(preview.image_offset)
+    data = file.read(preview.image_length)
+
+    return read_rgb15_image(preview.resolution_x, preview.resolution_y, data)
+
+
+# where the settings of a PrintSettingsPatch are stored in the header and in the
+# print parameters
+_HEADER_SETTINGS: Dict[str, str] = {
+    "exposure_secs": "layer_exposure",
+    "bottom_exposure_secs": "bottom_exposure",
+    "light_off_time_secs": "layer_off_time",
+}
+_PARAM_SETTINGS: Dict[str, str] = {
+    "light_off_time_secs": "light_off_time",
+    "bottom_light_off_time_secs": "bottom_lift_off_time",
+    "lift_height_mm": "lift_height",
+    "lift_speed_mm_per_min": "lift_speed",
+    "bottom_lift_height_mm": "bottom_lift_height",
+    "bottom_lift_speed_mm_per_min": "bottom_lift_speed",
+    "retract_speed_mm_per_min": "retract_speed",
+}
+
+# where the settings of every layer are stored in the layer definitions of
+# version 3 files
+_LAYER_DEF_EX_SETTINGS: Dict[str, str] = {
+    "exposure_secs": "layer_exposure",
+    "light_off_time_secs": "layer_off_time",
+    "lift_height_mm": "lift_height",
+    "lift_speed_mm_per_min": "lift_speed",
+    "retract_speed_mm_per_min": "retract_speed",
+}
+
+
+def _get_summary(
+    path: pathlib.Path, ctb_header: CTBHeader, printer_name: str
+) -> SlicedModelFileSummary:
+    return SlicedModelFileSummary(
+        filename=path.name,
+        bed_size_mm=(
+            round(ctb_header.bed_size_x_mm, 4),
+            round(ctb_header.bed_size_y_mm, 4),
+            round(ctb_header.bed_size_z_mm, 4),
+        ),
+        height_mm=ctb_header.height_mm,
+        layer_height_mm=ctb_header.layer_height_mm,
+        layer_count=ctb_header.layer_count,
+        resolution=(ctb_header.resolution_x, ctb_header.resolution_y),
+        print_time_secs=ctb_header.print_time,
+        printer_name=printer_name,
+    )
+
+
+def _read_slicer(file: BinaryIO, ctb_header: CTBHeader) -> CTBSlicer:
+    file.seek(ctb_header.slicer_offset)
+    return CTBSlicer.unpack(file.read(CTBSlicer.get_size()))
+
+
+def _read_printer_name(file: BinaryIO, ctb_slicer: CTBSlicer) -> str:
+    file.seek(ctb_slicer.machine_offset)
+    return file.read(ctb_slicer.machine_size).decode()
+
+
+def _check_layer_index(path: pathlib.Path, ctb_header: CTBHeader, layer: int) -> None:
+    if layer < 0 or layer >= ctb_header.layer_count:
+        raise IndexError(
+            f"{path.name} has no layer {layer} ({ctb_header.layer_count} layers)"
         )
 
-        while repeat > 0:
-            array[-1] += [r, g, b]
-            repeat -= 1
-
-            x += 1
-            if x == width:
-                x = 0
-                array.append([])
 
-    array.pop()
-
-    return png.from_array(array, "RGB;5")
+def _crypt_layer_data(seed: int, layer: int, data: Union[bytes, memoryview]) -> bytes:
+    """
+    Layers of encrypted .ctb files are XORed with a keystream of 32-bit little
+    endian words derived from the encryption seed and the layer index, so the
+    same function both encrypts and decrypts them. A seed of 0 means the file
+    isn't encrypted.
+    """
+    if seed == 0:
+        return bytes(data)
+    seed = (seed * 0x2D83CDAC + 0xD8A83423) & 0xFFFFFFFF
+    key = ((layer * 0x1E1530CD + 0xEC3D47CD) * seed) & 0xFFFFFFFF
+    word_count = (len(data) + 3) // 4
+    keystream = struct.pack(
+        f"<{word_count}I",
+        *[(key + index * seed) & 0xFFFFFFFF for index in range(word_count)],
+    )
+    # XORing the whole layer as a single integer is much faster than doing it
+    # byte by byte in Python
+    return (
+        int.from_bytes(data, "little")
+        ^ int.from_bytes(keystream[: len(data)], "little")
+    ).to_bytes(len(data), "little")
+
+
+def _get_layer_def_offsets(ctb_header: CTBHeader, layer: int) -> List[int]:
+    # .cbddlp files store the layer definitions once for every level of
+    # anti-aliasing, each of them pointing to a 1-bit plane of the layer, while
+    # .ctb files store anti-aliased pixels as shades of gray in a single image
+    if ctb_header.magic == CBDDLP_MAGIC:
+        plane_count = max(1, ctb_header.anti_alias_level)
+    else:
+        plane_count = 1
+    return [
+        ctb_header.layer_defs_offset
+        + (plane * ctb_header.layer_count + layer) * CTBLayerDef.get_size()
+        for plane in range(plane_count)
+    ]
+
+
+def _decode_layer_image(
+    path: pathlib.Path,
+    ctb_header: CTBHeader,
+    layer: int,
+    planes: Sequence[Union[bytes, memoryview]],
+) -> LayerImage:
+    (width, height) = (ctb_header.resolution_x, ctb_header.resolution_y)
+    if ctb_header.magic == CTB_MAGIC:
+        pixels = decode_rle7_layer(
+            width,
+            height,
+            _crypt_layer_data(ctb_header.encryption_seed, layer, planes[0]),
+        )
+    elif ctb_header.magic == CBDDLP_MAGIC:
+        pixels = decode_bit_planes(width, height, planes)
+    else:
+        raise UnsupportedLayerEncoding(path.name)
+    return LayerImage(width=width, height=height, pixels=pixels)
+
+
+def _get_layer_area(
+    path: pathlib.Path,
+    ctb_header: CTBHeader,
+    layer: int,
+    planes: Sequence[Union[bytes, memoryview]],
+) -> LayerArea:
+    (width, height) = (ctb_header.resolution_x, ctb_header.resolution_y)
+    if ctb_header.magic == CTB_MAGIC:
+        return get_rle7_layer_area(
+            width,
+            height,
+            _crypt_layer_data(ctb_header.encryption_seed, layer, planes[0]),
+        )
+    elif ctb_header.magic == CBDDLP_MAGIC:
+        return get_bit_plane_layer_area(width, height, planes)
+    else:
+        raise UnsupportedLayerEncoding(path.name)
+
+
+def _count_layer_pixels(
+    path: pathlib.Path,
+    ctb_header: CTBHeader,
+    layer: int,
+    planes: Sequence[Union[bytes, memoryview]],
+) -> List[int]:
+    if ctb_header.magic == CTB_MAGIC:
+        return [
+            count_rle7_pixels(
+                _crypt_layer_data(ctb_header.encryption_seed, layer, planes[0])
+            )
+        ]
+    elif ctb_header.magic == CBDDLP_MAGIC:
+        return [count_bit_plane_pixels(plane) for plane in planes]
+    else:
+        raise UnsupportedLayerEncoding(path.name)
+
+
+def _get_layer_planes(
+    buffer: FileBuffer, ctb_header: CTBHeader, layer: int
+) -> List[bytes]:
+    planes = []
+    for layer_def_offset in _get_layer_def_offsets(ctb_header, layer):
+        layer_def = CTBLayerDef.unpack_from(buffer, layer_def_offset)
+        start = layer_def.image_offset
+        end = start + layer_def.image_length
+        planes.append(buffer[start:end])
+    return planes
+
+
+def _get_layer_def_ex_offsets(
+    file: BinaryIO, ctb_header: CTBHeader
+) -> Optional[List[int]]:
+    if ctb_header.version < 3:
+        return None
+    file.seek(ctb_header.layer_defs_offset)
+    data = file.read(ctb_header.layer_count * CTBLayerDef.get_size())
+    layer_defs = list(
+        map(CTBLayerDef.from_values, CTBLayerDef.get_codec().iter_unpack(data))
+    )
+    if any(
+        layer_def.image_info_size < CTBLayerDefEx.get_size()
+        or layer_def.image_offset < CTBLayerDefEx.get_size()
+        for layer_def in layer_defs
+    ):
+        return None
+    return [
+        layer_def.image_offset - CTBLayerDefEx.get_size() for layer_def in layer_defs
+    ]
+
+
+def _read_layer_def_exs(
+    file: BinaryIO, ctb_header: CTBHeader
+) -> Optional[List[CTBLayerDefEx]]:
+    layer_def_ex_offsets = _get_layer_def_ex_offsets(file, ctb_header)
+    if layer_def_ex_offsets is None:
+        return None
+    layer_def_exs = []
+    for layer_def_ex_offset in layer_def_ex_offsets:
+        file.seek(layer_def_ex_offset)
+        layer_def_exs.append(CTBLayerDefEx.unpack(file.read(CTBLayerDefEx.get_size())))
+    return layer_def_exs
+
+
+def _read_motion_profile(file: BinaryIO, ctb_header: CTBHeader) -> MotionProfile:
+    motion_profile = read_param_motion_profile(
+        file,
+        ctb_header.param_offset,
+        ctb_header.param_size,
+        CTBParam,
+        ctb_header.bottom_count,
+        ctb_header.layer_off_time,
+    )
+    layer_def_exs = _read_layer_def_exs(file, ctb_header)
+    if layer_def_exs is None:
+        return motion_profile
+    return replace(
+        motion_profile,
+        layer_lift_height_mm=tuple(
+            layer_def_ex.lift_height for layer_def_ex in layer_def_exs
+        ),
+        layer_lift_speed_mm_per_min=tuple(
+            layer_def_ex.lift_speed for layer_def_ex in layer_def_exs
+        ),
+        layer_retract_speed_mm_per_min=tuple(
+            layer_def_ex.retract_speed for layer_def_ex in layer_def_exs
+        ),
+    )
 
 
 @dataclass(frozen=True)
 class CTBFile(SlicedModelFile):
+    MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset([CTB_MAGIC, CBDDLP_MAGIC])
+
     @classmethod
     def read(self, path: pathlib.Path) -> "CTBFile":
         with open(str(path), "rb") as file:
             ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
 
-            file.seek(ctb_header.slicer_offset)
-            ctb_slicer = CTBSlicer.unpack(file.read(CTBSlicer.get_size()))
+            ctb_slicer = _read_slicer(file, ctb_header)
+            printer_name = _read_printer_name(file, ctb_slicer)
 
-            file.seek(ctb_slicer.machine_offset)
-            printer_name = file.read(ctb_slicer.machine_size).decode()
-
-            end_byte_offset_by_layer = []
-            for layer in range(0, ctb_header.layer_count):
-                file.seek(ctb_header.layer_defs_offset + layer * CTBLayerDef.get_size())
-                layer_def = CTBLayerDef.unpack(file.read(CTBLayerDef.get_size()))
-                end_byte_offset_by_layer.append(
-                    layer_def.image_offset + layer_def.image_length
-                )
+            layer_table = unpack_layer_table(
+                file, ctb_header.layer_defs_offset, ctb_header.layer_count, CTBLayerDef
+            )
 
             return CTBFile(
-                filename=path.name,
-                bed_size_mm=(
-                    round(ctb_header.bed_size_x_mm, 4),
-                    round(ctb_header.bed_size_y_mm, 4),
-                    round(ctb_header.bed_size_z_mm, 4),
-                ),
-                height_mm=ctb_header.height_mm,
-                layer_height_mm=ctb_header.layer_height_mm,
-                layer_count=ctb_header.layer_count,
-                resolution=(ctb_header.resolution_x, ctb_header.resolution_y),
-                print_time_secs=ctb_header.print_time,
-                end_byte_offset_by_layer=end_byte_offset_by_layer,
+                **asdict(_get_summary(path, ctb_header, printer_name)),
+                end_byte_offset_by_layer=layer_table.get_end_byte_offsets(),
                 slicer_version=".".join(
                     [
                         str(ctb_slicer.version_release),
@@ -185,18 +449,174 @@ class CTBFile(SlicedModelFile):
                         str(ctb_slicer.version_patch),
                     ]
                 ),
-                printer_name=printer_name,
+            )
+
+    @classmethod
+    def read_summary(cls, path: pathlib.Path) -> SlicedModelFileSummary:
+        with open(str(path), "rb") as file:
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            printer_name = _read_printer_name(file, _read_slicer(file, ctb_header))
+            return _get_summary(path, ctb_header, printer_name)
+
+    @classmethod
+    def read_layer_table(cls, path: pathlib.Path) -> LayerTable:
+        with open(str(path), "rb") as file:
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            return unpack_layer_table(
+                file, ctb_header.layer_defs_offset, ctb_header.layer_count, CTBLayerDef
             )
 
     @classmethod
     def read_preview(cls, path: pathlib.Path) -> png.Image:
         with open(str(path), "rb") as file:
             ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            return _read_preview_at(file, ctb_header.high_res_preview_offset)
+
+    @classmethod
+    def read_thumbnail(cls, path: pathlib.Path) -> png.Image:
+        with open(str(path), "rb") as file:
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            return _read_preview_at(file, ctb_header.low_res_preview_offset)
+
+    @classmethod
+    def read_layer_image(cls, path: pathlib.Path, layer: int) -> LayerImage:
+        with map_file(path) as buffer:
+            ctb_header = CTBHeader.unpack_from(buffer)
+            _check_layer_index(path, ctb_header, layer)
+
+            return _decode_layer_image(
+                path, ctb_header, layer, _get_layer_planes(buffer, ctb_header, layer)
+            )
+
+    @classmethod
+    def read_layer_area_table(cls, path: pathlib.Path) -> LayerAreaTable:
+        summary = cls.read_summary(path)
+        # every layer of the file is read, which takes a single mapping rather
+        # than a seek and a read for every one of them
+        with map_file(path) as buffer:
+            ctb_header = CTBHeader.unpack_from(buffer)
+            layer_table = unpack_layer_table_from(
+                buffer,
+                ctb_header.layer_defs_offset,
+                ctb_header.layer_count,
+                CTBLayerDef,
+            )
+            return build_layer_area_table(
+                summary,
+                layer_table,
+                (
+                    _get_layer_area(
+                        path,
+                        ctb_header,
+                        layer,
+                        _get_layer_planes(buffer, ctb_header, layer),
+                    )
+                    for layer in range(ctb_header.layer_count)
+                ),
+            )
+
+    @classmethod
+    def read_motion_profile(cls, path: pathlib.Path) -> MotionProfile:
+        with open(str(path), "rb") as file:
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            return _read_motion_profile(file, ctb_header)
 
-            file.seek(ctb_header.high_res_preview_offset)
-            preview = CTBPreview.unpack(file.read(CTBPreview.get_size()))
+    @classmethod
+    def patch_print_settings(
+        cls, path: pathlib.Path, patch: PrintSettingsPatch
+    ) -> None:
+        with open(str(path), "r+b") as file:
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            structs = [(0, CTBHeader, _HEADER_SETTINGS)]
+            if ctb_header.param_offset != 0:
+                structs.append((ctb_header.param_offset, CTBParam, _PARAM_SETTINGS))
+            patch_print_settings_in_place(
+                file,
+                patch,
+                structs,
+                _get_layer_def_offsets(ctb_header, 0),
+                CTBLayerDef,
+                ctb_header.layer_count,
+                ctb_header.bottom_count,
+            )
+            # the printer goes by the copies of the layer definitions that come
+            # before the image of every layer in version 3 files, so those are
+            # patched as well
+            layer_def_ex_offsets = _get_layer_def_ex_offsets(file, ctb_header)
+            if layer_def_ex_offsets is not None:
+                for (layers, setting, value) in get_layer_setting_patches(
+                    patch, ctb_header.layer_count, ctb_header.bottom_count
+                ):
+                    field_name = _LAYER_DEF_EX_SETTINGS[setting]
+                    packed_value = CTBLayerDefEx.pack_field(field_name, value)
+                    field_offset = CTBLayerDefEx.get_field_offset(field_name)
+                    for layer in layers:
+                        file.seek(layer_def_ex_offsets[layer] + field_offset)
+                        file.write(packed_value)
+
+        print_time_secs = round(cls.simulate_print(path).get_total_secs())
+        with open(str(path), "r+b") as file:
+            patch_struct_field(file, 0, CTBHeader, "print_time", print_time_secs)
+            # the slicer block doesn't hold the print time, but it does hold the
+            # time the file was last changed at
+            if ctb_header.slicer_offset != 0:
+                patch_struct_field(
+                    file,
+                    ctb_header.slicer_offset,
+                    CTBSlicer,
+                    "modified_timestamp_minutes",
+                    int(time.time()) // 60,
+                )
 
-            file.seek(preview.image_offset)
-            data = file.read(preview.image_length)
+    @classmethod
+    def validate(
+        cls, path: pathlib.Path, check_layer_pixels: bool = False
+    ) -> IntegrityReport:
+        file_size = os.path.getsize(path)
+        with open(str(path), "rb") as file:
+            if file_size < CTBHeader.get_size():
+                return IntegrityReport(
+                    errors=["The file is too short to hold a header"],
+                    checked_layer_pixels=False,
+                )
+            ctb_header = CTBHeader.unpack(file.read(CTBHeader.get_size()))
+            # the slicer block hasn't been bounds-checked yet, and the printer
+            # name doesn't take part in checking the summary anyway
+            summary = _get_summary(path, ctb_header, printer_name="")
+            errors = check_summary(summary)
+            if ctb_header.magic not in cls.MAGIC_NUMBERS:
+                errors.append(f"Unknown magic number {ctb_header.magic:#010x}")
+            if ctb_header.magic == CBDDLP_MAGIC and ctb_header.anti_alias_level > 255:
+                errors.append(
+                    f"Invalid anti-aliasing level {ctb_header.anti_alias_level}"
+                )
+            if errors:
+                return IntegrityReport(errors=errors, checked_layer_pixels=False)
+
+            errors += check_file_bounds(
+                file,
+                file_size,
+                {
+                    "preview": ctb_header.high_res_preview_offset,
+                    "thumbnail": ctb_header.low_res_preview_offset,
+                },
+                CTBPreview,
+                # .cbddlp files have one layer table for every plane
+                _get_layer_def_offsets(ctb_header, 0),
+                ctb_header.layer_count,
+                CTBLayerDef,
+            )
 
-            return _read_image(preview.resolution_x, preview.resolution_y, data)
+        if not check_layer_pixels or errors:
+            return IntegrityReport(errors=errors, checked_layer_pixels=False)
+        with map_file(path) as buffer:
+            errors += check_layer_pixel_counts(
+                summary,
+                lambda layer: _count_layer_pixels(
+                    path,
+                    ctb_header,
+                    layer,
+                    _get_layer_planes(buffer, ctb_header, layer),
+                ),
+            )
+        return IntegrityReport(errors=errors, checked_layer_pixels=True)
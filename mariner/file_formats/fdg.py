@@ -1,14 +1,35 @@
+import os
 import pathlib
-import struct
-from dataclasses import dataclass
-from typing import List
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, ClassVar, Dict, FrozenSet
 
 import png
-from typedstruct import LittleEndianStruct, StructType
+from typedstruct import StructType
 
-from mariner.file_formats import SlicedModelFile
+from mariner.exceptions import UnsupportedLayerEncoding
+from mariner.file_formats import (
+    IntegrityReport,
+    LayerAreaTable,
+    LayerImage,
+    LayerTable,
+    MotionProfile,
+    PrintSettingsPatch,
+    SlicedModelFile,
+    SlicedModelFileSummary,
+    check_file_bounds,
+    check_summary,
+    patch_print_settings_in_place,
+    patch_struct_field,
+    unpack_layer_table,
+)
+from mariner.file_formats.rle import read_rgb15_image
+from mariner.file_formats.structs import LittleEndianStruct, compiled_struct
 
 
+FDG_MAGIC: int = 0xBD3C7AC8
+
+
+@compiled_struct
 @dataclass(frozen=True)
 class FDGHeader(LittleEndianStruct):
     magic: int = StructType.uint32()
@@ -71,6 +92,7 @@ class FDGHeader(LittleEndianStruct):
     unknown_16: int = StructType.uint32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class FDGLayerDef(LittleEndianStruct):
     layer_height_mm: float = StructType.float32()
@@ -84,6 +106,7 @@ class FDGLayerDef(LittleEndianStruct):
     unknown_03: int = StructType.uint32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class FDGPreview(LittleEndianStruct):
     resolution_x: int = StructType.uint32()
@@ -92,72 +115,72 @@ class FDGPreview(LittleEndianStruct):
     image_length: int = StructType.uint32()
 
 
-REPEAT_RGB15_MASK: int = 1 << 5
+def _read_preview_at(file: BinaryIO, preview_offset: int) -> png.Image:
+    file.seek(preview_offset)
+    preview = FDGPreview.unpack(file.read(FDGPreview.get_size()))
 
+    file.seek(preview.image_offset)
+    data = file.read(preview.image_length)
 
-def _read_image(width: int, height: int, data: bytes) -> png.Image:
-    array: List[List[int]] = [[]]
+    return read_rgb15_image(preview.resolution_x, preview.resolution_y, data)
 
-    (i, x) = (0, 0)
-    while i < len(data):
-        color16 = int(struct.unpack_from("<H", data, i)[0])
-        i += 2
-        repeat = 1
-        if color16 & REPEAT_RGB15_MASK:
-            repeat += int(struct.unpack_from("<H", data, i)[0]) & 0xFFF
-            i += 2
 
-        (r, g, b) = (
-            (color16 >> 0) & 0x1F,
-            (color16 >> 6) & 0x1F,
-            (color16 >> 11) & 0x1F,
-        )
+# where the settings of a PrintSettingsPatch are stored in the header
+_HEADER_SETTINGS: Dict[str, str] = {
+    "exposure_secs": "layer_exposure",
+    "bottom_exposure_secs": "bottom_exposure",
+    "light_off_time_secs": "light_off_time",
+    "bottom_light_off_time_secs": "bottom_light_off_time",
+    "lift_height_mm": "lift_height",
+    "lift_speed_mm_per_min": "lift_speed",
+    "bottom_lift_height_mm": "bottom_lift_height",
+    "bottom_lift_speed_mm_per_min": "bottom_lift_speed",
+    "retract_speed_mm_per_min": "retract_speed",
+}
 
-        while repeat > 0:
-            array[-1] += [r, g, b]
-            repeat -= 1
 
-            x += 1
-            if x == width:
-                x = 0
-                array.append([])
+def _get_summary(
+    path: pathlib.Path, fdg_header: FDGHeader, printer_name: str
+) -> SlicedModelFileSummary:
+    return SlicedModelFileSummary(
+        filename=path.name,
+        bed_size_mm=(
+            round(fdg_header.bed_size_x_mm, 4),
+            round(fdg_header.bed_size_y_mm, 4),
+            round(fdg_header.bed_size_z_mm, 4),
+        ),
+        height_mm=fdg_header.height_mm,
+        layer_height_mm=fdg_header.layer_height_mm,
+        layer_count=fdg_header.layer_count,
+        resolution=(fdg_header.resolution_x, fdg_header.resolution_y),
+        print_time_secs=fdg_header.print_time,
+        printer_name=printer_name,
+    )
 
-    array.pop()
 
-    return png.from_array(array, "RGB;5")
+def _read_printer_name(file: BinaryIO, fdg_header: FDGHeader) -> str:
+    file.seek(fdg_header.machine_offset)
+    return file.read(fdg_header.machine_size).decode()
 
 
 @dataclass(frozen=True)
 class FDGFile(SlicedModelFile):
+    MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset([FDG_MAGIC])
+
     @classmethod
     def read(self, path: pathlib.Path) -> "FDGFile":
         with open(str(path), "rb") as file:
             fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
 
-            file.seek(fdg_header.machine_offset)
-            printer_name = file.read(fdg_header.machine_size).decode()
+            printer_name = _read_printer_name(file, fdg_header)
 
-            end_byte_offset_by_layer = []
-            for layer in range(0, fdg_header.layer_count):
-                file.seek(fdg_header.layer_defs_offset + layer * FDGLayerDef.get_size())
-                layer_def = FDGLayerDef.unpack(file.read(FDGLayerDef.get_size()))
-                end_byte_offset_by_layer.append(
-                    layer_def.image_offset + layer_def.image_length
-                )
+            layer_table = unpack_layer_table(
+                file, fdg_header.layer_defs_offset, fdg_header.layer_count, FDGLayerDef
+            )
 
             return FDGFile(
-                filename=path.name,
-                bed_size_mm=(
-                    round(fdg_header.bed_size_x_mm, 4),
-                    round(fdg_header.bed_size_y_mm, 4),
-                    round(fdg_header.bed_size_z_mm, 4),
-                ),
-                height_mm=fdg_header.height_mm,
-                layer_height_mm=fdg_header.layer_height_mm,
-                layer_count=fdg_header.layer_count,
-                resolution=(fdg_header.resolution_x, fdg_header.resolution_y),
-                print_time_secs=fdg_header.print_time,
-                end_byte_offset_by_layer=end_byte_offset_by_layer,
+                **asdict(_get_summary(path, fdg_header, printer_name)),
+                end_byte_offset_by_layer=layer_table.get_end_byte_offsets(),
                 slicer_version=".".join(
                     [
                         str(fdg_header.slicer_version_release),
@@ -166,18 +189,108 @@ class FDGFile(SlicedModelFile):
                         str(fdg_header.slicer_version_patch),
                     ]
                 ),
-                printer_name=printer_name,
+            )
+
+    @classmethod
+    def read_summary(cls, path: pathlib.Path) -> SlicedModelFileSummary:
+        with open(str(path), "rb") as file:
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            return _get_summary(path, fdg_header, _read_printer_name(file, fdg_header))
+
+    @classmethod
+    def read_layer_table(cls, path: pathlib.Path) -> LayerTable:
+        with open(str(path), "rb") as file:
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            return unpack_layer_table(
+                file, fdg_header.layer_defs_offset, fdg_header.layer_count, FDGLayerDef
             )
 
     @classmethod
     def read_preview(cls, path: pathlib.Path) -> png.Image:
         with open(str(path), "rb") as file:
             fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            return _read_preview_at(file, fdg_header.high_res_preview_offset)
+
+    @classmethod
+    def read_thumbnail(cls, path: pathlib.Path) -> png.Image:
+        with open(str(path), "rb") as file:
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            return _read_preview_at(file, fdg_header.low_res_preview_offset)
+
+    @classmethod
+    def read_layer_image(cls, path: pathlib.Path, layer: int) -> LayerImage:
+        raise UnsupportedLayerEncoding(path.name)
+
+    @classmethod
+    def read_layer_area_table(cls, path: pathlib.Path) -> LayerAreaTable:
+        raise UnsupportedLayerEncoding(path.name)
+
+    @classmethod
+    def read_motion_profile(cls, path: pathlib.Path) -> MotionProfile:
+        with open(str(path), "rb") as file:
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            return MotionProfile(
+                bottom_layer_count=fdg_header.bottom_layer_count,
+                bottom_lift_height_mm=fdg_header.bottom_lift_height,
+                bottom_lift_speed_mm_per_min=fdg_header.bottom_lift_speed,
+                lift_height_mm=fdg_header.lift_height,
+                lift_speed_mm_per_min=fdg_header.lift_speed,
+                retract_speed_mm_per_min=fdg_header.retract_speed,
+                bottom_light_off_time_secs=fdg_header.bottom_light_off_time,
+                light_off_time_secs=fdg_header.light_off_time,
+            )
 
-            file.seek(fdg_header.high_res_preview_offset)
-            preview = FDGPreview.unpack(file.read(FDGPreview.get_size()))
+    @classmethod
+    def patch_print_settings(
+        cls, path: pathlib.Path, patch: PrintSettingsPatch
+    ) -> None:
+        with open(str(path), "r+b") as file:
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            patch_print_settings_in_place(
+                file,
+                patch,
+                [(0, FDGHeader, _HEADER_SETTINGS)],
+                [fdg_header.layer_defs_offset],
+                FDGLayerDef,
+                fdg_header.layer_count,
+                fdg_header.bottom_layer_count,
+            )
+        print_time_secs = round(cls.simulate_print(path).get_total_secs())
+        with open(str(path), "r+b") as file:
+            patch_struct_field(file, 0, FDGHeader, "print_time", print_time_secs)
 
-            file.seek(preview.image_offset)
-            data = file.read(preview.image_length)
+    @classmethod
+    def validate(
+        cls, path: pathlib.Path, check_layer_pixels: bool = False
+    ) -> IntegrityReport:
+        # we can't decode the layers of .fdg files, so check_layer_pixels only
+        # ever gets as far as the layer table
+        file_size = os.path.getsize(path)
+        with open(str(path), "rb") as file:
+            if file_size < FDGHeader.get_size():
+                return IntegrityReport(
+                    errors=["The file is too short to hold a header"],
+                    checked_layer_pixels=False,
+                )
+            fdg_header = FDGHeader.unpack(file.read(FDGHeader.get_size()))
+            # the machine name hasn't been bounds-checked yet, and the printer
+            # name doesn't take part in checking the summary anyway
+            errors = check_summary(_get_summary(path, fdg_header, printer_name=""))
+            if fdg_header.magic not in cls.MAGIC_NUMBERS:
+                errors.append(f"Unknown magic number {fdg_header.magic:#010x}")
+            if errors:
+                return IntegrityReport(errors=errors, checked_layer_pixels=False)
 
-            return _read_image(preview.resolution_x, preview.resolution_y, data)
+            errors += check_file_bounds(
+                file,
+                file_size,
+                {
+                    "preview": fdg_header.high_res_preview_offset,
+                    "thumbnail": fdg_header.low_res_preview_offset,
+                },
+                FDGPreview,
+                [fdg_header.layer_defs_offset],
+                fdg_header.layer_count,
+                FDGLayerDef,
+            )
+            return IntegrityReport(errors=errors, checked_layer_pixels=False)
@@ -1,14 +1,45 @@
+import os
 import pathlib
-import struct
-from dataclasses import dataclass
-from typing import List
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, ClassVar, Dict, FrozenSet, List
 
 import png
-from typedstruct import LittleEndianStruct, StructType
-
-from mariner.file_formats import SlicedModelFile
-
-
+from typedstruct import StructType
+
+from mariner.file_formats import (
+    FileBuffer,
+    IntegrityReport,
+    LayerAreaTable,
+    LayerImage,
+    LayerTable,
+    MotionProfile,
+    PrintSettingsPatch,
+    SlicedModelFile,
+    SlicedModelFileSummary,
+    build_layer_area_table,
+    check_file_bounds,
+    check_layer_pixel_counts,
+    check_summary,
+    map_file,
+    patch_print_settings_in_place,
+    patch_struct_field,
+    read_param_motion_profile,
+    unpack_layer_table,
+    unpack_layer_table_from,
+)
+from mariner.file_formats.rle import (
+    count_bit_plane_pixels,
+    decode_bit_planes,
+    get_bit_plane_layer_area,
+    read_rgb15_image,
+)
+from mariner.file_formats.structs import LittleEndianStruct, compiled_struct
+
+
+PHOTON_MAGIC: int = 0x12FD0019
+
+
+@compiled_struct
 @dataclass(frozen=True)
 class PhotonHeader(LittleEndianStruct):
     magic: int = StructType.uint32()  # 00: Always 0x12FD0019
@@ -43,6 +74,7 @@ class PhotonHeader(LittleEndianStruct):
     slicer_size: int = StructType.uint32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class PhotonParam(LittleEndianStruct):
     bottom_lift_height: float = StructType.float32()  # 00:
@@ -62,6 +94,7 @@ class PhotonParam(LittleEndianStruct):
     unknown_04: int = StructType.uint32()  # 38:
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class PhotonSlicer(LittleEndianStruct):
     skip_0: int = StructType.uint32()
@@ -88,6 +121,7 @@ class PhotonSlicer(LittleEndianStruct):
     unknown_07: float = StructType.float32()
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class PhotonLayerDef(LittleEndianStruct):
     layer_height_mm: float = StructType.float32()  # 00:
@@ -101,6 +135,7 @@ class PhotonLayerDef(LittleEndianStruct):
     unknown_04: int = StructType.uint32()  # 20:
 
 
+@compiled_struct
 @dataclass(frozen=True)
 class PhotonPreview(LittleEndianStruct):
     resolution_x: int = StructType.uint32()
@@ -113,77 +148,132 @@ class PhotonPreview(LittleEndianStruct):
     unknown_04: int = StructType.uint32()
 
 
-REPEAT_RGB15_MASK: int = 1 << 5
-
-
-def _read_image(width: int, height: int, data: bytes) -> png.Image:
-    array: List[List[int]] = [[]]
-
-    (i, x) = (0, 0)
-    while i < len(data):
-        color16 = int(struct.unpack_from("<H", data, i)[0])
-        i += 2
-        repeat = 1
-        if color16 & REPEAT_RGB15_MASK:
-            repeat += int(struct.unpack_from("<H", data, i)[0]) & 0xFFF
-            i += 2
-
-        (r, g, b) = (
-            (color16 >> 0) & 0x1F,
-            (color16 >> 6) & 0x1F,
-            (color16 >> 11) & 0x1F,
+def _read_preview_at(file: BinaryIO, preview_offset: int) -> png.Image:
+    file.seek(preview_offset)
+    preview = PhotonPreview.unpack(file.read(PhotonPreview.get_size()))
+
+    file.seek(preview.image_offset)
+    data = file.read(preview.image_length)
+
+    return read_rgb15_image(preview.resolution_x, preview.resolution_y, data)
+
+
+# where the settings of a PrintSettingsPatch are stored in the header and in the
+# print parameters
+_HEADER_SETTINGS: Dict[str, str] = {
+    "exposure_secs": "layer_exposure",
+    "bottom_exposure_secs": "bottom_exposure",
+    "light_off_time_secs": "layer_off_time",
+}
+_PARAM_SETTINGS: Dict[str, str] = {
+    "light_off_time_secs": "light_off_time",
+    "bottom_light_off_time_secs": "bottom_lift_off_time",
+    "lift_height_mm": "lift_height",
+    "lift_speed_mm_per_min": "lift_speed",
+    "bottom_lift_height_mm": "bottom_lift_height",
+    "bottom_lift_speed_mm_per_min": "bottom_lift_speed",
+    "retract_speed_mm_per_min": "retract_speed",
+}
+
+
+def _get_summary(
+    path: pathlib.Path, photon_header: PhotonHeader, printer_name: str
+) -> SlicedModelFileSummary:
+    return SlicedModelFileSummary(
+        filename=path.name,
+        bed_size_mm=(
+            round(photon_header.bed_size_x_mm, 4),
+            round(photon_header.bed_size_y_mm, 4),
+            round(photon_header.bed_size_z_mm, 4),
+        ),
+        height_mm=photon_header.height_mm,
+        layer_height_mm=photon_header.layer_height_mm,
+        layer_count=photon_header.layer_count,
+        resolution=(photon_header.resolution_x, photon_header.resolution_y),
+        print_time_secs=photon_header.print_time,
+        printer_name=printer_name,
+    )
+
+
+def _read_slicer(file: BinaryIO, photon_header: PhotonHeader) -> PhotonSlicer:
+    file.seek(photon_header.slicer_offset)
+    return PhotonSlicer.unpack(file.read(PhotonSlicer.get_size()))
+
+
+def _read_printer_name(file: BinaryIO, photon_slicer: PhotonSlicer) -> str:
+    file.seek(photon_slicer.machine_offset)
+    return file.read(photon_slicer.machine_size).decode()
+
+
+def _check_layer_index(
+    path: pathlib.Path, photon_header: PhotonHeader, layer: int
+) -> None:
+    if layer < 0 or layer >= photon_header.layer_count:
+        raise IndexError(
+            f"{path.name} has no layer {layer} ({photon_header.layer_count} layers)"
         )
 
-        while repeat > 0:
-            array[-1] += [r, g, b]
-            repeat -= 1
 
-            x += 1
-            if x == width:
-                x = 0
-                array.append([])
-
-    array.pop()
-
-    return png.from_array(array, "RGB;5")
+def _get_layer_def_offsets(photon_header: PhotonHeader, layer: int) -> List[int]:
+    # the layer definitions are stored once for every level of anti-aliasing,
+    # each of them pointing to a 1-bit plane of the layer. version 1 files
+    # don't support anti-aliasing at all.
+    if photon_header.version >= 2:
+        plane_count = max(1, photon_header.anti_alias_level)
+    else:
+        plane_count = 1
+    return [
+        photon_header.layer_defs_offset
+        + (plane * photon_header.layer_count + layer) * PhotonLayerDef.get_size()
+        for plane in range(plane_count)
+    ]
+
+
+def _get_layer_planes(
+    buffer: FileBuffer, photon_header: PhotonHeader, layer: int
+) -> List[bytes]:
+    planes = []
+    for layer_def_offset in _get_layer_def_offsets(photon_header, layer):
+        layer_def = PhotonLayerDef.unpack_from(buffer, layer_def_offset)
+        start = layer_def.image_offset
+        end = start + layer_def.image_length
+        planes.append(buffer[start:end])
+    return planes
+
+
+def _read_motion_profile(file: BinaryIO, photon_header: PhotonHeader) -> MotionProfile:
+    return read_param_motion_profile(
+        file,
+        photon_header.param_offset,
+        photon_header.param_size,
+        PhotonParam,
+        photon_header.bottom_count,
+        photon_header.layer_off_time,
+    )
 
 
 @dataclass(frozen=True)
 class PhotonFile(SlicedModelFile):
+    MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset([PHOTON_MAGIC])
+
     @classmethod
     def read(self, path: pathlib.Path) -> "PhotonFile":
         with open(str(path), "rb") as file:
             photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
 
-            file.seek(photon_header.slicer_offset)
-            photon_slicer = PhotonSlicer.unpack(file.read(PhotonSlicer.get_size()))
+            photon_slicer = _read_slicer(file, photon_header)
+            printer_name = _read_printer_name(file, photon_slicer)
 
-            file.seek(photon_slicer.machine_offset)
-            printer_name = file.read(photon_slicer.machine_size).decode()
-
-            end_byte_offset_by_layer = []
-            for layer in range(0, photon_header.layer_count):
-                file.seek(
-                    photon_header.layer_defs_offset + layer * PhotonLayerDef.get_size()
-                )
-                layer_def = PhotonLayerDef.unpack(file.read(PhotonLayerDef.get_size()))
-                end_byte_offset_by_layer.append(
-                    layer_def.image_offset + layer_def.image_length
-                )
+            layer_table = unpack_layer_table(
+                file,
+                photon_header.layer_defs_offset,
+                photon_header.layer_count,
+                PhotonLayerDef,
+            )
 
             return PhotonFile(
-                filename=path.name,
-                bed_size_mm=(
-                    round(photon_header.bed_size_x_mm, 4),
-                    round(photon_header.bed_size_y_mm, 4),
-                    round(photon_header.bed_size_z_mm, 4),
-                ),
-                height_mm=photon_header.height_mm,
-                layer_height_mm=photon_header.layer_height_mm,
-                layer_count=photon_header.layer_count,
-                resolution=(photon_header.resolution_x, photon_header.resolution_y),
-                print_time_secs=photon_header.print_time,
-                end_byte_offset_by_layer=end_byte_offset_by_layer,
+                **asdict(_get_summary(path, photon_header, printer_name)),
+                end_byte_offset_by_layer=layer_table.get_end_byte_offsets(),
                 slicer_version=".".join(
                     [
                         str(photon_slicer.version_release),
@@ -192,18 +282,155 @@ class PhotonFile(SlicedModelFile):
                         str(photon_slicer.version_patch),
                     ]
                 ),
-                printer_name=printer_name,
+            )
+
+    @classmethod
+    def read_summary(cls, path: pathlib.Path) -> SlicedModelFileSummary:
+        with open(str(path), "rb") as file:
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            printer_name = _read_printer_name(file, _read_slicer(file, photon_header))
+            return _get_summary(path, photon_header, printer_name)
+
+    @classmethod
+    def read_layer_table(cls, path: pathlib.Path) -> LayerTable:
+        with open(str(path), "rb") as file:
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            return unpack_layer_table(
+                file,
+                photon_header.layer_defs_offset,
+                photon_header.layer_count,
+                PhotonLayerDef,
             )
 
     @classmethod
     def read_preview(cls, path: pathlib.Path) -> png.Image:
         with open(str(path), "rb") as file:
             photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            return _read_preview_at(file, photon_header.high_res_preview_offset)
 
-            file.seek(photon_header.high_res_preview_offset)
-            preview = PhotonPreview.unpack(file.read(PhotonPreview.get_size()))
+    @classmethod
+    def read_thumbnail(cls, path: pathlib.Path) -> png.Image:
+        with open(str(path), "rb") as file:
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            return _read_preview_at(file, photon_header.low_res_preview_offset)
 
-            file.seek(preview.image_offset)
-            data = file.read(preview.image_length)
+    @classmethod
+    def read_layer_image(cls, path: pathlib.Path, layer: int) -> LayerImage:
+        with map_file(path) as buffer:
+            photon_header = PhotonHeader.unpack_from(buffer)
+            _check_layer_index(path, photon_header, layer)
+            planes = _get_layer_planes(buffer, photon_header, layer)
+
+            (width, height) = (photon_header.resolution_x, photon_header.resolution_y)
+            return LayerImage(
+                width=width,
+                height=height,
+                pixels=decode_bit_planes(width, height, planes),
+            )
 
-            return _read_image(preview.resolution_x, preview.resolution_y, data)
+    @classmethod
+    def read_layer_area_table(cls, path: pathlib.Path) -> LayerAreaTable:
+        summary = cls.read_summary(path)
+        # every layer of the file is read, which takes a single mapping rather
+        # than a seek and a read for every one of them
+        with map_file(path) as buffer:
+            photon_header = PhotonHeader.unpack_from(buffer)
+            layer_table = unpack_layer_table_from(
+                buffer,
+                photon_header.layer_defs_offset,
+                photon_header.layer_count,
+                PhotonLayerDef,
+            )
+            return build_layer_area_table(
+                summary,
+                layer_table,
+                (
+                    get_bit_plane_layer_area(
+                        photon_header.resolution_x,
+                        photon_header.resolution_y,
+                        _get_layer_planes(buffer, photon_header, layer),
+                    )
+                    for layer in range(photon_header.layer_count)
+                ),
+            )
+
+    @classmethod
+    def read_motion_profile(cls, path: pathlib.Path) -> MotionProfile:
+        with open(str(path), "rb") as file:
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            return _read_motion_profile(file, photon_header)
+
+    @classmethod
+    def patch_print_settings(
+        cls, path: pathlib.Path, patch: PrintSettingsPatch
+    ) -> None:
+        with open(str(path), "r+b") as file:
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            structs = [(0, PhotonHeader, _HEADER_SETTINGS)]
+            if photon_header.param_offset != 0:
+                structs.append(
+                    (photon_header.param_offset, PhotonParam, _PARAM_SETTINGS)
+                )
+            patch_print_settings_in_place(
+                file,
+                patch,
+                structs,
+                _get_layer_def_offsets(photon_header, 0),
+                PhotonLayerDef,
+                photon_header.layer_count,
+                photon_header.bottom_count,
+            )
+        print_time_secs = round(cls.simulate_print(path).get_total_secs())
+        with open(str(path), "r+b") as file:
+            patch_struct_field(file, 0, PhotonHeader, "print_time", print_time_secs)
+
+    @classmethod
+    def validate(
+        cls, path: pathlib.Path, check_layer_pixels: bool = False
+    ) -> IntegrityReport:
+        file_size = os.path.getsize(path)
+        with open(str(path), "rb") as file:
+            if file_size < PhotonHeader.get_size():
+                return IntegrityReport(
+                    errors=["The file is too short to hold a header"],
+                    checked_layer_pixels=False,
+                )
+            photon_header = PhotonHeader.unpack(file.read(PhotonHeader.get_size()))
+            # the slicer block hasn't been bounds-checked yet, and the printer
+            # name doesn't take part in checking the summary anyway
+            summary = _get_summary(path, photon_header, printer_name="")
+            errors = check_summary(summary)
+            if photon_header.magic not in cls.MAGIC_NUMBERS:
+                errors.append(f"Unknown magic number {photon_header.magic:#010x}")
+            if photon_header.version >= 2 and photon_header.anti_alias_level > 255:
+                errors.append(
+                    f"Invalid anti-aliasing level {photon_header.anti_alias_level}"
+                )
+            if errors:
+                return IntegrityReport(errors=errors, checked_layer_pixels=False)
+
+            errors += check_file_bounds(
+                file,
+                file_size,
+                {
+                    "preview": photon_header.high_res_preview_offset,
+                    "thumbnail": photon_header.low_res_preview_offset,
+                },
+                PhotonPreview,
+                # there is one layer table for every plane
+                _get_layer_def_offsets(photon_header, 0),
+                photon_header.layer_count,
+                PhotonLayerDef,
+            )
+
+        if not check_layer_pixels or errors:
+            return IntegrityReport(errors=errors, checked_layer_pixels=False)
+        with map_file(path) as buffer:
+            errors += check_layer_pixel_counts(
+                summary,
+                lambda layer: [
+                    count_bit_plane_pixels(plane)
+                    for plane in _get_layer_planes(buffer, photon_header, layer)
+                ],
+            )
+        return IntegrityReport(errors=errors, checked_layer_pixels=True)
@@ -0,0 +1,400 @@
+import re
+import struct
+from itertools import accumulate, compress
+from typing import Dict, Iterator, List, Optional, Pattern, Sequence, Tuple, Union
+
+import png
+
+from mariner.file_formats import LayerArea
+
+
+REPEAT_RGB15_MASK: int = 1 << 5
+MAX_RGB15_REPEAT: int = 0xFFF + 1
+
+
+def _check_rgb15_image_size(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> None:
+    # every run takes at least 2 bytes, so this rejects bogus dimensions (e.g.
+    # from files that aren't really sliced model files) before we start
+    # allocating rows for them
+    if width <= 0 or height <= 0 or width * height > len(data) // 2 * MAX_RGB15_REPEAT:
+        raise ValueError(
+            f"Invalid {width}x{height} preview with {len(data)} bytes of data"
+        )
+
+
+def _iter_rgb15_runs(data: Union[bytes, memoryview]) -> Iterator[Tuple[bytes, int]]:
+    even_data = memoryview(data)[: len(data) // 2 * 2]
+    words = (word for (word,) in struct.iter_unpack("<H", even_data))
+    colors: Dict[int, bytes] = {}
+    for color16 in words:
+        repeat = 1
+        if color16 & REPEAT_RGB15_MASK:
+            repeat_word = next(words, None)
+            if repeat_word is None:
+                return
+            repeat += repeat_word & 0xFFF
+
+        rgb = colors.get(color16)
+        if rgb is None:
+            rgb = bytes(
+                (
+                    (color16 >> 0) & 0x1F,
+                    (color16 >> 6) & 0x1F,
+                    (color16 >> 11) & 0x1F,
+                )
+            )
+            colors[color16] = rgb
+        yield (rgb, repeat)
+
+
+def iter_rgb15_rows(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> Iterator[bytearray]:
+    """
+    Decodes the RGB15 run-length encoded previews used by all ChiTu formats one
+    row at a time, with 3 bytes (5-bit R, G and B values) per pixel. Each run is
+    expanded with a single bytes repetition, and at most a row plus a run is kept
+    in memory regardless of the size of the preview. Rows missing from the end
+    of truncated previews are filled with black.
+    """
+    stride = width * 3
+    rows_left = height
+    row = bytearray()
+    for (rgb, repeat) in _iter_rgb15_runs(data):
+        row += rgb * repeat
+        while len(row) >= stride and rows_left > 0:
+            yield row[:stride]
+            del row[:stride]
+            rows_left -= 1
+        if rows_left == 0:
+            return
+    if row:
+        yield row + bytearray(stride - len(row))
+        rows_left -= 1
+    for _ in range(rows_left):
+        yield bytearray(stride)
+
+
+def decode_rgb15_rle(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> bytearray:
+    _check_rgb15_image_size(width, height, data)
+    return bytearray().join(iter_rgb15_rows(width, height, data))
+
+
+def read_rgb15_image(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> png.Image:
+    _check_rgb15_image_size(width, height, data)
+    # rows are only decoded as the image is written out
+    return png.from_array(
+        iter_rgb15_rows(width, height, data),
+        "RGB;5",
+        info={"width": width, "height": height},
+    )
+
+
+# 7-bit grayscale values are stretched to 8 bits, keeping black at 0 and white
+# at 255
+_RLE7_TO_GRAY: bytes = bytes(
+    0 if value & 0x7F == 0 else ((value & 0x7F) << 1) | 1 for value in range(256)
+)
+_GRAY_PIXELS: Tuple[bytes, ...] = tuple(
+    bytes([_RLE7_TO_GRAY[value]]) for value in range(128)
+)
+_RLE7_LITERALS: Pattern[bytes] = re.compile(rb"[\x00-\x7f]*")
+
+
+def _iter_rle7_chunks(data: bytes) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Splits a 7-bit grayscale run-length encoded layer into chunks made of a
+    (possibly empty) span of single 7-bit pixels followed by a run of a single
+    7-bit value, whose length may be 0 for the last chunk. Bytes with the high
+    bit set start a run, followed by its length in 1 to 4 bytes.
+    """
+    offset = 0
+    end = len(data)
+    while offset < end:
+        literals_end = _RLE7_LITERALS.match(data, offset).end()
+        literals = data[offset:literals_end]
+        offset = literals_end
+        if offset + 1 >= end:
+            yield (literals, 0, 0)
+            return
+
+        value = data[offset] & 0x7F
+        lead = data[offset + 1]
+        if lead & 0x80 == 0:
+            (length, length_size) = (lead, 1)
+        elif lead & 0xC0 == 0x80:
+            (length, length_size) = (lead & 0x3F, 2)
+        elif lead & 0xE0 == 0xC0:
+            (length, length_size) = (lead & 0x1F, 3)
+        elif lead & 0xF0 == 0xE0:
+            (length, length_size) = (lead & 0x0F, 4)
+        else:
+            raise ValueError(f"Invalid run length at offset {offset + 1}")
+        length_end = offset + 1 + length_size
+        if length_end > end:
+            yield (literals, 0, 0)
+            return
+        length_start = offset + 2
+        for byte in data[length_start:length_end]:
+            length = (length << 8) | byte
+        offset = length_end
+        yield (literals, value, length)
+
+
+def decode_rle7_layer(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> bytearray:
+    """
+    Decodes a layer image stored as 7-bit grayscale runs, as used by .ctb
+    files, into 8-bit grayscale pixels. Spans of single pixels are converted
+    with one bytes.translate call and runs with one bytes repetition, so the
+    Python loop only runs once per run rather than once per pixel. Pixels
+    missing from truncated layers are left black.
+    """
+    size = width * height
+    pixels = bytearray()
+    for (literals, value, length) in _iter_rle7_chunks(bytes(data)):
+        pixels += literals.translate(_RLE7_TO_GRAY)
+        pixels += _GRAY_PIXELS[value] * min(length, max(0, size - len(pixels)))
+        if len(pixels) >= size:
+            break
+    del pixels[size:]
+    pixels += bytearray(size - len(pixels))
+    return pixels
+
+
+def count_rle7_pixels(data: Union[bytes, memoryview]) -> int:
+    """
+    Returns the number of pixels encoded in a 7-bit grayscale run-length
+    encoded layer, without decoding it. Raises ValueError for invalid runs.
+    """
+    return sum(
+        len(literals) + length
+        for (literals, _, length) in _iter_rle7_chunks(bytes(data))
+    )
+
+
+# every byte of a bit plane is a run of up to 127 pixels, with the value of the
+# pixels in the high bit and the length of the run in the low 7 bits
+_BIT_PLANE_RUNS: Tuple[bytes, ...] = tuple(
+    bytes([code >> 7]) * (code & 0x7F) for code in range(256)
+)
+_BIT_PLANE_CHUNK_SIZE: int = 4096
+
+
+def _iter_bit_plane_pixels(data: Union[bytes, memoryview]) -> Iterator[bytes]:
+    # runs are expanded a chunk at a time by looking up every byte of the chunk
+    # in _BIT_PLANE_RUNS, which keeps the loop out of Python
+    for start in range(0, len(data), _BIT_PLANE_CHUNK_SIZE):
+        end = start + _BIT_PLANE_CHUNK_SIZE
+        yield b"".join(map(_BIT_PLANE_RUNS.__getitem__, bytes(data[start:end])))
+
+
+def _iter_bit_plane_bands(
+    width: int,
+    height: int,
+    planes: Sequence[Union[bytes, memoryview]],
+    band_height: int,
+) -> Iterator[bytearray]:
+    plane_count = len(planes)
+    if plane_count == 0 or plane_count > 255:
+        raise ValueError(f"Invalid number of bit planes: {plane_count}")
+    levels = bytes(
+        level * 255 // plane_count if level <= plane_count else 0
+        for level in range(256)
+    )
+
+    pixel_iterators = [_iter_bit_plane_pixels(plane) for plane in planes]
+    buffers = [bytearray() for _ in planes]
+    for band_start in range(0, height, band_height):
+        band_size = width * min(band_height, height - band_start)
+        for (pixel_iterator, buffer) in zip(pixel_iterators, buffers):
+            while len(buffer) < band_size:
+                pixels = next(pixel_iterator, None)
+                if pixels is None:
+                    buffer += bytes(band_size - len(buffer))
+                    break
+                buffer += pixels
+
+        if plane_count == 1:
+            band = buffers[0][:band_size]
+        else:
+            # every pixel is either 0 or 1 and there are less than 256 planes,
+            # so adding the planes up as big integers never carries over from
+            # one pixel to the next
+            lit_plane_counts = sum(
+                int.from_bytes(memoryview(buffer)[:band_size], "little")
+                for buffer in buffers
+            )
+            band = bytearray(lit_plane_counts.to_bytes(band_size, "little"))
+        for buffer in buffers:
+            del buffer[:band_size]
+        yield band.translate(levels)
+
+
+def decode_bit_planes(
+    width: int, height: int, planes: Sequence[Union[bytes, memoryview]]
+) -> bytearray:
+    """
+    Decodes a layer image stored as one 1-bit run-length encoded plane per
+    level of anti-aliasing, as used by .cbddlp and .photon files, into 8-bit
+    grayscale pixels. Pixels lit in every plane are white, and pixels lit in
+    only some of them are shades of gray.
+    """
+    # decoding in bands is faster than decoding the whole layer at once, as the
+    # bands of every plane fit in the CPU caches
+    return bytearray().join(_iter_bit_plane_bands(width, height, planes, 64))
+
+
+class _LayerAreaAccumulator:
+    """
+    Keeps track of the lit pixels of a layer given as runs of pixels, without
+    ever rasterizing it.
+    """
+
+    width: int
+    lit_pixel_count: int
+    intensity: int
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.lit_pixel_count = 0
+        self.intensity = 0
+        (self.min_x, self.min_y, self.max_x, self.max_y) = (width, -1, -1, -1)
+
+    def _add_span(self, first: int, last: int) -> None:
+        (first_y, first_x) = divmod(first, self.width)
+        (last_y, last_x) = divmod(last, self.width)
+        if first_y != last_y:
+            # the span wraps around to the next row, so it touches both edges
+            (first_x, last_x) = (0, self.width - 1)
+        if self.min_y < 0:
+            self.min_y = first_y
+        self.min_x = min(self.min_x, first_x)
+        self.max_x = max(self.max_x, last_x)
+        self.max_y = last_y
+
+    def add_run(self, start: int, length: int, gray: int) -> None:
+        if gray == 0 or length <= 0:
+            return
+        self.lit_pixel_count += length
+        self.intensity += gray * length
+        self._add_span(start, start + length - 1)
+
+    def add_pixels(self, start: int, pixels: bytes) -> None:
+        # single pixels are handled a row at a time with bytes methods, which
+        # find the lit ones without looping over them in Python
+        offset = 0
+        while offset < len(pixels):
+            row_end = min(
+                len(pixels), offset + self.width - (start + offset) % self.width
+            )
+            row = pixels[offset:row_end].rstrip(b"\0")
+            lit_pixels = row.lstrip(b"\0")
+            if lit_pixels:
+                first = start + offset + len(row) - len(lit_pixels)
+                self.lit_pixel_count += len(lit_pixels) - lit_pixels.count(0)
+                self.intensity += sum(lit_pixels)
+                self._add_span(first, first + len(lit_pixels) - 1)
+            offset = row_end
+
+    def get_bounding_box(self) -> Optional[Tuple[int, int, int, int]]:
+        if self.lit_pixel_count == 0:
+            return None
+        return (self.min_x, self.min_y, self.max_x, self.max_y)
+
+
+def get_grayscale_layer_area(width: int, pixels: Union[bytes, bytearray]) -> LayerArea:
+    accumulator = _LayerAreaAccumulator(width)
+    accumulator.add_pixels(0, bytes(pixels))
+    return LayerArea(
+        lit_pixel_count=accumulator.lit_pixel_count,
+        area_px=accumulator.intensity / 255,
+        bounding_box=accumulator.get_bounding_box(),
+    )
+
+
+def get_rle7_layer_area(
+    width: int, height: int, data: Union[bytes, memoryview]
+) -> LayerArea:
+    size = width * height
+    accumulator = _LayerAreaAccumulator(width)
+    position = 0
+    for (literals, value, length) in _iter_rle7_chunks(bytes(data)):
+        pixels = literals[: size - position].translate(_RLE7_TO_GRAY)
+        accumulator.add_pixels(position, pixels)
+        position += len(pixels)
+        length = min(length, size - position)
+        accumulator.add_run(position, length, _RLE7_TO_GRAY[value])
+        position += length
+        if position >= size:
+            break
+    return LayerArea(
+        lit_pixel_count=accumulator.lit_pixel_count,
+        area_px=accumulator.intensity / 255,
+        bounding_box=accumulator.get_bounding_box(),
+    )
+
+
+_BIT_PLANE_RUN_LENGTHS: bytes = bytes(code & 0x7F for code in range(256))
+_BIT_PLANE_LIT_RUN_LENGTHS: bytes = bytes(
+    code & 0x7F if code & 0x80 else 0 for code in range(256)
+)
+
+
+def count_bit_plane_pixels(data: Union[bytes, memoryview]) -> int:
+    return sum(bytes(data).translate(_BIT_PLANE_RUN_LENGTHS))
+
+
+def get_bit_plane_layer_area(
+    width: int, height: int, planes: Sequence[Union[bytes, memoryview]]
+) -> LayerArea:
+    """
+    Anti-aliasing planes are nested, with every plane lighting the pixels above
+    its own gray threshold, so the lit pixels of the layer are the ones of the
+    plane that lights the most of them.
+    """
+    size = width * height
+    accumulators: List[_LayerAreaAccumulator] = []
+    for plane in planes:
+        accumulator = _LayerAreaAccumulator(width)
+        data = bytes(plane)
+        lit_run_lengths = data.translate(_BIT_PLANE_LIT_RUN_LENGTHS)
+        # the end of every run comes from a running sum of the run lengths,
+        # and only lit runs make it to the Python loop
+        run_ends = accumulate(data.translate(_BIT_PLANE_RUN_LENGTHS))
+        lit_runs = compress(zip(run_ends, lit_run_lengths), lit_run_lengths)
+        for (end, length) in lit_runs:
+            if end > size:
+                length -= end - size
+                end = size
+            accumulator.add_run(end - length, length, 255)
+            if end >= size:
+                break
+        accumulators.append(accumulator)
+
+    bounding_boxes = [
+        bounding_box
+        for bounding_box in map(_LayerAreaAccumulator.get_bounding_box, accumulators)
+        if bounding_box is not None
+    ]
+    bounding_box = None
+    if bounding_boxes:
+        (min_xs, min_ys, max_xs, max_ys) = zip(*bounding_boxes)
+        bounding_box = (min(min_xs), min(min_ys), max(max_xs), max(max_ys))
+    lit_pixel_counts = [accumulator.lit_pixel_count for accumulator in accumulators]
+    return LayerArea(
+        lit_pixel_count=max(lit_pixel_counts, default=0),
+        area_px=sum(lit_pixel_counts) / max(1, len(lit_pixel_counts)),
+        bounding_box=bounding_box,
+    )
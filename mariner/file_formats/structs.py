@@ -0,0 +1,89 @@
+import dataclasses
+import mmap
+import struct
+from abc import ABC
+from typing import Dict, Tuple, Type, TypeVar, Union
+
+import typedstruct
+
+
+TStruct = TypeVar("TStruct", bound="LittleEndianStruct")
+TStructType = TypeVar("TStructType", bound=Type["LittleEndianStruct"])
+
+
+class LittleEndianStruct(typedstruct.LittleEndianStruct, ABC):
+    """
+    A typedstruct struct that is decoded through a struct.Struct compiled by
+    the @compiled_struct decorator. typedstruct works out the format from the
+    dataclass fields and goes through the frozen dataclass constructor on every
+    call, which dominates the time it takes to parse headers and layer tables.
+    """
+
+    _codec: struct.Struct
+    _field_names: Tuple[str, ...]
+    _field_codecs: Dict[str, Tuple[int, struct.Struct]]
+
+    @classmethod
+    def get_codec(cls) -> struct.Struct:
+        return cls.__dict__["_codec"]
+
+    @classmethod
+    def get_field_names(cls) -> Tuple[str, ...]:
+        return cls.__dict__["_field_names"]
+
+    @classmethod
+    def get_field_offset(cls, field_name: str) -> int:
+        (offset, _) = cls.__dict__["_field_codecs"][field_name]
+        return offset
+
+    @classmethod
+    def pack_field(cls, field_name: str, value: Union[int, float]) -> bytes:
+        (_, codec) = cls.__dict__["_field_codecs"][field_name]
+        return codec.pack(value)
+
+    @classmethod
+    def get_format(cls) -> str:
+        return cls.get_codec().format
+
+    @classmethod
+    def get_size(cls) -> int:
+        return cls.get_codec().size
+
+    @classmethod
+    def from_values(cls: Type[TStruct], values: Tuple) -> TStruct:
+        # the fields are already of the right type, so we skip the checks and
+        # the object.__setattr__ calls of the frozen dataclass constructor
+        record = object.__new__(cls)
+        record.__dict__.update(zip(cls.__dict__["_field_names"], values))
+        return record
+
+    @classmethod
+    def unpack(cls: Type[TStruct], buffer: Union[bytes, memoryview]) -> TStruct:
+        return cls.from_values(cls.__dict__["_codec"].unpack(buffer))
+
+    @classmethod
+    def unpack_from(
+        cls: Type[TStruct], buffer: Union[bytes, memoryview, mmap.mmap], offset: int = 0
+    ) -> TStruct:
+        return cls.from_values(cls.__dict__["_codec"].unpack_from(buffer, offset))
+
+
+def compiled_struct(cls: TStructType) -> TStructType:
+    """
+    Compiles the format of a struct dataclass once, at import time. It must be
+    applied on top of @dataclass, once the fields are known.
+    """
+    fields = dataclasses.fields(cls)
+    cls._codec = struct.Struct(
+        cls.FORMAT_PREFIX + "".join(field.metadata["format"] for field in fields)
+    )
+    cls._field_names = tuple(field.name for field in fields)
+    # every field gets its own codec as well, so single fields can be patched
+    # in place without rewriting the whole struct
+    cls._field_codecs = {}
+    offset = 0
+    for field in fields:
+        field_codec = struct.Struct(cls.FORMAT_PREFIX + field.metadata["format"])
+        cls._field_codecs[field.name] = (offset, field_codec)
+        offset += field_codec.size
+    return cls
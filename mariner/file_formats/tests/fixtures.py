@@ -0,0 +1,30 @@
+import pathlib
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Type, Union
+
+from mariner.file_formats.structs import LittleEndianStruct
+
+
+def pack_struct(
+    struct_type: Type[LittleEndianStruct], **values: Union[int, float, bytes]
+) -> bytes:
+    """
+    Packs a struct with the given fields, and every other field set to 0. The
+    sample files only come in a few sizes, so this is how tests build the files
+    with the exact headers they need.
+    """
+    field_names = struct_type.get_field_names()
+    unknown_field_names = set(values.keys()) - set(field_names)
+    assert not unknown_field_names, f"Unknown fields {unknown_field_names}"
+    field_values = dict.fromkeys(field_names, 0)
+    field_values.update(values)
+    return struct_type.get_codec().pack(*field_values.values())
+
+
+@contextmanager
+def temporary_file(filename: str, data: bytes) -> Iterator[pathlib.Path]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / filename
+        path.write_bytes(data)
+        yield path
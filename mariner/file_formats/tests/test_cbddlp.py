@@ -7,6 +7,8 @@ import png
 from pyexpect import expect
 
 from mariner.file_formats.cbddlp import CBDDLPFile
+from mariner.file_formats.ctb import CBDDLP_MAGIC, CTBHeader, CTBSlicer
+from mariner.file_formats.tests.fixtures import pack_struct, temporary_file
 
 
 class CBDDLPFileTest(TestCase):
@@ -29,6 +31,40 @@ class CBDDLPFileTest(TestCase):
         expect(cbddlp_file.slicer_version).to_equal("1.7.0.0")
         expect(cbddlp_file.printer_name).to_equal("ELEGOO MARS")
 
+    def test_loading_cbddlp_file_summary(self) -> None:
+        # the summary only comes from the header and the printer name it points
+        # to, so a file holding nothing but those is enough to read it
+        header = pack_struct(
+            CTBHeader,
+            magic=CBDDLP_MAGIC,
+            version=2,
+            bed_size_x_mm=68.04,
+            bed_size_y_mm=120.96,
+            bed_size_z_mm=150.0,
+            height_mm=2.5,
+            layer_height_mm=0.05,
+            layer_count=50,
+            resolution_x=1440,
+            resolution_y=2560,
+            slicer_offset=CTBHeader.get_size(),
+            print_time=931,
+        )
+        slicer = pack_struct(
+            CTBSlicer,
+            machine_offset=CTBHeader.get_size() + CTBSlicer.get_size(),
+            machine_size=len("ELEGOO MARS"),
+        )
+        with temporary_file("pyramid.cbddlp", header + slicer + b"ELEGOO MARS") as path:
+            summary = CBDDLPFile.read_summary(path)
+        expect(summary.filename).to_equal("pyramid.cbddlp")
+        expect(summary.bed_size_mm).to_equal((68.04, 120.96, 150.0))
+        expect(summary.height_mm).close_to(2.5, max_delta=1e-6)
+        expect(summary.layer_height_mm).close_to(0.05, max_delta=1e-6)
+        expect(summary.layer_count).to_equal(50)
+        expect(summary.resolution).to_equal((1440, 2560))
+        expect(summary.printer_name).to_equal("ELEGOO MARS")
+        expect(summary.print_time_secs).to_equal(931)
+
     def test_preview_rendering(self) -> None:
         path = pathlib.Path(__file__).parent.absolute() / "pyramid.cbddlp"
         bytes = io.BytesIO()
@@ -0,0 +1,142 @@
+import io
+import pathlib
+import tempfile
+import zipfile
+from typing import List
+from unittest import TestCase
+
+import png
+from pyexpect import expect
+
+from mariner.exceptions import UnsupportedFileFormat
+from mariner.file_formats.utils import get_file_format
+from mariner.file_formats.chitubox_zip import ZIPFile
+
+
+GCODE = """;fileName:cube
+;machineType:Phrozen Sonic Mini
+;estimatedPrintTime:120
+;layerHeight:0.05
+;normalExposureTime:8
+;bottomLayerExposureTime:60
+;normalDropSpeed:150
+;normalLayerLiftHeight:5
+;normalLayerLiftSpeed:100
+;bottomLayerCount:1
+;totalLayer:3
+;bottomLayerLiftHeight:5
+;bottomLayerLiftSpeed:90
+;bottomLightOffTime:0
+;lightOffTime:1
+;resolutionX:4
+;resolutionY:2
+;machineX:68.04
+;machineY:120.96
+;machineZ:150
+;START_GCODE_BEGIN
+G21;
+G90;
+"""
+
+
+def _encode_png(rows: List[List[int]], mode: str) -> bytes:
+    data = io.BytesIO()
+    png.from_array(rows, mode).write(data)
+    return data.getvalue()
+
+
+class ZIPFileTest(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.directory.name) / "cube.zip"
+        self.layer_pngs = [
+            _encode_png([[255, 255, 255, 255], [255, 255, 255, 255]], "L"),
+            _encode_png([[0, 255, 128, 0], [0, 255, 255, 0]], "L"),
+            _encode_png([[0, 0, 0, 0], [0, 0, 0, 0]], "L"),
+        ]
+        with zipfile.ZipFile(self.path, "w") as archive:
+            archive.writestr("run.gcode", GCODE, zipfile.ZIP_DEFLATED)
+            archive.writestr(
+                "preview.png", _encode_png([[255, 0, 0] * 2] * 2, "RGB")
+            )
+            for (layer, data) in enumerate(self.layer_pngs):
+                archive.writestr(f"{layer + 1}.png", data)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_loading_zip_file(self) -> None:
+        expect(get_file_format(str(self.path))).to_equal(ZIPFile)
+        zip_file = ZIPFile.read(self.path)
+        expect(zip_file.filename).to_equal("cube.zip")
+        expect(zip_file.bed_size_mm).to_equal((68.04, 120.96, 150.0))
+        expect(zip_file.height_mm).to_equal(0.15)
+        expect(zip_file.layer_count).to_equal(3)
+        expect(zip_file.resolution).to_equal((4, 2))
+        expect(zip_file.print_time_secs).to_equal(120)
+        expect(zip_file.printer_name).to_equal("Phrozen Sonic Mini")
+
+    def test_layer_table_points_into_the_archive(self) -> None:
+        layer_table = ZIPFile.read_layer_table(self.path)
+        expect(layer_table.layer_exposure).to_equal((60.0, 8.0, 8.0))
+        with open(self.path, "rb") as file:
+            data = file.read()
+        for (layer, layer_png) in enumerate(self.layer_pngs):
+            start = layer_table.image_offset[layer]
+            end = start + layer_table.image_length[layer]
+            expect(data[start:end]).to_equal(layer_png)
+
+    def test_layer_image_decoding(self) -> None:
+        layer_image = ZIPFile.read_layer_image(self.path, 1)
+        expect((layer_image.width, layer_image.height)).to_equal((4, 2))
+        expect(layer_image.pixels).to_equal(bytearray([0, 255, 128, 0, 0, 255, 255, 0]))
+        with self.assertRaises(IndexError):
+            ZIPFile.read_layer_image(self.path, 3)
+
+    def test_previews(self) -> None:
+        preview = ZIPFile.read_preview(self.path)
+        expect([list(row) for row in preview.rows]).to_equal(
+            [[255, 0, 0] * 2] * 2
+        )
+        # the cropped preview is missing, so we fall back to the full one
+        expect(ZIPFile.read_thumbnail(self.path).info["width"]).to_equal(2)
+
+    def test_layer_area_table_and_print_simulation(self) -> None:
+        layer_area_table = ZIPFile.read_layer_area_table(self.path)
+        expect(layer_area_table.lit_pixel_count).to_equal((8, 4, 0))
+        expect(layer_area_table.max_x[1]).to_equal(2)
+
+        print_timeline = ZIPFile.simulate_print(self.path)
+        # exposure, then lifting 5mm at 90mm/min and retracting at 150mm/min
+        expect(print_timeline.layer_end_secs[0]).close_to(65.333, max_delta=1e-3)
+        expect(print_timeline.light_off_secs).to_equal((0.0, 1.0, 1.0))
+
+    def test_validation(self) -> None:
+        report = ZIPFile.validate(self.path, check_layer_pixels=True)
+        expect(report.errors).to_equal([])
+        expect(report.checked_layer_pixels).to_equal(True)
+
+        with open(self.path, "rb") as file:
+            data = file.read()
+        truncated_path = pathlib.Path(self.directory.name) / "truncated.zip"
+        with open(truncated_path, "wb") as file:
+            file.write(data[:-100])
+        report = ZIPFile.validate(truncated_path, check_layer_pixels=True)
+        expect(report.is_valid()).to_equal(False)
+
+    def test_zip_file_without_gcode(self) -> None:
+        path = pathlib.Path(self.directory.name) / "photos.zip"
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("1.png", self.layer_pngs[0])
+        with self.assertRaises(UnsupportedFileFormat):
+            ZIPFile.read_summary(path)
+        expect(ZIPFile.validate(path).is_valid()).to_equal(False)
+
+    def test_truncated_zip_file(self) -> None:
+        with open(self.path, "rb") as file:
+            data = file.read()
+        truncated_path = pathlib.Path(self.directory.name) / "truncated.zip"
+        with open(truncated_path, "wb") as file:
+            file.write(data[:-100])
+        with self.assertRaises(UnsupportedFileFormat):
+            ZIPFile.read_summary(truncated_path)
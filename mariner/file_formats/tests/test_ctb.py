@@ -1,12 +1,23 @@
 import hashlib
 import io
+import mmap
 import pathlib
+import struct
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 
 import png
 from pyexpect import expect
 
-from mariner.file_formats.ctb import CTBFile
+from mariner.file_formats import PrintSettingsPatch
+from mariner.file_formats.ctb import (
+    CTBFile,
+    CTBHeader,
+    CTBLayerDef,
+    CTBLayerDefEx,
+    CTBParam,
+)
 
 
 class CTBFileTest(TestCase):
@@ -29,6 +40,18 @@ class CTBFileTest(TestCase):
         expect(ctb_file.slicer_version).to_equal("1.6.5.1")
         expect(ctb_file.printer_name).to_equal("ELEGOO MARS Pro")
 
+    def test_loading_ctb_file_summary(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        summary = CTBFile.read_summary(path)
+        expect(summary.filename).to_equal("stairs.ctb")
+        expect(summary.bed_size_mm).to_equal((68.04, 120.96, 150.0))
+        expect(summary.height_mm).close_to(20.0, max_delta=1e-9)
+        expect(summary.layer_height_mm).close_to(0.05, max_delta=1e-9)
+        expect(summary.layer_count).to_equal(400)
+        expect(summary.resolution).to_equal((1440, 2560))
+        expect(summary.printer_name).to_equal("ELEGOO MARS Pro")
+        expect(summary.print_time_secs).to_equal(5621)
+
     def test_preview_rendering(self) -> None:
         path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
         bytes = io.BytesIO()
@@ -41,3 +64,252 @@ class CTBFileTest(TestCase):
         expect(hashlib.md5(bytes.getvalue()).hexdigest()).to_equal(
             "ca98c806d42898ba70626e556f714928"
         )
+
+    def test_thumbnail_rendering(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        bytes = io.BytesIO()
+        thumbnail_image: png.Image = CTBFile.read_thumbnail(path)
+        thumbnail_image.write(bytes)
+        expect(thumbnail_image.info["width"]).to_equal(200)
+        expect(thumbnail_image.info["height"]).to_equal(125)
+        expect(thumbnail_image.info["bitdepth"]).to_equal(5)
+        expect(thumbnail_image.info["alpha"]).is_false()
+        expect(hashlib.md5(bytes.getvalue()).hexdigest()).to_equal(
+            "134dd2c8ed1ddbc53aee070c8f17c9cf"
+        )
+
+    def test_loading_layer_table(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        layer_table = CTBFile.read_layer_table(path)
+        expect(len(layer_table.image_offset)).to_equal(400)
+        expect(layer_table.image_offset[:2]).to_equal((24571, 26356))
+        expect(layer_table.image_length[:2]).to_equal((1701, 1701))
+        expect(layer_table.layer_exposure[:6]).to_equal(
+            (60.0, 60.0, 60.0, 60.0, 8.0, 8.0)
+        )
+        expect(layer_table.layer_off_time[0]).to_equal(0.0)
+        expect(layer_table.layer_height_mm[-1]).close_to(20.0, max_delta=1e-6)
+        expect(layer_table.get_end_byte_offsets()).to_equal(
+            CTBFile.read(path).end_byte_offset_by_layer
+        )
+
+    def test_layer_image_decoding(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        layer_image = CTBFile.read_layer_image(path, 0)
+        expect(layer_image.width).to_equal(1440)
+        expect(layer_image.height).to_equal(2560)
+        expect(len(layer_image.pixels)).to_equal(1440 * 2560)
+        expect(len(layer_image.pixels) - layer_image.pixels.count(0)).to_equal(224720)
+        expect(max(layer_image.pixels)).to_equal(255)
+
+        # the last layer is a lot smaller, with anti-aliased edges
+        layer_image = CTBFile.read_layer_image(path, 399)
+        expect(len(layer_image.pixels) - layer_image.pixels.count(0)).to_equal(21876)
+        expect(len(set(layer_image.pixels))).is_greater_than(2)
+
+        with self.assertRaises(IndexError):
+            CTBFile.read_layer_image(path, -1)
+        with self.assertRaises(IndexError):
+            CTBFile.read_layer_image(path, 400)
+
+    def test_layer_area_table(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        layer_area_table = CTBFile.read_layer_area_table(path)
+        expect(len(layer_area_table.lit_pixel_count)).to_equal(400)
+        expect(layer_area_table.lit_pixel_count[0]).to_equal(224720)
+        expect(layer_area_table.lit_pixel_count[399]).to_equal(21876)
+        expect(layer_area_table.area_px[399]).close_to(21212.5176, max_delta=1e-3)
+        expect(
+            (
+                layer_area_table.min_x[399],
+                layer_area_table.min_y[399],
+                layer_area_table.max_x[399],
+                layer_area_table.max_y[399],
+            )
+        ).to_equal((1143, 1174, 1249, 1385))
+        expect(layer_area_table.get_area_mm2(0)).close_to(500.0, max_delta=0.1)
+        # the slicer estimates 7.768ml of resin for this file
+        expect(layer_area_table.get_total_volume_ml()).close_to(7.768, max_delta=1e-3)
+        expect(layer_area_table.get_used_volume_fraction(0)).to_equal(0.0)
+        expect(layer_area_table.get_used_volume_fraction(400)).close_to(
+            1.0, max_delta=1e-9
+        )
+
+    def test_layers_are_read_through_a_mapping(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        with patch("mariner.file_formats.mmap.mmap", wraps=mmap.mmap) as mmap_mock:
+            layer_image = CTBFile.read_layer_image(path, 399)
+            layer_area_table = CTBFile.read_layer_area_table(path)
+            report = CTBFile.validate(path, check_layer_pixels=True)
+        expect(mmap_mock.call_count).to_equal(3)
+
+        # files that can't be mapped are read into memory instead
+        with patch("mariner.file_formats.mmap.mmap", side_effect=ValueError):
+            expect(CTBFile.read_layer_image(path, 399)).to_equal(layer_image)
+            expect(CTBFile.read_layer_area_table(path)).to_equal(layer_area_table)
+            expect(CTBFile.validate(path, check_layer_pixels=True)).to_equal(report)
+
+    def test_validation(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        report = CTBFile.validate(path, check_layer_pixels=True)
+        expect(report.is_valid()).to_equal(True)
+        expect(report.checked_layer_pixels).to_equal(True)
+
+        with open(path, "rb") as file:
+            data = file.read()
+        header = CTBHeader.unpack_from(data)
+        with tempfile.TemporaryDirectory() as directory:
+            truncated_path = pathlib.Path(directory) / "truncated.ctb"
+            with open(truncated_path, "wb") as file:
+                file.write(data[:400000])
+            report = CTBFile.validate(truncated_path, check_layer_pixels=True)
+            expect(report.errors).to_equal(
+                [
+                    "191 layers end past the end of the file (400000 bytes), "
+                    + "starting with layer 209"
+                ]
+            )
+            expect(report.checked_layer_pixels).to_equal(False)
+
+            # cutting the image of the first layer short leaves it with fewer
+            # pixels than the screen has
+            corrupted_data = bytearray(data)
+            struct.pack_into("<I", corrupted_data, header.layer_defs_offset + 16, 10)
+            corrupted_path = pathlib.Path(directory) / "corrupted.ctb"
+            with open(corrupted_path, "wb") as file:
+                file.write(corrupted_data)
+            expect(CTBFile.validate(corrupted_path).is_valid()).to_equal(True)
+            report = CTBFile.validate(corrupted_path, check_layer_pixels=True)
+            expect(len(report.errors)).to_equal(1)
+            expect(report.errors[0]).to_start_with(
+                "1 layers have invalid runs, starting with layer 0: "
+            )
+
+    def test_print_simulation(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        motion_profile = CTBFile.read_motion_profile(path)
+        expect(motion_profile.bottom_layer_count).to_equal(5)
+        expect(motion_profile.lift_speed_mm_per_min).to_equal(100.0)
+        # version 3 files store the moves of every layer next to its image
+        expect(len(motion_profile.layer_lift_speed_mm_per_min)).to_equal(400)
+        expect(motion_profile.layer_lift_speed_mm_per_min[:5]).to_equal(
+            (90.0, 90.0, 90.0, 90.0, 100.0)
+        )
+        expect(motion_profile.layer_retract_speed_mm_per_min[0]).to_equal(0.0)
+
+        print_timeline = CTBFile.simulate_print(path)
+        expect(len(print_timeline.layer_end_secs)).to_equal(400)
+        # the first 4 layers are lifted 5mm at 90mm/min, and the rest at
+        # 100mm/min, even though the header counts 5 bottom layers. the bottom
+        # layers have no retract speed of their own, so all of them are
+        # retracted at the 150mm/min of the print parameters.
+        expect(print_timeline.lift_secs[0]).close_to(3.333, max_delta=1e-3)
+        expect(print_timeline.lift_secs[4]).close_to(3.0, max_delta=1e-9)
+        expect(print_timeline.retract_secs[0]).close_to(2.0, max_delta=1e-9)
+        expect(print_timeline.retract_secs[5]).close_to(2.0, max_delta=1e-9)
+        expect(print_timeline.layer_end_secs[0]).close_to(65.333, max_delta=1e-3)
+        # the slicer estimates 5621 seconds for this file
+        expect(print_timeline.get_total_secs()).close_to(5409.333, max_delta=1e-3)
+        expect(print_timeline.get_time_left_secs(0)).to_equal(
+            print_timeline.get_total_secs()
+        )
+        expect(print_timeline.get_time_left_secs(400)).to_equal(0.0)
+
+    def test_print_settings_patching(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        with open(path, "rb") as file:
+            data = file.read()
+
+        def unpack_layer_def_ex(patched_data: bytes, layer: int) -> CTBLayerDefEx:
+            header = CTBHeader.unpack_from(patched_data)
+            layer_def = CTBLayerDef.unpack_from(
+                patched_data, header.layer_defs_offset + layer * CTBLayerDef.get_size()
+            )
+            return CTBLayerDefEx.unpack_from(
+                patched_data, layer_def.image_offset - CTBLayerDefEx.get_size()
+            )
+
+        with tempfile.TemporaryDirectory() as directory:
+            patched_path = pathlib.Path(directory) / "patched.ctb"
+            with open(patched_path, "wb") as file:
+                file.write(data)
+
+            CTBFile.patch_print_settings(
+                patched_path,
+                PrintSettingsPatch(
+                    exposure_secs=2.5, bottom_exposure_secs=40.0, lift_height_mm=6.0
+                ),
+            )
+            with open(patched_path, "rb") as file:
+                patched_data = file.read()
+            expect(len(patched_data)).to_equal(len(data))
+            header = CTBHeader.unpack_from(patched_data)
+            expect(header.layer_exposure).to_equal(2.5)
+            expect(header.bottom_exposure).to_equal(40.0)
+            param = CTBParam.unpack_from(patched_data, header.param_offset)
+            expect(param.lift_height).to_equal(6.0)
+            expect(param.bottom_lift_height).to_equal(5.0)
+            layer_exposures = [
+                CTBLayerDef.unpack_from(
+                    patched_data, header.layer_defs_offset + i * CTBLayerDef.get_size()
+                ).layer_exposure
+                for i in range(header.layer_count)
+            ]
+            expect(layer_exposures[:5]).to_equal([40.0] * 5)
+            expect(set(layer_exposures[5:])).to_equal({2.5})
+            report = CTBFile.validate(patched_path, check_layer_pixels=True)
+            expect(report.is_valid()).to_equal(True)
+            expect(CTBFile.read_motion_profile(patched_path).lift_height_mm).to_equal(
+                6.0
+            )
+            # version 3 files have a copy of every layer definition along with
+            # the moves of the layer, which are patched too
+            bottom_layer_def_ex = unpack_layer_def_ex(patched_data, 0)
+            expect(bottom_layer_def_ex.layer_exposure).to_equal(40.0)
+            expect(bottom_layer_def_ex.lift_height).to_equal(5.0)
+            layer_def_ex = unpack_layer_def_ex(patched_data, 10)
+            expect(layer_def_ex.layer_exposure).to_equal(2.5)
+            expect(layer_def_ex.lift_height).to_equal(6.0)
+            expect(layer_def_ex.lift_speed).to_equal(100.0)
+            # the estimate of the slicer is replaced by the simulated print time
+            expect(CTBFile.read_summary(patched_path).print_time_secs).to_equal(
+                round(CTBFile.simulate_print(patched_path).get_total_secs())
+            )
+            expect(CTBFile.read_summary(patched_path).print_time_secs).to_equal(3584)
+
+            # patching a range of layers leaves the header and the rest alone
+            CTBFile.patch_print_settings(
+                patched_path,
+                PrintSettingsPatch(exposure_secs=4.0, layer_range=(100, 200)),
+            )
+            with open(patched_path, "rb") as file:
+                patched_data = file.read()
+            expect(CTBHeader.unpack_from(patched_data).layer_exposure).to_equal(2.5)
+            layer_exposures = [
+                CTBLayerDef.unpack_from(
+                    patched_data, header.layer_defs_offset + i * CTBLayerDef.get_size()
+                ).layer_exposure
+                for i in [99, 100, 199, 200]
+            ]
+            expect(layer_exposures).to_equal([2.5, 4.0, 4.0, 2.5])
+            layer_exposures = [
+                unpack_layer_def_ex(patched_data, i).layer_exposure
+                for i in [99, 100, 199, 200]
+            ]
+            expect(layer_exposures).to_equal([2.5, 4.0, 4.0, 2.5])
+
+            # layer tables don't have a lift height, so it can't be changed for
+            # a range of layers, even though version 3 files have one per layer
+            with self.assertRaises(ValueError):
+                CTBFile.patch_print_settings(
+                    patched_path,
+                    PrintSettingsPatch(lift_height_mm=7.0, layer_range=(100, 200)),
+                )
+            with open(patched_path, "rb") as file:
+                expect(file.read()).to_equal(patched_data)
+
+            with self.assertRaises(IndexError):
+                CTBFile.patch_print_settings(
+                    patched_path,
+                    PrintSettingsPatch(exposure_secs=4.0, layer_range=(300, 401)),
+                )
@@ -6,7 +6,8 @@ from unittest import TestCase
 import png
 from pyexpect import expect
 
-from mariner.file_formats.fdg import FDGFile
+from mariner.file_formats.fdg import FDG_MAGIC, FDGFile, FDGHeader
+from mariner.file_formats.tests.fixtures import pack_struct, temporary_file
 
 
 class FDGFileTest(TestCase):
@@ -29,6 +30,36 @@ class FDGFileTest(TestCase):
         expect(fdg_file.slicer_version).to_equal("1.8.1.0")
         expect(fdg_file.printer_name).to_equal("Voxelab Proxima 6")
 
+    def test_loading_fdg_file_summary(self) -> None:
+        # the summary only comes from the header and the printer name it points
+        # to, so a file holding nothing but those is enough to read it
+        header = pack_struct(
+            FDGHeader,
+            magic=FDG_MAGIC,
+            version=2,
+            bed_size_x_mm=82.62,
+            bed_size_y_mm=130.56,
+            bed_size_z_mm=155.0,
+            height_mm=20.0,
+            layer_height_mm=0.05,
+            layer_count=400,
+            resolution_x=1620,
+            resolution_y=2560,
+            print_time=4243,
+            machine_offset=FDGHeader.get_size(),
+            machine_size=len("Voxelab Proxima 6"),
+        )
+        with temporary_file("stairs.fdg", header + b"Voxelab Proxima 6") as path:
+            summary = FDGFile.read_summary(path)
+        expect(summary.filename).to_equal("stairs.fdg")
+        expect(summary.bed_size_mm).to_equal((82.62, 130.56, 155.0))
+        expect(summary.height_mm).close_to(20.0, max_delta=1e-6)
+        expect(summary.layer_height_mm).close_to(0.05, max_delta=1e-6)
+        expect(summary.layer_count).to_equal(400)
+        expect(summary.resolution).to_equal((1620, 2560))
+        expect(summary.printer_name).to_equal("Voxelab Proxima 6")
+        expect(summary.print_time_secs).to_equal(4243)
+
     def test_preview_rendering(self) -> None:
         path = pathlib.Path(__file__).parent.absolute() / "stairs.fdg"
         bytes = io.BytesIO()
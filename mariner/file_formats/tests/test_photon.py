@@ -6,7 +6,14 @@ from unittest import TestCase
 import png
 from pyexpect import expect
 
-from mariner.file_formats.photon import PhotonFile
+from mariner.file_formats.photon import (
+    PHOTON_MAGIC,
+    PhotonFile,
+    PhotonHeader,
+    PhotonLayerDef,
+    PhotonSlicer,
+)
+from mariner.file_formats.tests.fixtures import pack_struct, temporary_file
 
 
 class PhotonFileTest(TestCase):
@@ -30,6 +37,42 @@ class PhotonFileTest(TestCase):
         expect(photon_file.slicer_version).to_equal("1.7.0.0")
         expect(photon_file.printer_name).to_equal("AnyCubic Photon")
 
+    def test_loading_photon_file_summary(self) -> None:
+        # the summary only comes from the header and the printer name it points
+        # to, so a file holding nothing but those is enough to read it
+        header = pack_struct(
+            PhotonHeader,
+            magic=PHOTON_MAGIC,
+            version=2,
+            bed_size_x_mm=68.04,
+            bed_size_y_mm=120.96,
+            bed_size_z_mm=150.0,
+            height_mm=17.0,
+            layer_height_mm=0.05,
+            layer_count=340,
+            resolution_x=1440,
+            resolution_y=2560,
+            slicer_offset=PhotonHeader.get_size(),
+            print_time=5171,
+        )
+        slicer = pack_struct(
+            PhotonSlicer,
+            machine_offset=PhotonHeader.get_size() + PhotonSlicer.get_size(),
+            machine_size=len("AnyCubic Photon"),
+        )
+        with temporary_file(
+            "stairs.photon", header + slicer + b"AnyCubic Photon"
+        ) as path:
+            summary = PhotonFile.read_summary(path)
+        expect(summary.filename).to_equal("stairs.photon")
+        expect(summary.bed_size_mm).to_equal((68.04, 120.96, 150.0))
+        expect(summary.height_mm).close_to(17.0, max_delta=1e-6)
+        expect(summary.layer_height_mm).close_to(0.05, max_delta=1e-6)
+        expect(summary.layer_count).to_equal(340)
+        expect(summary.resolution).to_equal((1440, 2560))
+        expect(summary.printer_name).to_equal("AnyCubic Photon")
+        expect(summary.print_time_secs).to_equal(5171)
+
     def test_preview_rendering(self) -> None:
         path = pathlib.Path(__file__).parent.absolute() / "stairs.photon"
         bytes = io.BytesIO()
@@ -42,3 +85,47 @@ class PhotonFileTest(TestCase):
         expect(hashlib.md5(bytes.getvalue()).hexdigest()).to_equal(
             "44e523ed707f3dfcad8071fe46c537f3"
         )
+
+    def test_layer_image_decoding(self) -> None:
+        # a 4x1 file with two layers, each of them split in three anti-aliasing
+        # planes of 1-bit runs
+        layer_count = 2
+        layer_planes = [
+            [bytes([0x84]), bytes([0x84]), bytes([0x84])],
+            [bytes([0x83, 0x01]), bytes([0x82, 0x02]), bytes([0x81, 0x03])],
+        ]
+        data = bytearray(
+            pack_struct(
+                PhotonHeader,
+                magic=PHOTON_MAGIC,
+                version=2,
+                layer_defs_offset=PhotonHeader.get_size(),
+                layer_count=layer_count,
+                resolution_x=4,
+                resolution_y=1,
+                anti_alias_level=3,
+            )
+        )
+        layer_defs_size = 3 * layer_count * PhotonLayerDef.get_size()
+        image_offset = PhotonHeader.get_size() + layer_defs_size
+        images = bytearray()
+        for plane in range(3):
+            for layer in range(layer_count):
+                image = layer_planes[layer][plane]
+                data += pack_struct(
+                    PhotonLayerDef,
+                    image_offset=image_offset + len(images),
+                    image_length=len(image),
+                )
+                images += image
+        data += images
+
+        with temporary_file("gradient.photon", bytes(data)) as path:
+            layer_image = PhotonFile.read_layer_image(path, 1)
+            expect(PhotonFile.read_layer_image(path, 0).pixels).to_equal(
+                bytearray([255, 255, 255, 255])
+            )
+            with self.assertRaises(IndexError):
+                PhotonFile.read_layer_image(path, 2)
+        expect((layer_image.width, layer_image.height)).to_equal((4, 1))
+        expect(layer_image.pixels).to_equal(bytearray([255, 170, 85, 0]))
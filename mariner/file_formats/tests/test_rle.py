@@ -0,0 +1,169 @@
+import struct
+from unittest import TestCase
+
+from pyexpect import expect
+
+from mariner.file_formats import LayerArea
+from mariner.file_formats.rle import (
+    REPEAT_RGB15_MASK,
+    count_bit_plane_pixels,
+    count_rle7_pixels,
+    decode_bit_planes,
+    decode_rgb15_rle,
+    decode_rle7_layer,
+    get_bit_plane_layer_area,
+    get_rle7_layer_area,
+    iter_rgb15_rows,
+    read_rgb15_image,
+)
+
+
+def _color16(r: int, g: int, b: int) -> int:
+    return r | (g << 6) | (b << 11)
+
+
+class RGB15RLETest(TestCase):
+    def test_single_pixels(self) -> None:
+        data = struct.pack("<2H", _color16(1, 2, 3), _color16(31, 0, 31))
+        expect(decode_rgb15_rle(2, 1, data)).to_equal(bytearray([1, 2, 3, 31, 0, 31]))
+
+    def test_repeated_pixels(self) -> None:
+        data = struct.pack(
+            "<3H",
+            _color16(4, 5, 6) | REPEAT_RGB15_MASK,
+            0x3002,  # the upper 4 bits are not part of the repeat count
+            _color16(7, 8, 9),
+        )
+        expect(decode_rgb15_rle(4, 1, data)).to_equal(
+            bytearray([4, 5, 6] * 3 + [7, 8, 9])
+        )
+
+    def test_output_is_bounded_by_image_size(self) -> None:
+        data = struct.pack("<2H", _color16(1, 1, 1) | REPEAT_RGB15_MASK, 0xFFF)
+        expect(len(decode_rgb15_rle(2, 2, data))).to_equal(12)
+
+    def test_truncated_data(self) -> None:
+        data = struct.pack("<H", _color16(1, 1, 1) | REPEAT_RGB15_MASK) + b"\x00"
+        expect(decode_rgb15_rle(2, 2, data)).to_equal(bytearray(12))
+
+    def test_runs_spanning_several_rows(self) -> None:
+        data = struct.pack("<2H", _color16(1, 2, 3) | REPEAT_RGB15_MASK, 4)
+        expect(list(iter_rgb15_rows(2, 3, data))).to_equal(
+            [
+                bytearray([1, 2, 3, 1, 2, 3]),
+                bytearray([1, 2, 3, 1, 2, 3]),
+                bytearray([1, 2, 3, 0, 0, 0]),
+            ]
+        )
+
+    def test_read_image_fills_missing_rows(self) -> None:
+        data = struct.pack("<2H", _color16(1, 2, 3) | REPEAT_RGB15_MASK, 2)
+        image = read_rgb15_image(2, 2, data)
+        expect(image.info["width"]).to_equal(2)
+        expect(image.info["height"]).to_equal(2)
+        expect([list(row) for row in image.rows]).to_equal(
+            [[1, 2, 3, 1, 2, 3], [1, 2, 3, 0, 0, 0]]
+        )
+
+    def test_bogus_image_size(self) -> None:
+        data = struct.pack("<H", _color16(1, 2, 3))
+        with self.assertRaises(ValueError):
+            read_rgb15_image(100000, 100000, data)
+        with self.assertRaises(ValueError):
+            decode_rgb15_rle(0, 10, data)
+
+
+class RLE7Test(TestCase):
+    def test_single_pixels(self) -> None:
+        data = bytes([0x00, 0x7F, 0x20])
+        expect(decode_rle7_layer(3, 1, data)).to_equal(bytearray([0, 255, 65]))
+
+    def test_runs(self) -> None:
+        data = bytes([0xFF, 0x03, 0x10, 0x80, 0x02])
+        expect(decode_rle7_layer(3, 2, data)).to_equal(
+            bytearray([255, 255, 255, 33, 0, 0])
+        )
+
+    def test_long_runs(self) -> None:
+        # run lengths take up to 4 bytes, with the number of bytes given by the
+        # leading bits of the first one
+        data = bytes([0xFF, 0x81, 0x00, 0x80, 0xC0, 0x00, 0x01])
+        expect(decode_rle7_layer(257, 1, data)).to_equal(bytearray([255] * 256 + [0]))
+
+    def test_output_is_bounded_by_image_size(self) -> None:
+        data = bytes([0xFF, 0xE0, 0xFF, 0xFF, 0xFF, 0x7F])
+        expect(decode_rle7_layer(2, 2, data)).to_equal(bytearray([255] * 4))
+
+    def test_truncated_data(self) -> None:
+        data = bytes([0x7F, 0xFF, 0x81])
+        expect(decode_rle7_layer(2, 2, data)).to_equal(bytearray([255, 0, 0, 0]))
+
+    def test_invalid_run_length(self) -> None:
+        with self.assertRaises(ValueError):
+            decode_rle7_layer(2, 2, bytes([0xFF, 0xF0, 0x00, 0x00, 0x00, 0x00]))
+
+    def test_counting_pixels(self) -> None:
+        expect(count_rle7_pixels(bytes([0xFF, 0x03, 0x10, 0x80, 0x02]))).to_equal(6)
+        expect(count_rle7_pixels(bytes([0x7F, 0xFF, 0x81]))).to_equal(1)
+
+
+class BitPlaneTest(TestCase):
+    def test_single_plane(self) -> None:
+        data = bytes([0x82, 0x01, 0x81])
+        expect(decode_bit_planes(2, 2, [data])).to_equal(
+            bytearray([255, 255, 0, 255])
+        )
+
+    def test_anti_aliasing_planes(self) -> None:
+        planes = [bytes([0x83, 0x01]), bytes([0x82, 0x02]), bytes([0x81, 0x03])]
+        expect(decode_bit_planes(4, 1, planes)).to_equal(
+            bytearray([255, 170, 85, 0])
+        )
+
+    def test_truncated_planes(self) -> None:
+        expect(decode_bit_planes(3, 1, [bytes([0x81])])).to_equal(
+            bytearray([255, 0, 0])
+        )
+
+    def test_planes_spanning_several_bands(self) -> None:
+        planes = [bytes([0x80 | 100, 30]), bytes([0x80 | 70, 60])]
+        expect(decode_bit_planes(1, 130, planes)).to_equal(
+            bytearray([255] * 70 + [127] * 30 + [0] * 30)
+        )
+
+    def test_invalid_number_of_planes(self) -> None:
+        with self.assertRaises(ValueError):
+            decode_bit_planes(2, 2, [])
+
+    def test_counting_pixels(self) -> None:
+        expect(count_bit_plane_pixels(bytes([0x82, 0x01, 0x81]))).to_equal(4)
+
+
+class LayerAreaTest(TestCase):
+    def test_rle7_layer_area(self) -> None:
+        # a run wrapping around to the next row touches both edges of the layer
+        data = bytes([0x00, 0x00, 0xFF, 0x03, 0x00, 0x40, 0x00, 0x80, 0x05])
+        expect(get_rle7_layer_area(4, 3, data)).to_equal(
+            LayerArea(
+                lit_pixel_count=4,
+                area_px=3 + 129 / 255,
+                bounding_box=(0, 0, 3, 1),
+            )
+        )
+
+    def test_rle7_layer_area_of_single_pixels(self) -> None:
+        data = bytes([0x80, 0x05, 0x00, 0x7F, 0x00, 0x00, 0x7F])
+        expect(get_rle7_layer_area(4, 3, data)).to_equal(
+            LayerArea(lit_pixel_count=2, area_px=2.0, bounding_box=(1, 1, 2, 2))
+        )
+
+    def test_empty_layer_area(self) -> None:
+        expect(get_rle7_layer_area(2, 2, bytes([0x80, 0x04]))).to_equal(
+            LayerArea(lit_pixel_count=0, area_px=0.0, bounding_box=None)
+        )
+
+    def test_bit_plane_layer_area(self) -> None:
+        planes = [bytes([0x02, 0x83]), bytes([0x03, 0x81])]
+        expect(get_bit_plane_layer_area(4, 2, planes)).to_equal(
+            LayerArea(lit_pixel_count=3, area_px=2.0, bounding_box=(0, 0, 3, 1))
+        )
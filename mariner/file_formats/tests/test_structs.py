@@ -0,0 +1,33 @@
+import struct
+from dataclasses import asdict, dataclass
+from unittest import TestCase
+
+from pyexpect import expect
+from typedstruct import StructType
+
+from mariner.file_formats.structs import LittleEndianStruct, compiled_struct
+
+
+@compiled_struct
+@dataclass(frozen=True)
+class FooStruct(LittleEndianStruct):
+    foo: int = StructType.uint32()
+    bar: float = StructType.float32()
+    baz: int = StructType.uint16()
+
+
+class CompiledStructTest(TestCase):
+    def test_unpacking(self) -> None:
+        data = struct.pack("<IfH", 42, 1.5, 7)
+        expect(FooStruct.get_format()).to_equal("<IfH")
+        expect(FooStruct.get_size()).to_equal(10)
+        foo = FooStruct.unpack(data)
+        expect(foo).to_equal(FooStruct(foo=42, bar=1.5, baz=7))
+        expect(asdict(foo)).to_equal({"foo": 42, "bar": 1.5, "baz": 7})
+        expect(FooStruct.unpack_from(b"\0\0" + data, 2)).to_equal(foo)
+
+    def test_records_are_frozen(self) -> None:
+        foo = FooStruct.unpack(struct.pack("<IfH", 42, 1.5, 7))
+        with self.assertRaises(AttributeError):
+            foo.foo = 1  # type: ignore
+        expect(hash(foo)).to_equal(hash(FooStruct(foo=42, bar=1.5, baz=7)))
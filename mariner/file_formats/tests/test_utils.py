@@ -0,0 +1,74 @@
+import pathlib
+import struct
+from dataclasses import dataclass
+from typing import ClassVar, FrozenSet
+from unittest.mock import patch
+
+from pyexpect import expect
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from mariner.exceptions import UnsupportedFileFormat
+from mariner.file_formats import SlicedModelFile
+from mariner.file_formats.ctb import CTBFile
+from mariner.file_formats.photon import PhotonFile
+from mariner.file_formats.utils import (
+    EXTENSION_TO_FILE_FORMAT,
+    detect_file_format,
+    get_file_format,
+    get_supported_extensions,
+    register_file_format,
+)
+
+
+class FileFormatDetectionTest(TestCase):
+    def setUp(self) -> None:
+        path = pathlib.Path(__file__).parent.absolute() / "stairs.ctb"
+        with open(path, "rb") as file:
+            self.ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+
+    def test_detecting_file_format(self) -> None:
+        self.fs.create_file("/files/stairs.ctb", contents=self.ctb_file_contents)
+        expect(get_file_format("/files/stairs.ctb")).to_equal(CTBFile)
+
+    def test_detecting_misnamed_file(self) -> None:
+        self.fs.create_file("/files/stairs.photon", contents=self.ctb_file_contents)
+        expect(detect_file_format(pathlib.Path("/files/stairs.photon"))).to_equal(
+            CTBFile
+        )
+
+    def test_extension_breaks_ties_between_formats(self) -> None:
+        header = struct.pack("<I", 0x12FD0019) + bytes(60)
+        self.fs.create_file("/files/a.photon", contents=header)
+        self.fs.create_file("/files/a.cbddlp", contents=header)
+        expect(detect_file_format("/files/a.photon")).to_equal(PhotonFile)
+        expect(detect_file_format("/files/a.cbddlp")).to_equal(CTBFile)
+
+    def test_rejecting_junk_files(self) -> None:
+        self.fs.create_file("/files/._stairs.ctb", contents=b"\x00\x05\x16\x07Mac OS X")
+        self.fs.create_file("/files/empty.ctb", contents=b"")
+        expect(detect_file_format("/files/._stairs.ctb")).to_equal(None)
+        expect(detect_file_format("/files/empty.ctb")).to_equal(None)
+        expect(detect_file_format("/files/missing.ctb")).to_equal(None)
+        with self.assertRaises(UnsupportedFileFormat):
+            get_file_format("/files/._stairs.ctb")
+
+    def test_sniffing_again_after_file_changes(self) -> None:
+        self.fs.create_file("/files/a.ctb", contents=b"junk")
+        expect(detect_file_format("/files/a.ctb")).to_equal(None)
+        with open("/files/a.ctb", "wb") as file:
+            file.write(self.ctb_file_contents)
+        expect(detect_file_format("/files/a.ctb")).to_equal(CTBFile)
+
+    @patch.dict(EXTENSION_TO_FILE_FORMAT)
+    def test_registering_file_format(self) -> None:
+        @dataclass(frozen=True)
+        class FooFile(CTBFile):
+            MAGIC_NUMBERS: ClassVar[FrozenSet[int]] = frozenset([0x12345678])
+
+        register_file_format("foo", FooFile)
+        expect(get_supported_extensions()).to_contain(".foo")
+        self.fs.create_file("/files/a.foo", contents=struct.pack("<I", 0x12345678))
+        file_format: type = get_file_format("/files/a.foo")
+        expect(issubclass(file_format, SlicedModelFile)).is_true()
+        expect(file_format).to_equal(FooFile)
@@ -1,18 +1,30 @@
+import logging
 import os
-from typing import Mapping, Set, Type
+import struct
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Set, Type, Union
 
+from mariner.exceptions import UnsupportedFileFormat
 from mariner.file_formats import SlicedModelFile
 from mariner.file_formats.ctb import CTBFile
 from mariner.file_formats.cbddlp import CBDDLPFile
 from mariner.file_formats.fdg import FDGFile
 from mariner.file_formats.photon import PhotonFile
+from mariner.file_formats.chitubox_zip import ZIPFile
 
 
-EXTENSION_TO_FILE_FORMAT: Mapping[str, Type[SlicedModelFile]] = {
+# file formats can also be provided by other packages, by declaring an entry
+# point in this group named after the file extension (without the dot) that
+# points to a SlicedModelFile subclass
+FILE_FORMAT_ENTRY_POINT_GROUP: str = "mariner.file_formats"
+
+EXTENSION_TO_FILE_FORMAT: Dict[str, Type[SlicedModelFile]] = {
     ".ctb": CTBFile,
     ".cbddlp": CBDDLPFile,
     ".fdg": FDGFile,
     ".photon": PhotonFile,
+    ".zip": ZIPFile,
 }
 
 
@@ -21,12 +33,89 @@ def get_file_extension(filename: str) -> str:
     return extension.lower()
 
 
-def get_file_format(filename: str) -> Type[SlicedModelFile]:
+def register_file_format(extension: str, file_format: Type[SlicedModelFile]) -> None:
+    EXTENSION_TO_FILE_FORMAT[get_file_extension(f"file.{extension}")] = file_format
+    _sniff_file_format.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _load_file_format_plugins() -> None:
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # importlib.metadata is only available on Python 3.8+
+        return
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        file_format_entry_points = all_entry_points.select(
+            group=FILE_FORMAT_ENTRY_POINT_GROUP
+        )
+    else:
+        file_format_entry_points = all_entry_points.get(
+            FILE_FORMAT_ENTRY_POINT_GROUP, []
+        )
+    for entry_point in file_format_entry_points:
+        try:
+            file_format = entry_point.load()
+        except Exception:
+            logging.getLogger(__name__).warning(
+                "Failed to load file format plugin %s", entry_point, exc_info=True
+            )
+            continue
+        if isinstance(file_format, type) and issubclass(file_format, SlicedModelFile):
+            register_file_format(entry_point.name, file_format)
+
+
+@lru_cache(maxsize=4096)
+def _sniff_file_format(
+    filename: str, modification_time_ns: int, size: int
+) -> Optional[Type[SlicedModelFile]]:
+    # the modification time and size are only part of the key of the cache, so
+    # that files are sniffed again once they change
+    try:
+        with open(filename, "rb") as file:
+            header = file.read(4)
+    except OSError:
+        return None
+    if len(header) < 4:
+        return None
+    (magic,) = struct.unpack("<I", header)
+
+    # several formats may share the same magic number, in which case the file
+    # extension breaks the tie
+    candidates = [
+        file_format
+        for file_format in EXTENSION_TO_FILE_FORMAT.values()
+        if magic in file_format.MAGIC_NUMBERS
+    ]
     file_format = EXTENSION_TO_FILE_FORMAT.get(get_file_extension(filename))
+    if file_format in candidates:
+        return file_format
+    return next(iter(candidates), None)
+
+
+def detect_file_format(filename: Union[str, Path]) -> Optional[Type[SlicedModelFile]]:
+    """
+    Detects the format of a file from the magic number in its header, which
+    takes a single 4-byte read. Files that aren't sliced model files at all,
+    like macOS resource forks, are detected as None. Results are cached for as
+    long as the file doesn't change.
+    """
+    _load_file_format_plugins()
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return _sniff_file_format(str(filename), stat.st_mtime_ns, stat.st_size)
+
 
-    assert file_format is not None
+def get_file_format(filename: Union[str, Path]) -> Type[SlicedModelFile]:
+    file_format = detect_file_format(filename)
+    if file_format is None:
+        raise UnsupportedFileFormat(os.path.basename(filename))
     return file_format
 
 
 def get_supported_extensions() -> Set[str]:
+    _load_file_format_plugins()
     return set(EXTENSION_TO_FILE_FORMAT.keys())
@@ -0,0 +1,232 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class FileEventType(Enum):
+    CHANGED = "CHANGED"
+    DELETED = "DELETED"
+
+
+@dataclass(frozen=True)
+class FileEvent:
+    type: FileEventType
+    path: Path
+
+
+class FileWatcher(ABC):
+    @abstractmethod
+    def read_events(self, timeout_secs: float) -> List[FileEvent]:
+        """
+        Blocks for at most timeout_secs and returns the files that changed since
+        the last call. A rename is reported as a DELETED event for the old path
+        followed by a CHANGED event for the new one. A directory that is deleted
+        or moved away may be reported as a single DELETED event for the
+        directory itself, which stands for everything that was under it.
+        """
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+def _walk_files(directory: Path) -> List[Path]:
+    files = []
+    for (dirpath, _, filenames) in os.walk(directory):
+        for filename in filenames:
+            files.append(Path(dirpath) / filename)
+    return files
+
+
+class PollingFileWatcher(FileWatcher):
+    """
+    Detects changes by periodically comparing the mtime and size of every file
+    under the watched directory. This works everywhere, including filesystems
+    that don't deliver inotify events.
+    """
+
+    _directory: Path
+    _snapshot: Dict[Path, Tuple[float, int]]
+
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> Dict[Path, Tuple[float, int]]:
+        snapshot = {}
+        for path in _walk_files(self._directory):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def read_events(self, timeout_secs: float) -> List[FileEvent]:
+        time.sleep(timeout_secs)
+        snapshot = self._take_snapshot()
+        events = [
+            FileEvent(type=FileEventType.DELETED, path=path)
+            for path in self._snapshot.keys()
+            if path not in snapshot
+        ] + [
+            FileEvent(type=FileEventType.CHANGED, path=path)
+            for (path, stat) in snapshot.items()
+            if self._snapshot.get(path) != stat
+        ]
+        self._snapshot = snapshot
+        return events
+
+
+_IN_CLOSE_WRITE: int = 0x00000008
+_IN_MOVED_FROM: int = 0x00000040
+_IN_MOVED_TO: int = 0x00000080
+_IN_CREATE: int = 0x00000100
+_IN_DELETE: int = 0x00000200
+_IN_Q_OVERFLOW: int = 0x00004000
+_IN_IGNORED: int = 0x00008000
+_IN_ISDIR: int = 0x40000000
+
+_WATCH_MASK: int = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+)
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; }
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyFileWatcher(FileWatcher):
+    """
+    Watches a directory tree through the Linux inotify API. Files are reported
+    once they are closed after writing, so uploads are only picked up after
+    they have been fully written to disk.
+    """
+
+    _directory: Path
+    _fd: int
+    _libc: ctypes.CDLL
+    _watches: Dict[int, Path]
+
+    def __init__(self, directory: Path) -> None:
+        library = ctypes.util.find_library("c")
+        if library is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+
+        self._directory = directory
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches = {}
+        try:
+            self._add_watches(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watches(self, directory: Path) -> None:
+        for (dirpath, _, _) in os.walk(directory):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dirpath), _WATCH_MASK
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), dirpath)
+            self._watches[wd] = Path(dirpath)
+
+    def _remove_watches(self, directory: Path) -> None:
+        for (wd, path) in list(self._watches.items()):
+            if path == directory or directory in path.parents:
+                # the watch of a deleted directory is already gone, in which case
+                # this fails and we get IN_IGNORED for it anyway
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _read_buffer(self) -> bytes:
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def read_events(self, timeout_secs: float) -> List[FileEvent]:
+        (readable, _, _) = select.select([self._fd], [], [], timeout_secs)
+        if not readable:
+            return []
+
+        buffer = self._read_buffer()
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            (wd, mask, _, length) = _INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += _INOTIFY_EVENT.size
+            name_end = offset + length
+            name = os.fsdecode(buffer[offset:name_end].rstrip(b"\0"))
+            offset = name_end
+
+            if mask & _IN_Q_OVERFLOW:
+                # we lost events, so the best we can do is to report everything
+                events += [
+                    FileEvent(type=FileEventType.CHANGED, path=path)
+                    for path in _walk_files(self._directory)
+                ]
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = directory / name
+
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # files may have been written to the new directory before we
+                    # managed to watch it, so we report whatever is there already
+                    try:
+                        self._add_watches(path)
+                    except FileNotFoundError:
+                        continue
+                    events += [
+                        FileEvent(type=FileEventType.CHANGED, path=file)
+                        for file in _walk_files(path)
+                    ]
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    # a moved directory keeps its watches, which would report
+                    # events under its old path, so we watch it again if it shows
+                    # up somewhere else in the tree
+                    self._remove_watches(path)
+                    events.append(FileEvent(type=FileEventType.DELETED, path=path))
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                events.append(FileEvent(type=FileEventType.DELETED, path=path))
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                events.append(FileEvent(type=FileEventType.CHANGED, path=path))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def create_file_watcher(directory: Path) -> FileWatcher:
+    try:
+        return InotifyFileWatcher(directory)
+    except OSError:
+        return PollingFileWatcher(directory)
@@ -1,18 +1,32 @@
 import logging
 import multiprocessing
 import os
-from typing import Dict
+from pathlib import Path
+from typing import Dict, Iterable
 
 from flask import render_template
 from waitress import serve
 
 from mariner import config
-from mariner.file_formats.utils import get_supported_extensions
+from mariner.file_formats.utils import (
+    detect_file_format,
+    get_file_extension,
+    get_supported_extensions,
+)
+from mariner.file_watcher import FileEvent, FileEventType, create_file_watcher
 from mariner.server.api import api as api_blueprint
 from mariner.server.app import app as flask_app
+from mariner.server.file_index import get_file_index
 from mariner.server.utils import (
-    read_cached_preview,
+    get_cached_preview_path,
+    get_cached_thumbnail_path,
+    invalidate_cached_file,
+    read_cached_integrity_report,
+    read_cached_layer_area_table,
+    read_cached_print_timeline,
     read_cached_sliced_model_file,
+    read_cached_sliced_model_file_summary,
+    share_cached_file,
 )
 
 from itertools import chain
@@ -40,11 +54,93 @@ class CacheBootstrapper(multiprocessing.Process):
             for extension in get_supported_extensions()
         ]
         for file in chain.from_iterable(globs):
-            read_cached_sliced_model_file(file.absolute())
-            read_cached_preview(file.absolute())
+            try:
+                if detect_file_format(file) is None:
+                    continue
+                read_cached_sliced_model_file_summary(file.absolute())
+                read_cached_sliced_model_file(file.absolute())
+                get_cached_thumbnail_path(file.absolute())
+                get_cached_preview_path(file.absolute())
+                read_cached_layer_area_table(file.absolute())
+            except Exception:
+                # plain .zip archives, or files that are corrupt or still being
+                # copied, must not keep the rest from being cached and indexed
+                logging.getLogger(__name__).warning(
+                    "Failed to warm cache for %s", file, exc_info=True
+                )
+        # everything is cached by now, so this only has to stat each file
+        get_file_index().sync()
+
+
+class CacheWarmer(multiprocessing.Process):
+    """
+    Keeps the cache up to date as files are uploaded, copied, renamed or deleted
+    under the files directory, so that new files are already parsed by the time
+    somebody lists them.
+    """
+
+    def run(self) -> None:
+        os.nice(5)
+        watcher = create_file_watcher(config.get_files_directory())
+        while True:
+            self.handle_events(watcher.read_events(timeout_secs=5.0))
+
+    def handle_events(self, events: Iterable[FileEvent]) -> None:
+        # a single upload may generate several events for the same file, so we
+        # only keep the last one for each path
+        last_event_by_path = {event.path: event for event in events}
+        for event in last_event_by_path.values():
+            is_supported = (
+                get_file_extension(event.path.name) in get_supported_extensions()
+            )
+            # files moved through the API already had their cache entries moved
+            # along with them
+            if is_supported and not get_file_index().is_file_current(event.path):
+                invalidate_cached_file(event.path)
+            try:
+                if event.type == FileEventType.CHANGED:
+                    self.warm_cache(event.path)
+                else:
+                    self.forget_path(event.path)
+            except Exception:
+                # the file may still be in the middle of being copied, in which
+                # case we will get another event once it changes again
+                logging.getLogger(__name__).warning(
+                    "Failed to warm cache for %s", event.path, exc_info=True
+                )
+
+    def warm_cache(self, path: Path) -> None:
+        if get_file_extension(path.name) in get_supported_extensions():
+            # copies of a file we already went through get whatever is cached
+            # for it, rather than being read all over again
+            duplicates = get_file_index().find_duplicates(path)
+            if duplicates:
+                share_cached_file(duplicates[0], path)
+            read_cached_sliced_model_file_summary(path)
+            read_cached_sliced_model_file(path)
+            get_cached_thumbnail_path(path)
+            get_cached_preview_path(path)
+            read_cached_layer_area_table(path)
+            read_cached_print_timeline(path)
+            # counting the pixels of every layer is too slow to do while serving
+            # file_details, which uses this report once it's cached
+            read_cached_integrity_report(path, check_layer_pixels=True)
+        # every file gets listed, not just the sliced ones
+        get_file_index().update_file(path)
+
+    def forget_path(self, path: Path) -> None:
+        # a directory that was deleted or moved away outside of the API is only
+        # reported once, so the files that were under it are dropped here
+        for removed_path in get_file_index().remove_path(path):
+            is_supported = (
+                get_file_extension(removed_path.name) in get_supported_extensions()
+            )
+            if removed_path != path and is_supported:
+                invalidate_cached_file(removed_path)
 
 
 def main() -> None:
+    CacheWarmer().start()
     CacheBootstrapper().start()
 
     logger = logging.getLogger("waitress")
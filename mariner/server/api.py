@@ -1,27 +1,81 @@
+import base64
+import dataclasses
+import io
+import json
+import logging
+import math
 import os
+import re
+import shutil
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Dict, Optional, Tuple
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 from flask import (
     Blueprint,
     Response,
     abort,
     jsonify,
-    make_response,
     request,
+    send_file,
 )
 from pyre_extensions import none_throws
 from werkzeug.utils import secure_filename
 
 from mariner import config
-from mariner.exceptions import MarinerException, UnexpectedPrinterResponse
-from mariner.file_formats import SlicedModelFile
-from mariner.file_formats.utils import get_file_extension, get_supported_extensions
+from mariner.exceptions import (
+    InvalidPath,
+    MarinerException,
+    PathAlreadyExists,
+    PathNotFound,
+    ReadOnlyFileFormat,
+    UnexpectedPrinterResponse,
+)
+from mariner.file_formats import PrintSettingsPatch, SlicedModelFile
+from mariner.file_formats.utils import (
+    get_file_extension,
+    get_file_format,
+    get_supported_extensions,
+)
 from mariner.printer import ChiTuPrinter, PrinterState
+from mariner.server.file_index import (
+    SORTABLE_COLUMNS,
+    FileQuery,
+    IndexedFile,
+    get_file_index,
+)
+from mariner.server.layer_tiles import (
+    TILE_SIZE,
+    get_cached_layer_tile_path,
+    get_max_zoom,
+    prefetch_layer_tiles,
+)
+from mariner.server.live_layer import (
+    LookAheadLayerRenderer,
+    SharedPoller,
+    render_blank_png,
+    render_layer_png,
+)
+from mariner.server.thumbnail_sheet import (
+    THUMBNAIL_HEIGHT,
+    THUMBNAIL_WIDTH,
+    get_cached_thumbnail_sheet,
+    get_thumbnail_sheet_path,
+)
 from mariner.server.utils import (
-    read_cached_preview,
+    get_cached_integrity_report,
+    get_cached_layer_area_table,
+    get_cached_print_timeline,
+    get_cached_preview_path,
+    get_cached_thumbnail_path,
+    invalidate_cached_file,
+    read_cached_integrity_report,
     read_cached_sliced_model_file,
+    read_cached_sliced_model_file_summary,
+    relink_cached_file,
     retry,
 )
 
@@ -44,6 +98,19 @@ def handle_mariner_exception(exception: MarinerException) -> Tuple[str, int]:
     )
 
 
+LIVE_LAYER_POLL_INTERVAL_SECS: float = 2.0
+LIVE_LAYER_KEEPALIVE_SECS: float = 30.0
+LIVE_LAYER_MAX_STREAM_SECS: float = 60.0 * 60.0
+
+
+def _get_current_layer(
+    sliced_model_file: SlicedModelFile, current_byte: Optional[int]
+) -> int:
+    if current_byte == 0:
+        return 1
+    return sliced_model_file.end_byte_offset_by_layer.index(current_byte) + 1
+
+
 @api.route("/print_status", methods=["GET"])
 def print_status() -> str:
     with ChiTuPrinter() as printer:
@@ -54,23 +121,17 @@ def print_status() -> str:
         selected_file = printer.get_selected_file()
         print_status = printer.get_print_status()
 
+        print_details: Dict[str, Any] = {}
         if print_status.state == PrinterState.IDLE:
             progress = 0.0
-            print_details = {}
         else:
             sliced_model_file = read_cached_sliced_model_file(
                 config.get_files_directory() / selected_file
             )
 
-            if print_status.current_byte == 0:
-                current_layer = 1
-            else:
-                current_layer = (
-                    sliced_model_file.end_byte_offset_by_layer.index(
-                        print_status.current_byte
-                    )
-                    + 1
-                )
+            current_layer = _get_current_layer(
+                sliced_model_file, print_status.current_byte
+            )
 
             progress = (
                 100.0
@@ -78,15 +139,42 @@ def print_status() -> str:
                 / none_throws(sliced_model_file.layer_count)
             )
 
+            # every endpoint reports the estimate of the slicer as the print
+            # time, but the simulated timeline knows how long every layer takes,
+            # so it tells how much of that estimate is left at the current layer.
+            # until the cache warmer has simulated the print, we go by progress.
+            print_time_secs = sliced_model_file.print_time_secs
+            print_timeline = get_cached_print_timeline(
+                config.get_files_directory() / selected_file
+            )
+            if print_timeline is not None and print_timeline.get_total_secs() > 0.0:
+                time_left_fraction = (
+                    print_timeline.get_time_left_secs(current_layer - 1)
+                    / print_timeline.get_total_secs()
+                )
+            else:
+                time_left_fraction = (100.0 - progress) / 100.0
+            time_left_secs = round(print_time_secs * time_left_fraction)
+
             print_details = {
                 "current_layer": current_layer,
                 "layer_count": sliced_model_file.layer_count,
-                "print_time_secs": sliced_model_file.print_time_secs,
-                "time_left_secs": round(
-                    sliced_model_file.print_time_secs * (100.0 - progress) / 100.0
-                ),
+                "print_time_secs": print_time_secs,
+                "time_left_secs": time_left_secs,
             }
 
+            # the cache warmer works out the layer areas of every file, which is
+            # too slow to do here. until it's done, we just don't report them.
+            layer_area_table = get_cached_layer_area_table(
+                config.get_files_directory() / selected_file
+            )
+            if layer_area_table is not None:
+                print_details["resin_used_percent"] = round(
+                    100.0
+                    * layer_area_table.get_used_volume_fraction(current_layer - 1),
+                    2,
+                )
+
         return jsonify(
             {
                 "state": print_status.state.value,
@@ -97,8 +185,192 @@ def print_status() -> str:
         )
 
 
+def _get_layer_being_printed() -> Optional[Tuple[Path, int]]:
+    with ChiTuPrinter() as printer:
+        selected_file = printer.get_selected_file()
+        print_status = printer.get_print_status()
+    if print_status.state == PrinterState.IDLE:
+        return None
+    path = config.get_files_directory() / selected_file
+    sliced_model_file = read_cached_sliced_model_file(path)
+    return (path, _get_current_layer(sliced_model_file, print_status.current_byte) - 1)
+
+
+# the printer may reply with something unexpected every now and then, in which
+# case the poller just tries again later
+_live_layer_poller: SharedPoller[Optional[Tuple[Path, int]]] = SharedPoller(
+    _get_layer_being_printed,
+    LIVE_LAYER_POLL_INTERVAL_SECS,
+    recoverable_errors=(MarinerException, OSError, ValueError),
+)
+
+
+def _get_frame(png_bytes: bytes) -> bytes:
+    return (
+        b"--frame\r\nContent-Type: image/png\r\n"
+        + f"Content-Length: {len(png_bytes)}\r\n\r\n".encode("ascii")
+        + png_bytes
+        + b"\r\n"
+    )
+
+
+@api.route("/live_layer", methods=["GET"])
+def live_layer() -> Response:
+    """
+    Streams the image of the layer being printed as a multipart/x-mixed-replace
+    response, which browsers show as an image that updates itself every time
+    the printer moves on to the next layer. Each client holds on to a server
+    thread for as long as it is watching, so the last frame is sent again every
+    now and then to find out about clients that went away, and streams end
+    after a while regardless.
+    """
+
+    def iter_frames() -> Iterator[bytes]:
+        renderer = LookAheadLayerRenderer()
+        deadline = time.monotonic() + LIVE_LAYER_MAX_STREAM_SECS
+        last_layer_shown = None
+        frame = _get_frame(render_blank_png())
+        try:
+            with _live_layer_poller.subscribe() as version:
+                while time.monotonic() < deadline:
+                    (version, layer_being_printed) = _live_layer_poller.wait_for_change(
+                        version, LIVE_LAYER_KEEPALIVE_SECS
+                    )
+                    if (
+                        layer_being_printed is not None
+                        and layer_being_printed != last_layer_shown
+                    ):
+                        try:
+                            frame = _get_frame(renderer.render(*layer_being_printed))
+                            last_layer_shown = layer_being_printed
+                        except (MarinerException, OSError, ValueError, IndexError):
+                            # the file may have changed while it's being printed,
+                            # in which case we keep showing the last layer
+                            logging.getLogger(__name__).warning(
+                                "Failed to render layer %s",
+                                layer_being_printed,
+                                exc_info=True,
+                            )
+                    # frames are sent again when nothing changed for a while,
+                    # which is how we find out about clients that went away
+                    yield frame
+        finally:
+            renderer.close()
+
+    return Response(
+        iter_frames(), mimetype="multipart/x-mixed-replace; boundary=frame"
+    )
+
+
+RESULTS_PER_PAGE: int = 50
+MAX_RESULTS_PER_PAGE: int = 500
+# streamed listings without a limit still read the index this many rows at a time
+LIST_FILES_STREAM_BATCH_SIZE: int = 200
+# the types the value of a cursor may have, for each order it can be created in
+_CURSOR_VALUE_TYPES: Dict[str, Tuple[type, ...]] = {
+    "list_files": (int,),
+    "path": (str,),
+    "filename": (str,),
+    "mtime_ns": (int,),
+    "size": (int,),
+    "print_time_secs": (int,),
+    "printer_name": (str,),
+    "layer_height_mm": (int, float),
+    "layer_count": (int,),
+    "height_mm": (int, float),
+}
+# sqlite only holds 64-bit integers
+_MAX_CURSOR_INT: int = 2 ** 63 - 1
+
+
+def _get_number_arg(name: str, number_type: Callable[[str], Any]) -> Any:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = number_type(value)
+    except ValueError:
+        abort(400)
+    if not math.isfinite(number):
+        abort(400)
+    return number
+
+
+def _encode_cursor(order: str, cursor: Tuple[Any, str]) -> str:
+    (value, key) = cursor
+    payload = json.dumps({"order": order, "value": value, "key": key})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(order: str, cursor: str) -> Tuple[Any, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        # a cursor is only meaningful for the order it was created in
+        if payload["order"] != order or not isinstance(payload["key"], str):
+            abort(400)
+        value = payload["value"]
+        # the value ends up in a query, so anything but a number or a string of
+        # the type the order sorts by is rejected
+        if isinstance(value, bool) or not isinstance(value, _CURSOR_VALUE_TYPES[order]):
+            abort(400)
+        if isinstance(value, int) and abs(value) > _MAX_CURSOR_INT:
+            abort(400)
+        return (value, payload["key"])
+    except (ValueError, TypeError, KeyError):
+        abort(400)
+
+
+def _get_limit_arg(default: Optional[int]) -> Optional[int]:
+    limit = _get_number_arg("limit", int)
+    if limit is None:
+        return default
+    if limit < 1 or limit > MAX_RESULTS_PER_PAGE:
+        abort(400)
+    return limit
+
+
+def _get_file_data(indexed_file: IndexedFile) -> Dict[str, Any]:
+    file_data: Dict[str, Any] = {
+        "filename": indexed_file.filename,
+        "path": indexed_file.path,
+        "can_be_printed": indexed_file.can_be_printed,
+    }
+    if indexed_file.pending:
+        file_data["pending"] = True
+    if indexed_file.can_be_printed:
+        file_data["print_time_secs"] = indexed_file.print_time_secs
+    return file_data
+
+
+def _iter_list_files_lines(
+    path: Path,
+    directories: List[Dict[str, Any]],
+    cursor: Optional[Tuple[int, str]],
+    limit: Optional[int],
+) -> Iterator[str]:
+    for directory in directories:
+        yield json.dumps({"type": "directory", **directory}) + "\n"
+    files_left = limit
+    while files_left is None or files_left > 0:
+        batch_size = LIST_FILES_STREAM_BATCH_SIZE
+        if files_left is not None:
+            batch_size = min(batch_size, files_left)
+            files_left -= batch_size
+        indexed_files = get_file_index().list_directory(path, cursor, batch_size)
+        for indexed_file in indexed_files:
+            yield json.dumps({"type": "file", **_get_file_data(indexed_file)}) + "\n"
+        if len(indexed_files) < batch_size:
+            cursor = None
+            break
+        cursor = (indexed_files[-1].mtime_ns, indexed_files[-1].filename)
+    next_cursor = None
+    if cursor is not None and get_file_index().list_directory(path, cursor, 1):
+        next_cursor = _encode_cursor("list_files", cursor)
+    yield json.dumps({"type": "end", "next_cursor": next_cursor}) + "\n"
+
+
 @api.route("/list_files", methods=["GET"])
-def list_files() -> str:
+def list_files() -> Response:
     path_parameter = str(request.args.get("path", "."))
     path = (config.get_files_directory() / path_parameter).resolve()
     if (
@@ -106,55 +378,176 @@ def list_files() -> str:
         and path != config.get_files_directory()
     ):
         abort(400)
-    with os.scandir(path) as dir_entries:
-        files = []
-        directories = []
-        for dir_entry in sorted(
-            dir_entries, key=lambda t: t.stat().st_mtime, reverse=True
-        ):
-            if dir_entry.is_file():
-                sliced_model_file: Optional[SlicedModelFile] = None
-                if get_file_extension(dir_entry.name) in get_supported_extensions():
-                    if dir_entry.name.startswith("._"):
-                        if b"Mac OS X" not in open(dir_entry, "rb").read(32):
-                            sliced_model_file = read_cached_sliced_model_file(
-                                path / dir_entry.name
-                            )
-                    else:
-                        sliced_model_file = read_cached_sliced_model_file(
-                            path / dir_entry.name
-                        )
+    limit = _get_limit_arg(None)
+    cursor_arg = request.args.get("cursor")
+    cursor: Optional[Tuple[int, str]] = None
+    if cursor_arg is not None:
+        cursor = _decode_cursor("list_files", cursor_arg)
+    stream = request.args.get("format") == "ndjson"
+    # clients that page through or stream the listing get files that haven't
+    # been read yet marked as pending, rather than waiting for them to be parsed
+    incremental = stream or limit is not None or cursor is not None
 
-                file_data: Dict[str, Any] = {
-                    "filename": dir_entry.name,
-                    "path": str(
-                        (path / dir_entry.name).relative_to(
-                            config.get_files_directory()
-                        )
+    directories: List[Dict[str, Any]] = []
+    if cursor is None:
+        with os.scandir(path) as dir_entries:
+            directories = [
+                {"dirname": dir_entry.name}
+                for dir_entry in sorted(
+                    (dir_entry for dir_entry in dir_entries if dir_entry.is_dir()),
+                    key=lambda t: t.stat().st_mtime,
+                    reverse=True,
+                )
+            ]
+    # files that haven't changed since they were indexed only take a stat, so
+    # large directories no longer go through the cache one file at a time
+    file_index = get_file_index()
+    file_index.sync_directory(path, read_changed=not incremental)
+
+    if stream:
+        return Response(
+            _iter_list_files_lines(path, directories, cursor, limit),
+            mimetype="application/x-ndjson",
+        )
+
+    # one extra file tells us whether there's another page
+    indexed_files = file_index.list_directory(
+        path, cursor, None if limit is None else limit + 1
+    )
+    response: Dict[str, Any] = {"directories": directories}
+    if incremental:
+        next_cursor = None
+        if limit is not None and len(indexed_files) > limit:
+            indexed_files = indexed_files[:limit]
+            next_cursor = _encode_cursor(
+                "list_files", (indexed_files[-1].mtime_ns, indexed_files[-1].filename)
+            )
+        response["next_cursor"] = next_cursor
+    response["files"] = [_get_file_data(indexed_file) for indexed_file in indexed_files]
+    return jsonify(response)
+
+
+@api.route("/files/search", methods=["GET"])
+def search_files() -> str:
+    sort_by = request.args.get("sort_by", "mtime_ns")
+    if sort_by not in SORTABLE_COLUMNS:
+        abort(400)
+    order = request.args.get("order", "desc")
+    if order not in ["asc", "desc"]:
+        abort(400)
+    resolution_arg = request.args.get("resolution")
+    resolution = None
+    if resolution_arg is not None:
+        match = re.fullmatch(r"(\d+)x(\d+)", resolution_arg)
+        if match is None:
+            abort(400)
+        resolution = (int(match.group(1)), int(match.group(2)))
+    limit = none_throws(_get_limit_arg(RESULTS_PER_PAGE))
+    cursor_arg = request.args.get("cursor")
+
+    query = FileQuery(
+        printer_name=request.args.get("printer_name"),
+        resolution=resolution,
+        name=request.args.get("name"),
+        min_layer_height_mm=_get_number_arg("min_layer_height_mm", float),
+        max_layer_height_mm=_get_number_arg("max_layer_height_mm", float),
+        min_print_time_secs=_get_number_arg("min_print_time_secs", int),
+        max_print_time_secs=_get_number_arg("max_print_time_secs", int),
+        sort_by=sort_by,
+        descending=order == "desc",
+        cursor=None
+        if cursor_arg is None
+        else _decode_cursor(sort_by, cursor_arg),
+        # one extra result tells us whether there's another page
+        limit=limit + 1,
+    )
+    indexed_files = get_file_index().search(query)
+    next_cursor = None
+    if len(indexed_files) > limit:
+        indexed_files = indexed_files[:limit]
+        next_cursor = _encode_cursor(
+            sort_by, query.get_cursor(indexed_files[-1])
+        )
+    return jsonify(
+        {
+            "files": [
+                {
+                    "filename": indexed_file.filename,
+                    "path": indexed_file.path,
+                    "mtime_ns": indexed_file.mtime_ns,
+                    "size": indexed_file.size,
+                    "print_time_secs": indexed_file.print_time_secs,
+                    "printer_name": indexed_file.printer_name,
+                    "resolution": list(none_throws(indexed_file.resolution)),
+                    "layer_height_mm": round(
+                        none_throws(indexed_file.layer_height_mm), 4
                     ),
+                    "layer_count": indexed_file.layer_count,
+                    "height_mm": round(none_throws(indexed_file.height_mm), 4),
                 }
+                for indexed_file in indexed_files
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
 
-                if sliced_model_file:
-                    file_data = {
-                        "print_time_secs": sliced_model_file.print_time_secs,
-                        "can_be_printed": True,
-                        **file_data,
-                    }
-                else:
-                    file_data = {
-                        "can_be_printed": False,
-                        **file_data,
-                    }
-
-                files.append(file_data)
-            else:
-                directories.append({"dirname": dir_entry.name})
-        return jsonify(
-            {
-                "directories": directories,
-                "files": files,
-            }
-        )
+
+MAX_BATCH_FILE_DETAILS: int = 200
+
+# parsing is mostly CPU bound, so more workers than this would only add contention
+_file_details_executor = ThreadPoolExecutor(max_workers=2)
+
+
+def _get_file_details(filename: str, path: Path) -> Dict[str, Any]:
+    sliced_model_file = read_cached_sliced_model_file(path)
+    integrity_report = get_cached_integrity_report(path)
+    return {
+        "filename": sliced_model_file.filename,
+        "path": filename,
+        "bed_size_mm": list(sliced_model_file.bed_size_mm),
+        "height_mm": round(sliced_model_file.height_mm, 4),
+        "layer_count": sliced_model_file.layer_count,
+        "layer_height_mm": round(sliced_model_file.layer_height_mm, 4),
+        "resolution": list(sliced_model_file.resolution),
+        "print_time_secs": sliced_model_file.print_time_secs,
+        "integrity": {
+            "is_valid": integrity_report.is_valid(),
+            "errors": list(integrity_report.errors),
+            "checked_layer_pixels": integrity_report.checked_layer_pixels,
+        },
+    }
+
+
+def _get_file_details_or_error(filename: str) -> Dict[str, Any]:
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        return {
+            "path": filename,
+            "error": {
+                "title": "Invalid Path",
+                "description": f"{filename} is not under the files directory.",
+            },
+        }
+    not_found_error = {
+        "title": "File Not Found",
+        "description": f"{filename} doesn't exist.",
+    }
+    if not os.path.isfile(path):
+        return {"path": filename, "error": not_found_error}
+    try:
+        return _get_file_details(filename, path)
+    except MarinerException as exception:
+        error = {
+            "title": exception.get_title(),
+            "description": exception.get_description(),
+        }
+    except FileNotFoundError:
+        # the file was deleted while we were reading it
+        error = not_found_error
+    except Exception as exception:
+        # a single broken file shouldn't fail the details of every other one
+        error = {"title": "Unexpected Error", "description": repr(exception)}
+    return {"path": filename, "error": error}
 
 
 @api.route("/file_details", methods=["GET"])
@@ -163,19 +556,31 @@ def file_details() -> str:
     path = (config.get_files_directory() / filename).resolve()
     if config.get_files_directory() not in path.parents:
         abort(400)
-    sliced_model_file = read_cached_sliced_model_file(path)
-    return jsonify(
-        {
-            "filename": sliced_model_file.filename,
-            "path": filename,
-            "bed_size_mm": list(sliced_model_file.bed_size_mm),
-            "height_mm": round(sliced_model_file.height_mm, 4),
-            "layer_count": sliced_model_file.layer_count,
-            "layer_height_mm": round(sliced_model_file.layer_height_mm, 4),
-            "resolution": list(sliced_model_file.resolution),
-            "print_time_secs": sliced_model_file.print_time_secs,
-        }
+    return jsonify(_get_file_details(filename, path))
+
+
+@api.route("/file_details/batch", methods=["POST"])
+def batch_file_details() -> str:
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+    filenames = body.get("filenames")
+    if (
+        not isinstance(filenames, list)
+        or not all(isinstance(filename, str) for filename in filenames)
+        or len(filenames) > MAX_BATCH_FILE_DETAILS
+    ):
+        abort(400)
+    # cache hits come back right away, while misses are parsed on the pool
+    # instead of one after the other
+    unique_filenames = list(dict.fromkeys(filenames))
+    details_by_filename = dict(
+        zip(
+            unique_filenames,
+            _file_details_executor.map(_get_file_details_or_error, unique_filenames),
+        )
     )
+    return jsonify({"files": [details_by_filename[filename] for filename in filenames]})
 
 
 @api.route("/upload_file", methods=["POST"])
@@ -188,7 +593,33 @@ def upload_file() -> str:
     filename = secure_filename(file.filename)
     file.save(str(config.get_files_directory() / filename))
     os.sync()
-    return jsonify({"success": True})
+    # an existing file may have been overwritten, so we drop whatever we had
+    # cached for it. the cache warmer will pick up the new contents.
+    path = config.get_files_directory() / filename
+    invalidate_cached_file(path)
+    # uploads over flaky connections can end up truncated, which we want to
+    # know about right away rather than hours into the print
+    try:
+        read_cached_integrity_report(path)
+    except MarinerException:
+        pass
+    # the same file is often uploaded again under a different name, which we
+    # let the user know about. hashing the whole file takes too long to do here,
+    # so the cache warmer makes sure the copies are identical before they share
+    # their cache entries.
+    try:
+        duplicates = get_file_index().find_possible_duplicates(path)
+    except OSError:
+        duplicates = []
+    return jsonify(
+        {
+            "success": True,
+            "duplicates": sorted(
+                str(duplicate.relative_to(config.get_files_directory()))
+                for duplicate in duplicates
+            ),
+        }
+    )
 
 
 @api.route("/delete_file", methods=["POST"])
@@ -202,6 +633,230 @@ def delete_file() -> str:
     if not os.path.isfile(path):
         abort(400)
     os.remove(path)
+    invalidate_cached_file(path)
+    get_file_index().remove_path(path)
+    return jsonify({"success": True})
+
+
+MAX_BATCH_FILE_OPERATIONS: int = 1000
+
+
+def _resolve_existing_path(relative_path: str) -> Path:
+    path = (config.get_files_directory() / relative_path).resolve()
+    if config.get_files_directory() not in path.parents:
+        raise InvalidPath(relative_path)
+    if not os.path.exists(path):
+        raise PathNotFound(relative_path)
+    return path
+
+
+def _delete_path(path: Path) -> None:
+    if os.path.isdir(path):
+        for (directory, _, filenames) in os.walk(path):
+            for filename in filenames:
+                invalidate_cached_file(Path(directory) / filename)
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+        invalidate_cached_file(path)
+    get_file_index().remove_path(path)
+
+
+def _move_path(path: Path, new_path: Path) -> None:
+    if os.path.exists(new_path):
+        raise PathAlreadyExists(
+            str(new_path.relative_to(config.get_files_directory()))
+        )
+    os.rename(path, new_path)
+    # the files themselves haven't changed, so whatever was cached for them is
+    # moved along with them rather than read again
+    if os.path.isdir(new_path):
+        for (directory, _, filenames) in os.walk(new_path):
+            for filename in filenames:
+                new_file_path = Path(directory) / filename
+                relink_cached_file(
+                    path / new_file_path.relative_to(new_path), new_file_path
+                )
+    else:
+        relink_cached_file(path, new_path)
+    get_file_index().move_path(path, new_path)
+
+
+def _apply_file_operation(
+    relative_path: str, operation: Callable[[Path], Optional[Path]]
+) -> Dict[str, Any]:
+    try:
+        new_path = operation(_resolve_existing_path(relative_path))
+    except MarinerException as exception:
+        error = {
+            "title": exception.get_title(),
+            "description": exception.get_description(),
+        }
+    except OSError as exception:
+        error = {"title": "File Operation Failed", "description": str(exception)}
+    else:
+        result: Dict[str, Any] = {"path": relative_path, "success": True}
+        if new_path is not None:
+            result["new_path"] = str(
+                new_path.relative_to(config.get_files_directory())
+            )
+        return result
+    return {"path": relative_path, "success": False, "error": error}
+
+
+def _get_paths_arg(body: Any) -> List[str]:
+    paths = body.get("paths") if isinstance(body, dict) else None
+    if (
+        not isinstance(paths, list)
+        or not all(isinstance(path, str) for path in paths)
+        or len(paths) > MAX_BATCH_FILE_OPERATIONS
+    ):
+        abort(400)
+    return paths
+
+
+def _sync_file_operations(results: List[Dict[str, Any]]) -> str:
+    # the files directory is usually exported over USB as well, so everything
+    # is flushed to it at once rather than after every operation
+    os.sync()
+    return jsonify({"results": results})
+
+
+@api.route("/files/delete", methods=["POST"])
+def delete_files() -> str:
+    """
+    Deletes files and directories, along with everything under them.
+    """
+    paths = _get_paths_arg(request.get_json(silent=True))
+    return _sync_file_operations(
+        [_apply_file_operation(relative_path, _delete_path) for relative_path in paths]
+    )
+
+
+@api.route("/files/move", methods=["POST"])
+def move_files() -> str:
+    """
+    Moves files and directories into another directory, keeping their names.
+    """
+    body = request.get_json(silent=True)
+    paths = _get_paths_arg(body)
+    destination_arg = body.get("destination")
+    if not isinstance(destination_arg, str):
+        abort(400)
+    destination = (config.get_files_directory() / destination_arg).resolve()
+    if (
+        config.get_files_directory() not in destination.parents
+        and destination != config.get_files_directory()
+    ):
+        abort(400)
+    if not os.path.isdir(destination):
+        abort(400)
+
+    def move(path: Path) -> Path:
+        new_path = destination / path.name
+        _move_path(path, new_path)
+        return new_path
+
+    return _sync_file_operations(
+        [_apply_file_operation(relative_path, move) for relative_path in paths]
+    )
+
+
+@api.route("/files/rename", methods=["POST"])
+def rename_files() -> str:
+    """
+    Renames files and directories without moving them to another directory.
+    """
+    body = request.get_json(silent=True)
+    renames = body.get("renames") if isinstance(body, dict) else None
+    if (
+        not isinstance(renames, list)
+        or len(renames) > MAX_BATCH_FILE_OPERATIONS
+        or not all(
+            isinstance(rename, dict)
+            and isinstance(rename.get("path"), str)
+            and isinstance(rename.get("name"), str)
+            for rename in renames
+        )
+    ):
+        abort(400)
+
+    def get_rename(name: str) -> Callable[[Path], Path]:
+        def rename(path: Path) -> Path:
+            if name in ["", ".", ".."] or "/" in name or "\0" in name:
+                raise InvalidPath(name)
+            new_path = path.parent / name
+            _move_path(path, new_path)
+            return new_path
+
+        return rename
+
+    return _sync_file_operations(
+        [
+            _apply_file_operation(rename["path"], get_rename(rename["name"]))
+            for rename in renames
+        ]
+    )
+
+
+def _parse_print_settings_patch(body: Any) -> PrintSettingsPatch:
+    if not isinstance(body, dict):
+        abort(400)
+    setting_names = {
+        field.name
+        for field in dataclasses.fields(PrintSettingsPatch)
+        if field.name != "layer_range"
+    }
+    settings: Dict[str, Any] = {}
+    for (name, value) in body.items():
+        if name == "layer_range":
+            continue
+        if name not in setting_names:
+            abort(400)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            abort(400)
+        if not math.isfinite(value) or value < 0:
+            abort(400)
+        settings[name] = float(value)
+
+    layer_range = body.get("layer_range")
+    if layer_range is not None:
+        if (
+            not isinstance(layer_range, list)
+            or len(layer_range) != 2
+            or not all(
+                isinstance(layer, int) and not isinstance(layer, bool)
+                for layer in layer_range
+            )
+        ):
+            abort(400)
+        layer_range = (layer_range[0], layer_range[1])
+    return PrintSettingsPatch(layer_range=layer_range, **settings)
+
+
+@api.route("/patch_file", methods=["POST"])
+def patch_file() -> str:
+    filename = str(request.args.get("filename"))
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        abort(400)
+    if not os.path.isfile(path):
+        abort(400)
+    patch = _parse_print_settings_patch(request.get_json(silent=True))
+    try:
+        get_file_format(path).patch_print_settings(path, patch)
+    except (IndexError, ValueError):
+        abort(400)
+    except ReadOnlyFileFormat:
+        # the file is fine, it just can't be changed in place
+        abort(409)
+    os.sync()
+    # the summary, print time and layer images all depend on the settings, so
+    # everything we had cached for the file is stale now
+    invalidate_cached_file(path)
+    get_file_index().update_file(path, changed=True)
     return jsonify({"success": True})
 
 
@@ -212,15 +867,162 @@ def file_preview() -> Response:
     if config.get_files_directory() not in path.parents:
         abort(400)
 
-    preview_bytes = read_cached_preview(path)
+    return send_file(
+        get_cached_preview_path(path),
+        mimetype="image/png",
+        as_attachment=True,
+        download_name=f"{filename}.png",
+    )
+
+
+@api.route("/file_thumbnail", methods=["GET"])
+def file_thumbnail() -> Response:
+    filename = str(request.args.get("filename"))
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        abort(400)
+
+    return send_file(
+        get_cached_thumbnail_path(path),
+        mimetype="image/png",
+        as_attachment=True,
+        download_name=f"{filename}.thumbnail.png",
+    )
+
+
+@api.route("/layer_image", methods=["GET"])
+def layer_image() -> Response:
+    filename = str(request.args.get("filename"))
+    layer = request.args.get("layer", type=int)
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        abort(400)
+    if layer is None or get_file_extension(path.name) not in get_supported_extensions():
+        abort(400)
+
+    try:
+        png_bytes = render_layer_png(path, layer)
+    except IndexError:
+        abort(400)
+
+    return send_file(
+        io.BytesIO(png_bytes),
+        mimetype="image/png",
+        as_attachment=True,
+        download_name=f"{filename}.layer{layer}.png",
+    )
+
+
+@api.route("/layer_tiles", methods=["GET"])
+def layer_tiles() -> str:
+    filename = str(request.args.get("filename"))
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        abort(400)
+    if get_file_extension(path.name) not in get_supported_extensions():
+        abort(400)
+    summary = read_cached_sliced_model_file_summary(path)
+    (width, height) = summary.resolution
+    return jsonify(
+        {
+            "width": width,
+            "height": height,
+            "layer_count": summary.layer_count,
+            "tile_size": TILE_SIZE,
+            "max_zoom": get_max_zoom(width, height),
+        }
+    )
+
 
-    response = make_response(preview_bytes)
-    response.headers.set("Content-Type", "image/png")
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{filename}.png"
+@api.route("/layer_tile", methods=["GET"])
+def layer_tile() -> Response:
+    filename = str(request.args.get("filename"))
+    path = (config.get_files_directory() / filename).resolve()
+    if config.get_files_directory() not in path.parents:
+        abort(400)
+    if get_file_extension(path.name) not in get_supported_extensions():
+        abort(400)
+    coordinates = [
+        request.args.get(name, type=int) for name in ["layer", "zoom", "x", "y"]
+    ]
+    if any(coordinate is None for coordinate in coordinates):
+        abort(400)
+    (layer, zoom, x, y) = [none_throws(coordinate) for coordinate in coordinates]
+
+    try:
+        tile_path = get_cached_layer_tile_path(path, layer, zoom, x, y)
+    except IndexError:
+        abort(400)
+    prefetch_layer_tiles(path, layer, zoom, x, y)
+    return send_file(tile_path, mimetype="image/png")
+
+
+@api.route("/thumbnail_sheet", methods=["GET"])
+def thumbnail_sheet() -> str:
+    filenames = request.args.getlist("filename")
+    if filenames:
+        paths = [
+            (config.get_files_directory() / filename).resolve()
+            for filename in filenames
+        ]
+        if any(config.get_files_directory() not in path.parents for path in paths):
+            abort(400)
+        key = "\n".join(str(path) for path in paths)
+    else:
+        path_parameter = str(request.args.get("path", "."))
+        directory = (config.get_files_directory() / path_parameter).resolve()
+        if (
+            config.get_files_directory() not in directory.parents
+            and directory != config.get_files_directory()
+        ):
+            abort(400)
+        with os.scandir(directory) as dir_entries:
+            paths = sorted(
+                directory / dir_entry.name
+                for dir_entry in dir_entries
+                if dir_entry.is_file()
+            )
+        key = str(directory)
+
+    sheet = get_cached_thumbnail_sheet(
+        [
+            path
+            for path in paths
+            if get_file_extension(path.name) in get_supported_extensions()
+        ],
+        key,
+    )
+    return jsonify(
+        {
+            "url": f"api/thumbnail_sheet/{sheet.fingerprint}.png",
+            "width": sheet.width,
+            "height": sheet.height,
+            "thumbnail_width": THUMBNAIL_WIDTH,
+            "thumbnail_height": THUMBNAIL_HEIGHT,
+            "thumbnails": [
+                {
+                    "path": str(
+                        position.filename.relative_to(config.get_files_directory())
+                    ),
+                    "x": position.x,
+                    "y": position.y,
+                }
+                for position in sheet.thumbnails
+            ],
+        }
     )
 
-    return response
+
+@api.route("/thumbnail_sheet/<fingerprint>.png", methods=["GET"])
+def thumbnail_sheet_image(fingerprint: str) -> Response:
+    if re.fullmatch("[0-9a-f]+", fingerprint) is None:
+        abort(400)
+    sheet_path = get_thumbnail_sheet_path(fingerprint)
+    if not os.path.isfile(sheet_path):
+        abort(404)
+    # sheets are keyed by the contents of the files in them, so they never change,
+    # but they are deleted once a newer sheet replaces them
+    return send_file(sheet_path, mimetype="image/png", max_age=365 * 24 * 60 * 60)
 
 
 class PrinterCommand(Enum):
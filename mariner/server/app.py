@@ -40,6 +40,10 @@ app.config.from_mapping(
         "CACHE_TYPE": "filesystem",
         "CACHE_DIR": config.get_cache_directory(),
         "CACHE_DEFAULT_TIMEOUT": 300,
+        # the cache warmer fills in entries that requests never compute when they
+        # are missing, like the layer areas and the deep integrity reports, so
+        # nothing may be pruned just because there are many files
+        "CACHE_THRESHOLD": 0,
         "SECRET_KEY": os.urandom(16),
     }
 )
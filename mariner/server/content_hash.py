@@ -0,0 +1,33 @@
+import hashlib
+from pathlib import Path
+
+
+SAMPLE_SIZE: int = 64 * 1024
+
+_FULL_HASH_CHUNK_SIZE: int = 1024 * 1024
+
+
+def compute_sampled_hash(path: Path, size: int) -> str:
+    """
+    Hashes the size and a few chunks of a file. Files with the same sampled hash
+    are merely likely to be identical, which takes comparing their full hashes
+    to confirm.
+    """
+    # the header, the middle and the end of the file are what differs between
+    # two slices of the same model, and it takes three reads no matter how large
+    # the file is
+    last_offset = max(0, size - SAMPLE_SIZE)
+    sampled_hash = hashlib.sha256(str(size).encode("utf-8"))
+    with open(path, "rb") as file:
+        for offset in sorted({0, last_offset // 2, last_offset}):
+            file.seek(offset)
+            sampled_hash.update(file.read(SAMPLE_SIZE))
+    return sampled_hash.hexdigest()
+
+
+def compute_full_hash(path: Path) -> str:
+    full_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_FULL_HASH_CHUNK_SIZE), b""):
+            full_hash.update(chunk)
+    return full_hash.hexdigest()
@@ -0,0 +1,745 @@
+import logging
+import os
+import sqlite3
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from mariner import config
+from mariner.exceptions import UnsupportedFileFormat
+from mariner.file_formats import SlicedModelFileSummary
+from mariner.file_formats.utils import (
+    detect_file_format,
+    get_file_extension,
+    get_supported_extensions,
+)
+from mariner.server.content_hash import compute_full_hash, compute_sampled_hash
+from mariner.server.utils import (
+    invalidate_cached_content,
+    read_cached_sliced_model_file_summary,
+)
+
+
+# bump this whenever the schema changes. the index only holds what can be read
+# back from the files themselves, so it's simply rebuilt.
+_SCHEMA_VERSION: int = 4
+
+_COLUMNS: Sequence[str] = [
+    "path",
+    "directory",
+    "filename",
+    "mtime_ns",
+    "size",
+    "fingerprint",
+    "can_be_printed",
+    "print_time_secs",
+    "printer_name",
+    "resolution_x",
+    "resolution_y",
+    "layer_height_mm",
+    "layer_count",
+    "height_mm",
+    "pending",
+    "full_hash",
+]
+
+
+@dataclass(frozen=True)
+class IndexedFile:
+    # relative to the files directory
+    path: str
+    filename: str
+    mtime_ns: int
+    size: int
+    fingerprint: Optional[str]
+    can_be_printed: bool
+    print_time_secs: Optional[int]
+    printer_name: Optional[str]
+    resolution: Optional[Tuple[int, int]]
+    layer_height_mm: Optional[float]
+    layer_count: Optional[int]
+    height_mm: Optional[float]
+    # the file has been seen, but not read yet
+    pending: bool = False
+    # only worked out to tell whether files with the same fingerprint are
+    # actually identical
+    full_hash: Optional[str] = None
+
+    def to_row(self) -> Tuple:
+        (resolution_x, resolution_y) = self.resolution or (None, None)
+        return (
+            self.path,
+            str(Path(self.path).parent),
+            self.filename,
+            self.mtime_ns,
+            self.size,
+            self.fingerprint,
+            self.can_be_printed,
+            self.print_time_secs,
+            self.printer_name,
+            resolution_x,
+            resolution_y,
+            self.layer_height_mm,
+            self.layer_count,
+            self.height_mm,
+            self.pending,
+            self.full_hash,
+        )
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "IndexedFile":
+        (
+            path,
+            _,
+            filename,
+            mtime_ns,
+            size,
+            fingerprint,
+            can_be_printed,
+            print_time_secs,
+            printer_name,
+            resolution_x,
+            resolution_y,
+            layer_height_mm,
+            layer_count,
+            height_mm,
+            pending,
+            full_hash,
+        ) = row
+        return cls(
+            path=path,
+            filename=filename,
+            mtime_ns=mtime_ns,
+            size=size,
+            fingerprint=fingerprint,
+            can_be_printed=bool(can_be_printed),
+            print_time_secs=print_time_secs,
+            printer_name=printer_name,
+            resolution=None
+            if resolution_x is None
+            else (resolution_x, resolution_y),
+            layer_height_mm=layer_height_mm,
+            layer_count=layer_count,
+            height_mm=height_mm,
+            pending=bool(pending),
+            full_hash=full_hash,
+        )
+
+
+# the columns search results can be sorted by
+SORTABLE_COLUMNS: FrozenSet[str] = frozenset(
+    [
+        "path",
+        "filename",
+        "mtime_ns",
+        "size",
+        "print_time_secs",
+        "printer_name",
+        "layer_height_mm",
+        "layer_count",
+        "height_mm",
+    ]
+)
+
+# layer heights are stored as 32-bit floats, so 0.05 comes back as something like
+# 0.0500000007. ranges are widened by this much so their bounds still match.
+_LAYER_HEIGHT_TOLERANCE_MM: float = 1e-6
+
+
+@dataclass(frozen=True)
+class FileQuery:
+    """
+    A search over the sliced files in the index. Every filter that is set must
+    match, and names match case-insensitively anywhere in the filename. Results
+    are paged through by passing the sort value and path of the last result of
+    a page as the cursor of the next one.
+    """
+
+    printer_name: Optional[str] = None
+    resolution: Optional[Tuple[int, int]] = None
+    name: Optional[str] = None
+    min_layer_height_mm: Optional[float] = None
+    max_layer_height_mm: Optional[float] = None
+    min_print_time_secs: Optional[int] = None
+    max_print_time_secs: Optional[int] = None
+    sort_by: str = "mtime_ns"
+    descending: bool = True
+    cursor: Optional[Tuple[Any, str]] = None
+    limit: int = 50
+
+    def get_cursor(self, indexed_file: IndexedFile) -> Tuple[Any, str]:
+        # the sortable columns are all fields of IndexedFile as well
+        return (getattr(indexed_file, self.sort_by), indexed_file.path)
+
+    def to_sql(self) -> Tuple[str, List[Any]]:
+        assert self.sort_by in SORTABLE_COLUMNS
+        conditions = ["can_be_printed"]
+        parameters: List[Any] = []
+        if self.printer_name is not None:
+            conditions.append("printer_name = ?")
+            parameters.append(self.printer_name)
+        if self.resolution is not None:
+            conditions.append("resolution_x = ? AND resolution_y = ?")
+            parameters += list(self.resolution)
+        if self.name is not None:
+            conditions.append("instr(lower(filename), lower(?)) > 0")
+            parameters.append(self.name)
+        if self.min_layer_height_mm is not None:
+            conditions.append("layer_height_mm >= ?")
+            parameters.append(self.min_layer_height_mm - _LAYER_HEIGHT_TOLERANCE_MM)
+        if self.max_layer_height_mm is not None:
+            conditions.append("layer_height_mm <= ?")
+            parameters.append(self.max_layer_height_mm + _LAYER_HEIGHT_TOLERANCE_MM)
+        if self.min_print_time_secs is not None:
+            conditions.append("print_time_secs >= ?")
+            parameters.append(self.min_print_time_secs)
+        if self.max_print_time_secs is not None:
+            conditions.append("print_time_secs <= ?")
+            parameters.append(self.max_print_time_secs)
+        # the path breaks ties, so that the cursor points at a single row
+        direction = "DESC" if self.descending else "ASC"
+        if self.cursor is not None:
+            conditions.append(
+                f"({self.sort_by}, path) {'<' if self.descending else '>'} (?, ?)"
+            )
+            parameters += list(self.cursor)
+        where = " AND ".join(conditions)
+        order_by = f"{self.sort_by} {direction}, path {direction}"
+        parameters.append(self.limit)
+        return (f"{where} ORDER BY {order_by} LIMIT ?", parameters)
+
+
+def _get_relative_path(path: Path) -> str:
+    return str(path.relative_to(config.get_files_directory()))
+
+
+def _read_summary(path: Path) -> Optional[SlicedModelFileSummary]:
+    # files with the right extension may still be something else entirely, like
+    # the ._ resource forks created by macOS
+    if get_file_extension(path.name) not in get_supported_extensions():
+        return None
+    if detect_file_format(path) is None:
+        return None
+    try:
+        return read_cached_sliced_model_file_summary(path)
+    except UnsupportedFileFormat:
+        # not every .zip file is a print job
+        return None
+    except (OSError, EOFError, ValueError, struct.error):
+        # a single corrupt file is listed as unprintable rather than breaking
+        # the listing of its whole directory
+        logging.getLogger(__name__).warning("Failed to read %s", path, exc_info=True)
+        return None
+
+
+def _get_unprintable_file(
+    path: Path, stat: os.stat_result, pending: bool = False
+) -> IndexedFile:
+    return IndexedFile(
+        path=_get_relative_path(path),
+        filename=path.name,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        fingerprint=None,
+        can_be_printed=False,
+        print_time_secs=None,
+        printer_name=None,
+        resolution=None,
+        layer_height_mm=None,
+        layer_count=None,
+        height_mm=None,
+        pending=pending,
+    )
+
+
+def _read_indexed_file(path: Path, stat: os.stat_result) -> IndexedFile:
+    summary = _read_summary(path)
+    if summary is None:
+        return _get_unprintable_file(path, stat)
+    return IndexedFile(
+        path=_get_relative_path(path),
+        filename=path.name,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        fingerprint=compute_sampled_hash(path, stat.st_size),
+        can_be_printed=True,
+        print_time_secs=summary.print_time_secs,
+        printer_name=summary.printer_name,
+        resolution=summary.resolution,
+        layer_height_mm=summary.layer_height_mm,
+        layer_count=summary.layer_count,
+        height_mm=summary.height_mm,
+    )
+
+
+class FileIndex:
+    """
+    A persistent index of every file under the files directory, along with the
+    metadata of the sliced ones. Entries are only re-read when the size or the
+    modification time of a file changes, so keeping the index up to date takes
+    a stat per file.
+    """
+
+    _database: str
+    _connection: Optional[sqlite3.Connection]
+    _lock: threading.Lock
+    _read_executor: ThreadPoolExecutor
+    _pending_reads: Dict[str, "Future[None]"]
+
+    def __init__(self, database: str) -> None:
+        self._database = database
+        self._connection = None
+        self._lock = threading.Lock()
+        self._read_executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_reads = {}
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # the connection is opened lazily, so that the cache warmer and the cache
+        # bootstrapper open their own after being forked from the server
+        if self._connection is not None:
+            return self._connection
+        if self._database != ":memory:":
+            os.makedirs(os.path.dirname(self._database), exist_ok=True)
+        connection = sqlite3.connect(self._database, check_same_thread=False)
+        # lets the server read the index while the cache warmer writes to it
+        connection.execute("PRAGMA journal_mode=WAL")
+        (schema_version,) = connection.execute("PRAGMA user_version").fetchone()
+        if schema_version != _SCHEMA_VERSION:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS files")
+                connection.execute(
+                    """
+                    CREATE TABLE files (
+                        path TEXT PRIMARY KEY,
+                        directory TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        fingerprint TEXT,
+                        can_be_printed INTEGER NOT NULL,
+                        print_time_secs INTEGER,
+                        printer_name TEXT,
+                        resolution_x INTEGER,
+                        resolution_y INTEGER,
+                        layer_height_mm REAL,
+                        layer_count INTEGER,
+                        height_mm REAL,
+                        pending INTEGER NOT NULL,
+                        full_hash TEXT
+                    )
+                    """
+                )
+                connection.execute(
+                    "CREATE INDEX files_by_directory ON files (directory, mtime_ns)"
+                )
+                # the columns searches usually filter on
+                connection.execute(
+                    "CREATE INDEX files_by_printer_name ON files (printer_name)"
+                )
+                connection.execute(
+                    "CREATE INDEX files_by_print_time ON files (print_time_secs)"
+                )
+                connection.execute(
+                    "CREATE INDEX files_by_layer_height ON files (layer_height_mm)"
+                )
+                # files with the same fingerprint are likely to be copies
+                connection.execute(
+                    "CREATE INDEX files_by_fingerprint ON files (fingerprint)"
+                )
+                connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._connection = connection
+        return connection
+
+    def _get_fingerprints(
+        self, connection: sqlite3.Connection, relative_paths: Iterable[str]
+    ) -> Set[str]:
+        fingerprints = set()
+        for relative_path in relative_paths:
+            row = connection.execute(
+                "SELECT fingerprint FROM files WHERE path = ?", (relative_path,)
+            ).fetchone()
+            if row is not None and row[0] is not None:
+                fingerprints.add(row[0])
+        return fingerprints
+
+    def _drop_unused_fingerprints(
+        self, connection: sqlite3.Connection, fingerprints: Set[str]
+    ) -> None:
+        # cache entries are shared by every file with the same fingerprint, so
+        # they're only dropped once the last of those files is gone or changed
+        for fingerprint in fingerprints:
+            row = connection.execute(
+                "SELECT 1 FROM files WHERE fingerprint = ? LIMIT 1", (fingerprint,)
+            ).fetchone()
+            if row is None:
+                invalidate_cached_content(fingerprint)
+
+    def _write(self, indexed_files: Sequence[IndexedFile]) -> None:
+        if not indexed_files:
+            return
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._lock:
+            connection = self._get_connection()
+            fingerprints = self._get_fingerprints(
+                connection, [indexed_file.path for indexed_file in indexed_files]
+            )
+            with connection:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) "
+                    + f"VALUES ({placeholders})",
+                    [indexed_file.to_row() for indexed_file in indexed_files],
+                )
+            self._drop_unused_fingerprints(connection, fingerprints)
+
+    def _delete(self, relative_paths: Sequence[str]) -> None:
+        if not relative_paths:
+            return
+        with self._lock:
+            connection = self._get_connection()
+            fingerprints = self._get_fingerprints(connection, relative_paths)
+            with connection:
+                connection.executemany(
+                    "DELETE FROM files WHERE path = ?",
+                    [(relative_path,) for relative_path in relative_paths],
+                )
+            self._drop_unused_fingerprints(connection, fingerprints)
+
+    def _query(self, where: str, parameters: Sequence[object]) -> List[IndexedFile]:
+        with self._lock:
+            rows = (
+                self._get_connection()
+                .execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM files WHERE {where}",
+                    parameters,
+                )
+                .fetchall()
+            )
+        return [IndexedFile.from_row(row) for row in rows]
+
+    def get_file(self, path: Path) -> Optional[IndexedFile]:
+        indexed_files = self._query("path = ?", [_get_relative_path(path)])
+        return indexed_files[0] if indexed_files else None
+
+    def search(self, query: FileQuery) -> List[IndexedFile]:
+        """
+        Returns a page of the sliced files matching a query. The index isn't
+        synced first, so results are as fresh as the cache warmer keeps it.
+        """
+        (where, parameters) = query.to_sql()
+        return self._query(where, parameters)
+
+    def update_file(self, path: Path, changed: bool = False) -> Optional[IndexedFile]:
+        """
+        Brings the entry of a single file up to date, and returns it. Returns None
+        and drops the entry if the file no longer exists. With changed set, the
+        file is read again even if its size and modification time are the same,
+        which happens for files changed in place on coarse-grained filesystems.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.remove_path(path)
+            return None
+        indexed_file = self.get_file(path)
+        if (
+            changed
+            or indexed_file is None
+            or indexed_file.pending
+            or indexed_file.mtime_ns != stat.st_mtime_ns
+            or indexed_file.size != stat.st_size
+        ):
+            indexed_file = _read_indexed_file(path, stat)
+            self._write([indexed_file])
+        return indexed_file
+
+    def is_file_current(self, path: Path) -> bool:
+        """
+        Tells whether the entry of a file still matches its contents. Files keep
+        their modification time when they're moved or renamed, so this is how
+        those are told apart from files that actually changed.
+        """
+        indexed_file = self.get_file(path)
+        if indexed_file is None or indexed_file.fingerprint is None:
+            return False
+        try:
+            stat = os.stat(path)
+            return (
+                indexed_file.mtime_ns == stat.st_mtime_ns
+                and indexed_file.size == stat.st_size
+                and compute_sampled_hash(path, stat.st_size) == indexed_file.fingerprint
+            )
+        except OSError:
+            return False
+
+    def _find_possible_duplicates(self, path: Path) -> List[IndexedFile]:
+        sampled_hash = compute_sampled_hash(path, os.stat(path).st_size)
+        return self._query(
+            "fingerprint = ? AND path != ? ORDER BY path",
+            [sampled_hash, _get_relative_path(path)],
+        )
+
+    def find_possible_duplicates(self, path: Path) -> List[Path]:
+        """
+        Returns the other files with the same fingerprint as the given one, which
+        are very likely to be identical to it. The fingerprint only covers a few
+        chunks of the file, so this is fast enough to answer uploads with.
+        """
+        return [
+            config.get_files_directory() / indexed_file.path
+            for indexed_file in self._find_possible_duplicates(path)
+        ]
+
+    def _set_full_hash(
+        self, relative_path: str, stat: os.stat_result, full_hash: str
+    ) -> None:
+        # the entry is left alone if the file changed since it was indexed
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute(
+                    "UPDATE files SET full_hash = ? "
+                    + "WHERE path = ? AND mtime_ns = ? AND size = ?",
+                    (full_hash, relative_path, stat.st_mtime_ns, stat.st_size),
+                )
+
+    def _get_full_hash(self, indexed_file: IndexedFile) -> Optional[str]:
+        if indexed_file.full_hash is not None:
+            return indexed_file.full_hash
+        path = config.get_files_directory() / indexed_file.path
+        try:
+            full_hash = compute_full_hash(path)
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (
+            stat.st_mtime_ns != indexed_file.mtime_ns
+            or stat.st_size != indexed_file.size
+        ):
+            # the file changed since its fingerprint was worked out
+            return None
+        self._set_full_hash(indexed_file.path, stat, full_hash)
+        return full_hash
+
+    def find_duplicates(self, path: Path) -> List[Path]:
+        """
+        Returns the other files that are identical to the given one. Files with
+        the same fingerprint are hashed in full to make sure, which takes reading
+        all of them, so this is left to the cache warmer. Full hashes are kept in
+        the index, so every copy is only hashed once.
+        """
+        candidates = self._find_possible_duplicates(path)
+        if not candidates:
+            return []
+        full_hash = compute_full_hash(path)
+        self._set_full_hash(_get_relative_path(path), os.stat(path), full_hash)
+        return [
+            config.get_files_directory() / candidate.path
+            for candidate in candidates
+            if self._get_full_hash(candidate) == full_hash
+        ]
+
+    def _read_pending_file(self, path: Path) -> None:
+        relative_path = _get_relative_path(path)
+        try:
+            self.update_file(path)
+        except Exception:
+            # a broken file would otherwise stay pending forever, and be read
+            # again every time its directory is listed
+            logging.getLogger(__name__).warning(
+                "Failed to index %s", path, exc_info=True
+            )
+            try:
+                self._write([_get_unprintable_file(path, os.stat(path))])
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                del self._pending_reads[relative_path]
+
+    def _read_in_background(self, path: Path) -> None:
+        relative_path = _get_relative_path(path)
+        with self._lock:
+            if relative_path in self._pending_reads:
+                return
+            self._pending_reads[relative_path] = self._read_executor.submit(
+                self._read_pending_file, path
+            )
+
+    def wait_for_pending_reads(self) -> None:
+        with self._lock:
+            futures = list(self._pending_reads.values())
+        wait(futures)
+
+    def remove_path(self, path: Path) -> List[Path]:
+        """
+        Drops the entry of a file, or the entries of everything under a directory,
+        and returns the paths whose entries were dropped.
+        """
+        relative_path = _get_relative_path(path)
+        prefix = f"{relative_path}/"
+        where = "path = ? OR substr(path, 1, ?) = ?"
+        parameters = (relative_path, len(prefix), prefix)
+        with self._lock:
+            connection = self._get_connection()
+            rows = connection.execute(
+                f"SELECT path, fingerprint FROM files WHERE {where}", parameters
+            ).fetchall()
+            with connection:
+                connection.execute(f"DELETE FROM files WHERE {where}", parameters)
+            self._drop_unused_fingerprints(
+                connection,
+                {fingerprint for (_, fingerprint) in rows if fingerprint is not None},
+            )
+        return [config.get_files_directory() / row_path for (row_path, _) in rows]
+
+    def move_path(self, path: Path, new_path: Path) -> None:
+        """
+        Moves the entry of a file, or the entries of everything under a directory,
+        to where it was moved or renamed to. The files themselves haven't changed,
+        so they aren't read again.
+        """
+        relative_path = _get_relative_path(path)
+        new_relative_path = _get_relative_path(new_path)
+        prefix = f"{relative_path}/"
+        where = "path = ? OR substr(path, 1, ?) = ?"
+        parameters = (relative_path, len(prefix), prefix)
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        with self._lock:
+            connection = self._get_connection()
+            rows = connection.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM files WHERE {where}", parameters
+            ).fetchall()
+            moved_files = []
+            suffix_start = len(relative_path)
+            for row in rows:
+                indexed_file = IndexedFile.from_row(row)
+                moved_path = new_relative_path + indexed_file.path[suffix_start:]
+                moved_files.append(
+                    replace(
+                        indexed_file,
+                        path=moved_path,
+                        filename=PurePosixPath(moved_path).name,
+                    )
+                )
+            # whatever the files were moved over is gone
+            fingerprints = self._get_fingerprints(
+                connection, [moved_file.path for moved_file in moved_files]
+            )
+            with connection:
+                connection.execute(f"DELETE FROM files WHERE {where}", parameters)
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) "
+                    + f"VALUES ({placeholders})",
+                    [moved_file.to_row() for moved_file in moved_files],
+                )
+            self._drop_unused_fingerprints(connection, fingerprints)
+
+    def sync_directory(self, directory: Path, read_changed: bool = True) -> None:
+        """
+        Brings the entries of the files directly under a directory up to date.
+        With read_changed set to False, new and changed files are added as
+        pending and read in the background, so this only takes a stat per file.
+        """
+        relative_directory = _get_relative_path(directory)
+        with self._lock:
+            rows = (
+                self._get_connection()
+                .execute(
+                    "SELECT path, mtime_ns, size, pending FROM files "
+                    + "WHERE directory = ?",
+                    (relative_directory,),
+                )
+                .fetchall()
+            )
+        # pending files never match, so they get picked up again
+        stat_by_path: Dict[str, Optional[Tuple[int, int]]] = {
+            path: None if pending else (mtime_ns, size)
+            for (path, mtime_ns, size, pending) in rows
+        }
+        # relative paths are built by hand, since going through pathlib for
+        # every file adds up in directories with thousands of them
+        prefix = "" if relative_directory == "." else f"{relative_directory}/"
+        changed_files = []
+        pending_paths = []
+        seen_paths: Set[str] = set()
+        with os.scandir(directory) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.is_file():
+                    continue
+                relative_path = prefix + dir_entry.name
+                seen_paths.add(relative_path)
+                stat = dir_entry.stat()
+                if stat_by_path.get(relative_path) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                path = directory / dir_entry.name
+                if read_changed:
+                    changed_files.append(_read_indexed_file(path, stat))
+                else:
+                    changed_files.append(_get_unprintable_file(path, stat, True))
+                    pending_paths.append(path)
+        self._write(changed_files)
+        self._delete(
+            [
+                relative_path
+                for relative_path in stat_by_path.keys()
+                if relative_path not in seen_paths
+            ]
+        )
+        for path in pending_paths:
+            self._read_in_background(path)
+
+    def list_directory(
+        self,
+        directory: Path,
+        cursor: Optional[Tuple[int, str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[IndexedFile]:
+        """
+        Returns the files directly under a directory from the most recently
+        modified to the least, as of the last sync. Results are paged through by
+        passing the modification time and filename of the last result of a page
+        as the cursor of the next one.
+        """
+        where = "directory = ?"
+        parameters: List[Any] = [_get_relative_path(directory)]
+        if cursor is not None:
+            (mtime_ns, filename) = cursor
+            where += " AND (mtime_ns < ? OR (mtime_ns = ? AND filename > ?))"
+            parameters += [mtime_ns, mtime_ns, filename]
+        where += " ORDER BY mtime_ns DESC, filename"
+        if limit is not None:
+            where += " LIMIT ?"
+            parameters.append(limit)
+        return self._query(where, parameters)
+
+    def sync(self) -> None:
+        """
+        Brings the whole index up to date with the files directory.
+        """
+        files_directory = config.get_files_directory()
+        seen_directories = set()
+        for (directory, _, _) in os.walk(files_directory):
+            seen_directories.add(str(Path(directory).relative_to(files_directory)))
+            self.sync_directory(Path(directory))
+        with self._lock:
+            rows = (
+                self._get_connection()
+                .execute("SELECT DISTINCT directory FROM files")
+                .fetchall()
+            )
+        for (directory,) in rows:
+            if directory not in seen_directories:
+                self.remove_path(files_directory / directory)
+
+
+@lru_cache(maxsize=None)
+def get_file_index() -> FileIndex:
+    # not right in the cache directory, which flask-caching prunes as if every
+    # file in it were a cache entry
+    return FileIndex(
+        str(Path(config.get_cache_directory()) / "index" / "file_index.sqlite3")
+    )
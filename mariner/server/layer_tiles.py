@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List
+
+import png
+
+from mariner import config
+from mariner.file_formats import LayerImage
+from mariner.file_formats.utils import get_file_format
+from mariner.server.utils import write_file_atomically
+
+
+TILE_SIZE: int = 256
+PREFETCH_LAYER_COUNT: int = 2
+
+_MAX_CACHE_SIZE_BYTES: int = 64 * 1024 * 1024
+# scanning the cache directory isn't free, so we only evict tiles every so often
+_WRITES_PER_EVICTION: int = 16
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=1)
+_lock = threading.Lock()
+_writes_since_eviction: int = 0
+_requested_layer_by_filename: Dict[Path, int] = {}
+
+
+def get_max_zoom(width: int, height: int) -> int:
+    """
+    Returns the zoom level at which layers are shown at full resolution. At zoom
+    level 0 the whole layer fits in a single tile, and every level doubles the
+    resolution of the previous one.
+    """
+    zoom = 0
+    while max(width, height) > TILE_SIZE << zoom:
+        zoom += 1
+    return zoom
+
+
+def _get_cache_directory() -> Path:
+    return Path(config.get_cache_directory()) / "layer_tiles"
+
+
+def _get_fingerprint(filename: Path) -> str:
+    # tiles are keyed by the size and modification time of the file, so stale
+    # tiles are never served and eventually get evicted once a file changes
+    stat = os.stat(filename)
+    line = f"{filename}:{stat.st_mtime_ns}:{stat.st_size}"
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=2)
+def _read_layer_image(filename: Path, fingerprint: str, layer: int) -> LayerImage:
+    # all tiles of a layer are usually requested together, so we keep the last
+    # decoded layers around instead of decoding them again for every tile
+    return get_file_format(str(filename)).read_layer_image(filename, layer)
+
+
+def _reduce_block_row(
+    image: LayerImage, left: int, top: int, width: int, scale: int
+) -> bytes:
+    block_width = width * scale
+    lit_rows = []
+    for y in range(top, min(top + scale, image.height)):
+        start = y * image.width + left
+        end = start + min(block_width, image.width - left)
+        pixels = bytes(image.pixels[start:end])
+        # most of a layer is usually empty, so blank rows are skipped up front
+        if pixels.strip(b"\0"):
+            lit_rows.append(pixels + bytes(block_width - len(pixels)))
+    if not lit_rows:
+        return bytes(width)
+    if scale == 1:
+        return lit_rows[0]
+    columns = bytes(map(max, *lit_rows)) if len(lit_rows) > 1 else lit_rows[0]
+    return bytes(map(max, *[columns[offset::scale] for offset in range(scale)]))
+
+
+def _render_tile(image: LayerImage, zoom: int, x: int, y: int) -> png.Image:
+    max_zoom = get_max_zoom(image.width, image.height)
+    if zoom < 0 or zoom > max_zoom or x < 0 or y < 0:
+        raise IndexError(f"Invalid tile {x},{y} at zoom level {zoom}")
+    scale = 1 << (max_zoom - zoom)
+    left = x * TILE_SIZE * scale
+    top = y * TILE_SIZE * scale
+    if left >= image.width or top >= image.height:
+        raise IndexError(f"Invalid tile {x},{y} at zoom level {zoom}")
+
+    # every pixel of a tile is the brightest pixel of the scale x scale block it
+    # covers, so features thinner than a block, like supports, don't vanish as
+    # we zoom out. rows are combined with map(max, ...), which keeps the loop
+    # over the pixels in C. tiles along the edges of the layer are padded with
+    # black.
+    width = min(TILE_SIZE, (image.width - left + scale - 1) // scale)
+    height = min(TILE_SIZE, (image.height - top + scale - 1) // scale)
+    padding = bytes(TILE_SIZE - width)
+    rows: List[bytes] = []
+    for row in range(height):
+        block_row = _reduce_block_row(image, left, top + row * scale, width, scale)
+        rows.append(block_row + padding)
+    rows += [bytes(TILE_SIZE)] * (TILE_SIZE - height)
+    return png.from_array(rows, "L", info={"width": TILE_SIZE, "height": TILE_SIZE})
+
+
+def _evict_least_recently_used_tiles() -> None:
+    tiles = []
+    with os.scandir(_get_cache_directory()) as dir_entries:
+        for dir_entry in dir_entries:
+            # tiles that are still being written are left alone
+            if dir_entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = dir_entry.stat()
+            except FileNotFoundError:
+                continue
+            tiles.append((stat.st_mtime_ns, stat.st_size, dir_entry.path))
+
+    cache_size = sum(size for (_, size, _) in tiles)
+    for (_, size, path) in sorted(tiles):
+        if cache_size <= _MAX_CACHE_SIZE_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        cache_size -= size
+
+
+def get_cached_layer_tile_path(
+    filename: Path, layer: int, zoom: int, x: int, y: int
+) -> Path:
+    """
+    Returns the path to a PNG file with a TILE_SIZE x TILE_SIZE tile of the given
+    layer, rendering it first if it isn't cached yet. Raises IndexError for
+    layers or tiles that don't exist. Tiles are evicted from the cache in least
+    recently used order once the cache grows past its maximum size.
+    """
+    global _writes_since_eviction
+
+    fingerprint = _get_fingerprint(filename)
+    tile_path = _get_cache_directory() / f"{fingerprint}-{layer}-{zoom}-{x}-{y}.png"
+    if os.path.exists(tile_path):
+        # the modification time of tiles is used as their last access time,
+        # since the cache directory may well be mounted with noatime
+        os.utime(tile_path)
+        return tile_path
+
+    image = _read_layer_image(filename, fingerprint, layer)
+    write_file_atomically(tile_path, _render_tile(image, zoom, x, y).write)
+
+    with _lock:
+        _writes_since_eviction += 1
+        should_evict = _writes_since_eviction >= _WRITES_PER_EVICTION
+        if should_evict:
+            _writes_since_eviction = 0
+    if should_evict:
+        _evict_least_recently_used_tiles()
+    return tile_path
+
+
+def _prefetch_layer_tile(filename: Path, layer: int, zoom: int, x: int, y: int) -> None:
+    # by the time we get to it the user may have scrubbed somewhere else
+    requested_layer = _requested_layer_by_filename.get(filename, layer)
+    if abs(requested_layer - layer) > PREFETCH_LAYER_COUNT:
+        return
+    try:
+        get_cached_layer_tile_path(filename, layer, zoom, x, y)
+    except IndexError:
+        pass
+    except Exception:
+        logging.getLogger(__name__).warning(
+            "Failed to prefetch layer %d of %s", layer, filename, exc_info=True
+        )
+
+
+def prefetch_layer_tiles(filename: Path, layer: int, zoom: int, x: int, y: int) -> None:
+    """
+    Renders the same tile of the layers around the given one in the background,
+    so that they are already cached as the user scrubs through the layers.
+    """
+    _requested_layer_by_filename[filename] = layer
+    for distance in range(1, PREFETCH_LAYER_COUNT + 1):
+        for neighbor in [layer + distance, layer - distance]:
+            _prefetch_executor.submit(
+                _prefetch_layer_tile, filename, neighbor, zoom, x, y
+            )
@@ -0,0 +1,178 @@
+import io
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+import png
+
+from mariner.file_formats.utils import get_file_format
+
+
+TValue = TypeVar("TValue")
+
+
+def render_layer_png(filename: Path, layer: int) -> bytes:
+    png_bytes = io.BytesIO()
+    image = get_file_format(str(filename)).read_layer_image(filename, layer)
+    image.to_png().write(png_bytes)
+    return png_bytes.getvalue()
+
+
+def render_blank_png() -> bytes:
+    png_bytes = io.BytesIO()
+    png.from_array([[0]], "L").write(png_bytes)
+    return png_bytes.getvalue()
+
+
+class SharedPoller(Generic[TValue]):
+    """
+    Polls for a value from a single background thread for as long as anybody is
+    subscribed to it, so that every viewer of the live layer shares the same
+    connection to the printer instead of opening the serial port on its own.
+    Failed polls keep the last value around, and are logged unless they raised
+    one of the given recoverable errors.
+    """
+
+    _poll: Callable[[], TValue]
+    _interval_secs: float
+    _recoverable_errors: Tuple[Type[Exception], ...]
+    _condition: threading.Condition
+    _thread: Optional[threading.Thread]
+    _subscriber_count: int
+    _version: int
+    _value: Optional[TValue]
+
+    def __init__(
+        self,
+        poll: Callable[[], TValue],
+        interval_secs: float,
+        recoverable_errors: Tuple[Type[Exception], ...] = (),
+    ) -> None:
+        self._poll = poll
+        self._interval_secs = interval_secs
+        self._recoverable_errors = recoverable_errors
+        self._condition = threading.Condition()
+        self._thread = None
+        self._subscriber_count = 0
+        self._version = 0
+        self._value = None
+
+    @contextmanager
+    def subscribe(self) -> Iterator[int]:
+        """
+        Keeps the value polled while the context is open. Yields the version to
+        start waiting for changes from, so that a value polled for somebody else
+        is returned right away.
+        """
+        with self._condition:
+            self._subscriber_count += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            version = self._version if self._value is None else -1
+        try:
+            yield version
+        finally:
+            with self._condition:
+                self._subscriber_count -= 1
+
+    def wait_for_change(
+        self, version: int, timeout_secs: float
+    ) -> Tuple[int, Optional[TValue]]:
+        """
+        Waits until the value changes from the given version, or until the
+        timeout expires, and returns the latest version along with its value.
+        The value is None until the first successful poll.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout_secs)
+            return (self._version, self._value)
+
+    def _stop(self) -> None:
+        # nobody is keeping the value up to date from now on
+        self._thread = None
+        self._value = None
+
+    def _poll_once(self) -> bool:
+        try:
+            value = self._poll()
+            with self._condition:
+                if value != self._value:
+                    self._value = value
+                    self._version += 1
+                    self._condition.notify_all()
+        except Exception as exception:
+            if not isinstance(exception, self._recoverable_errors):
+                logging.getLogger(__name__).warning("Failed to poll", exc_info=True)
+        with self._condition:
+            if self._subscriber_count == 0:
+                self._stop()
+                return False
+        return True
+
+    def _run(self) -> None:
+        try:
+            while self._poll_once():
+                time.sleep(self._interval_secs)
+        except BaseException:
+            # the next subscriber starts polling again
+            with self._condition:
+                self._stop()
+            raise
+
+
+class LookAheadLayerRenderer:
+    """
+    Renders layers as PNG images while a file is being printed. Every time a
+    layer is rendered, the next one is rendered in the background, so it is
+    ready by the time the printer moves on to it.
+    """
+
+    _executor: ThreadPoolExecutor
+    _pending: Dict[Tuple[Path, int], "Future[bytes]"]
+
+    def __init__(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = {}
+
+    def render(self, filename: Path, layer: int) -> bytes:
+        future = self._pending.pop((filename, layer), None)
+        png_bytes = None
+        if future is not None:
+            try:
+                png_bytes = future.result()
+            except Exception:
+                # we'll try again below, which reports the error properly
+                pass
+        if png_bytes is None:
+            png_bytes = render_layer_png(filename, layer)
+
+        # the printer only ever moves forward, so anything else we rendered
+        # ahead of time won't be needed anymore
+        for stale_future in self._pending.values():
+            stale_future.cancel()
+        self._pending = {
+            (filename, layer + 1): self._executor.submit(
+                render_layer_png, filename, layer + 1
+            )
+        }
+        return png_bytes
+
+    def close(self) -> None:
+        for future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,314 @@
+import dataclasses
+import io
+import os
+import pathlib
+import struct
+import zipfile
+from typing import Any, List, Optional
+from unittest.mock import patch
+
+from freezegun import freeze_time
+from pyfakefs.fake_filesystem_unittest import TestCase
+
+from mariner.server.content_hash import compute_full_hash
+from mariner.server.file_index import FileIndex, FileQuery, IndexedFile
+from mariner.server.utils import read_cached_sliced_model_file_summary
+
+
+class FileIndexTest(TestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            self.ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        with freeze_time("2021-05-14"):
+            self.fs.create_file("/mnt/usb_share/a.ctb", contents=self.ctb_file_contents)
+        with freeze_time("2021-05-15"):
+            self.fs.create_file("/mnt/usb_share/notes.txt", contents="dummy content")
+        self.fs.create_file(
+            "/mnt/usb_share/foo/b.ctb", contents=self.ctb_file_contents
+        )
+        self.directory = pathlib.Path("/mnt/usb_share")
+        self.file_index = FileIndex(":memory:")
+
+    def test_sync_directory(self) -> None:
+        self.file_index.sync_directory(self.directory)
+        indexed_files = self.file_index.list_directory(self.directory)
+        self.assertEqual(
+            [indexed_file.path for indexed_file in indexed_files],
+            ["notes.txt", "a.ctb"],
+        )
+        (notes, sliced_file) = indexed_files
+        self.assertFalse(notes.can_be_printed)
+        self.assertIsNone(notes.print_time_secs)
+        self.assertTrue(sliced_file.can_be_printed)
+        self.assertEqual(sliced_file.print_time_secs, 5621)
+        self.assertEqual(sliced_file.resolution, (1440, 2560))
+        self.assertEqual(sliced_file.layer_count, 400)
+        self.assertEqual(sliced_file.printer_name, "ELEGOO MARS Pro")
+        self.assertIsNotNone(sliced_file.fingerprint)
+
+    def test_unreadable_files_are_not_printable(self) -> None:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("photo.png", b"not a print job")
+        self.fs.create_file("/mnt/usb_share/photos.zip", contents=archive.getvalue())
+        self.fs.create_file(
+            "/mnt/usb_share/truncated.zip", contents=archive.getvalue()[:-10]
+        )
+        self.file_index.sync_directory(self.directory)
+        for filename in ["photos.zip", "truncated.zip"]:
+            indexed_file = self.file_index.get_file(self.directory / filename)
+            self.assertIsNotNone(indexed_file)
+            self.assertFalse(indexed_file.can_be_printed)
+        self.assertTrue(
+            self.file_index.get_file(self.directory / "a.ctb").can_be_printed
+        )
+
+    def test_unchanged_files_are_not_read_again(self) -> None:
+        self.file_index.sync_directory(self.directory)
+        with patch(
+            "mariner.server.file_index.read_cached_sliced_model_file_summary",
+            side_effect=read_cached_sliced_model_file_summary,
+        ) as read_mock:
+            self.file_index.sync_directory(self.directory)
+            read_mock.assert_not_called()
+
+            with open(self.directory / "a.ctb", "ab") as file:
+                file.write(b"\0")
+            self.file_index.sync_directory(self.directory)
+            read_mock.assert_called_once_with(self.directory / "a.ctb")
+
+    def test_deleted_files_are_dropped(self) -> None:
+        self.file_index.sync()
+        self.assertIsNotNone(self.file_index.get_file(self.directory / "foo/b.ctb"))
+
+        os.remove(self.directory / "a.ctb")
+        self.file_index.sync_directory(self.directory)
+        self.assertEqual(
+            [
+                indexed_file.path
+                for indexed_file in self.file_index.list_directory(self.directory)
+            ],
+            ["notes.txt"],
+        )
+
+        self.fs.remove_object("/mnt/usb_share/foo")
+        self.file_index.sync()
+        self.assertIsNone(self.file_index.get_file(self.directory / "foo/b.ctb"))
+
+    def test_cache_entries_are_dropped_with_the_last_copy(self) -> None:
+        self.file_index.sync()
+        fingerprint = self.file_index.get_file(self.directory / "a.ctb").fingerprint
+        with patch(
+            "mariner.server.file_index.invalidate_cached_content"
+        ) as invalidate_mock:
+            # foo/b.ctb is a copy of a.ctb, so its entries are still needed
+            os.remove(self.directory / "a.ctb")
+            self.file_index.sync_directory(self.directory)
+            invalidate_mock.assert_not_called()
+
+            self.file_index.remove_path(self.directory / "foo")
+            invalidate_mock.assert_called_once_with(fingerprint)
+
+    def test_pending_files_are_read_in_the_background(self) -> None:
+        self.file_index.sync_directory(self.directory, read_changed=False)
+        indexed_files = self.file_index.list_directory(self.directory)
+        self.assertEqual(
+            [(f.path, f.pending) for f in indexed_files],
+            [("notes.txt", True), ("a.ctb", True)],
+        )
+
+        self.file_index.wait_for_pending_reads()
+        indexed_files = self.file_index.list_directory(self.directory)
+        self.assertEqual(
+            [(f.path, f.pending, f.can_be_printed) for f in indexed_files],
+            [("notes.txt", False, False), ("a.ctb", False, True)],
+        )
+
+    def test_list_directory_pages(self) -> None:
+        with freeze_time("2021-05-14"):
+            self.fs.create_file("/mnt/usb_share/b.ctb", contents="dummy content")
+        self.file_index.sync_directory(self.directory)
+        first_page = self.file_index.list_directory(self.directory, limit=2)
+        second_page = self.file_index.list_directory(
+            self.directory,
+            cursor=(first_page[-1].mtime_ns, first_page[-1].filename),
+            limit=2,
+        )
+        # a.ctb and b.ctb were modified at the same time, and are listed by name
+        self.assertEqual(
+            [indexed_file.path for indexed_file in first_page + second_page],
+            ["notes.txt", "a.ctb", "b.ctb"],
+        )
+
+    def test_update_file(self) -> None:
+        indexed_file = self.file_index.update_file(self.directory / "foo/b.ctb")
+        self.assertIsNotNone(indexed_file)
+        self.assertEqual(
+            self.file_index.get_file(self.directory / "foo/b.ctb"), indexed_file
+        )
+
+        self.assertEqual(
+            self.file_index.remove_path(self.directory / "foo"),
+            [self.directory / "foo/b.ctb"],
+        )
+        self.assertIsNone(self.file_index.get_file(self.directory / "foo/b.ctb"))
+
+    def test_move_path(self) -> None:
+        self.file_index.sync()
+        self.file_index.move_path(self.directory / "foo", self.directory / "bar")
+        self.file_index.move_path(self.directory / "a.ctb", self.directory / "c.ctb")
+        self.assertIsNone(self.file_index.get_file(self.directory / "foo/b.ctb"))
+        indexed_file = self.file_index.get_file(self.directory / "bar/b.ctb")
+        self.assertIsNotNone(indexed_file)
+        self.assertEqual(indexed_file.filename, "b.ctb")
+        self.assertEqual(
+            [
+                indexed_file.path
+                for indexed_file in self.file_index.list_directory(self.directory)
+            ],
+            ["notes.txt", "c.ctb"],
+        )
+
+    def test_find_duplicates(self) -> None:
+        self.file_index.sync()
+        self.fs.create_file("/mnt/usb_share/c.ctb", contents=self.ctb_file_contents)
+        copy_path = self.directory / "c.ctb"
+        # matching fingerprints are enough to tell an upload it's likely a copy
+        self.assertEqual(
+            self.file_index.find_possible_duplicates(copy_path),
+            [self.directory / "a.ctb", self.directory / "foo/b.ctb"],
+        )
+        with patch(
+            "mariner.server.file_index.compute_full_hash",
+            side_effect=compute_full_hash,
+        ) as compute_full_hash_mock:
+            self.assertEqual(
+                self.file_index.find_duplicates(copy_path),
+                [self.directory / "a.ctb", self.directory / "foo/b.ctb"],
+            )
+            self.assertEqual(compute_full_hash_mock.call_count, 3)
+            # the full hashes are kept in the index
+            self.file_index.find_duplicates(copy_path)
+            self.assertEqual(compute_full_hash_mock.call_count, 4)
+        self.assertEqual(
+            self.file_index.get_file(self.directory / "a.ctb").full_hash,
+            compute_full_hash(copy_path),
+        )
+
+    def test_changed_copies_are_not_duplicates(self) -> None:
+        self.file_index.sync()
+        # the fingerprint doesn't cover the middle of the layer data, so this
+        # takes comparing the full hashes
+        changed_contents = bytearray(self.ctb_file_contents)
+        changed_contents[len(changed_contents) // 4] ^= 0xFF
+        self.fs.create_file("/mnt/usb_share/c.ctb", contents=bytes(changed_contents))
+        copy_path = self.directory / "c.ctb"
+        self.assertEqual(
+            self.file_index.find_possible_duplicates(copy_path),
+            [self.directory / "a.ctb", self.directory / "foo/b.ctb"],
+        )
+        self.assertEqual(self.file_index.find_duplicates(copy_path), [])
+
+    def test_is_file_current(self) -> None:
+        self.file_index.sync()
+        self.assertTrue(self.file_index.is_file_current(self.directory / "a.ctb"))
+        self.assertFalse(self.file_index.is_file_current(self.directory / "c.ctb"))
+
+        # moved files keep their modification time
+        os.rename(self.directory / "a.ctb", self.directory / "c.ctb")
+        self.file_index.move_path(self.directory / "a.ctb", self.directory / "c.ctb")
+        self.assertTrue(self.file_index.is_file_current(self.directory / "c.ctb"))
+
+        with open(self.directory / "c.ctb", "ab") as file:
+            file.write(b"\0")
+        self.assertFalse(self.file_index.is_file_current(self.directory / "c.ctb"))
+
+
+class FileSearchTest(TestCase):
+    def setUp(self) -> None:
+        self.setUpPyfakefs()
+        self.file_index = FileIndex(":memory:")
+        self.file_index._write(
+            [
+                _make_indexed_file("cube.ctb", 100, "ELEGOO MARS", 0.05, 3600),
+                _make_indexed_file("foo/Cube.ctb", 200, "ELEGOO MARS", 0.03, 7200),
+                _make_indexed_file("sphere.ctb", 300, "ELEGOO MARS", 0.05, 1800),
+                _make_indexed_file("tree.cbddlp", 400, "ANYCUBIC", 0.05, 5400),
+                _make_indexed_file("notes.txt", 500, None, None, None),
+            ]
+        )
+
+    def _search(self, **kwargs: Any) -> List[str]:
+        return [
+            indexed_file.path
+            for indexed_file in self.file_index.search(FileQuery(**kwargs))
+        ]
+
+    def test_filters(self) -> None:
+        self.assertEqual(
+            self._search(), ["tree.cbddlp", "sphere.ctb", "foo/Cube.ctb", "cube.ctb"]
+        )
+        self.assertEqual(
+            self._search(printer_name="ANYCUBIC", resolution=(1440, 2560)),
+            ["tree.cbddlp"],
+        )
+        self.assertEqual(self._search(resolution=(2560, 1440)), [])
+        self.assertEqual(self._search(name="CUBE"), ["foo/Cube.ctb", "cube.ctb"])
+        self.assertEqual(
+            self._search(min_layer_height_mm=0.05, max_layer_height_mm=0.05),
+            ["tree.cbddlp", "sphere.ctb", "cube.ctb"],
+        )
+        self.assertEqual(
+            self._search(min_print_time_secs=3600, max_print_time_secs=5400),
+            ["tree.cbddlp", "cube.ctb"],
+        )
+
+    def test_sorting_and_pagination(self) -> None:
+        self.assertEqual(
+            self._search(sort_by="layer_height_mm", descending=False),
+            ["foo/Cube.ctb", "cube.ctb", "sphere.ctb", "tree.cbddlp"],
+        )
+
+        query = FileQuery(sort_by="layer_height_mm", descending=False, limit=2)
+        first_page = self.file_index.search(query)
+        second_page = self.file_index.search(
+            dataclasses.replace(query, cursor=query.get_cursor(first_page[-1]))
+        )
+        self.assertEqual(
+            [indexed_file.path for indexed_file in first_page + second_page],
+            ["foo/Cube.ctb", "cube.ctb", "sphere.ctb", "tree.cbddlp"],
+        )
+
+
+def _make_indexed_file(
+    path: str,
+    mtime_ns: int,
+    printer_name: Optional[str],
+    layer_height_mm: Optional[float],
+    print_time_secs: Optional[int],
+) -> IndexedFile:
+    can_be_printed = printer_name is not None
+    return IndexedFile(
+        path=path,
+        filename=pathlib.Path(path).name,
+        mtime_ns=mtime_ns,
+        size=1000,
+        fingerprint=None,
+        can_be_printed=can_be_printed,
+        print_time_secs=print_time_secs,
+        printer_name=printer_name,
+        resolution=(1440, 2560) if can_be_printed else None,
+        # the file formats store layer heights as 32-bit floats
+        layer_height_mm=None
+        if layer_height_mm is None
+        else struct.unpack("<f", struct.pack("<f", layer_height_mm))[0],
+        layer_count=400 if can_be_printed else None,
+        height_mm=20.0 if can_be_printed else None,
+    )
@@ -0,0 +1,104 @@
+import mmap
+import os
+import pathlib
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import png
+
+from pyexpect import expect
+from pyfakefs.fake_filesystem_unittest import TestCase as FakeFilesystemTestCase
+
+from mariner.file_formats import LayerImage
+from mariner.file_formats.ctb import CTBFile
+from mariner.server.layer_tiles import (
+    _evict_least_recently_used_tiles,
+    _read_layer_image,
+    _render_tile,
+    get_cached_layer_tile_path,
+    get_max_zoom,
+)
+
+
+class LayerTileTest(TestCase):
+    def test_max_zoom(self) -> None:
+        expect(get_max_zoom(256, 100)).to_equal(0)
+        expect(get_max_zoom(257, 100)).to_equal(1)
+        expect(get_max_zoom(1440, 2560)).to_equal(4)
+        expect(get_max_zoom(7680, 4320)).to_equal(5)
+
+    def test_render_tile(self) -> None:
+        # every pixel is set to its column, so we can tell which ones were kept
+        image = LayerImage(width=300, height=20, pixels=bytearray(range(150)) * 40)
+        tile = _render_tile(image, 0, 0, 0)
+        rows = [bytes(row) for row in tile.rows]
+        expect(len(rows)).to_equal(256)
+        expect(rows[0][:4]).to_equal(bytes([1, 3, 5, 7]))
+        expect(rows[0][149]).to_equal(149)
+        expect(rows[0][150:]).to_equal(bytes(106))
+        expect(rows[10:]).to_equal([bytes(256)] * 246)
+
+        rows = [bytes(row) for row in _render_tile(image, 1, 1, 0).rows]
+        expect(rows[0][:44]).to_equal(bytes(range(106, 150)))
+        expect(rows[0][44:]).to_equal(bytes(212))
+
+    def test_thin_features_survive_downsampling(self) -> None:
+        # a line one pixel wide, on the odd column of every 2x2 block
+        pixels = bytearray(300 * 21)
+        for row in range(21):
+            pixels[row * 300 + 7] = 255
+        image = LayerImage(width=300, height=21, pixels=pixels)
+        rows = [bytes(row) for row in _render_tile(image, 0, 0, 0).rows]
+        expect([row[3] for row in rows[:11]]).to_equal([255] * 11)
+        expect(sum(map(sum, rows))).to_equal(255 * 11)
+
+    def test_render_tile_out_of_bounds(self) -> None:
+        image = LayerImage(width=300, height=20, pixels=bytearray(300 * 20))
+        for (zoom, x, y) in [(2, 0, 0), (-1, 0, 0), (1, 2, 0), (1, 0, 1), (0, -1, 0)]:
+            with self.assertRaises(IndexError):
+                _render_tile(image, zoom, x, y)
+
+
+class LayerTileRenderingTest(TestCase):
+    def test_tiles_are_rendered_from_a_mapped_file(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        _read_layer_image.cache_clear()
+        with tempfile.TemporaryDirectory() as directory, patch(
+            "mariner.server.layer_tiles._get_cache_directory",
+            return_value=pathlib.Path(directory),
+        ), patch("mariner.file_formats.mmap.mmap", wraps=mmap.mmap) as mmap_mock:
+            tile_path = get_cached_layer_tile_path(path, 399, 0, 0, 0)
+            (_, _, rows, _) = png.Reader(filename=str(tile_path)).read()
+            tile_rows = [bytes(row) for row in rows]
+        mmap_mock.assert_called_once()
+        _read_layer_image.cache_clear()
+
+        image = CTBFile.read_layer_image(path, 399)
+        expect(tile_rows).to_equal(
+            [bytes(row) for row in _render_tile(image, 0, 0, 0).rows]
+        )
+        expect(any(any(row) for row in tile_rows)).to_equal(True)
+
+
+class LayerTileCacheTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        self.setUpPyfakefs()
+
+    @patch("mariner.server.layer_tiles._MAX_CACHE_SIZE_BYTES", 250)
+    def test_least_recently_used_tiles_are_evicted(self) -> None:
+        directory = pathlib.Path("/tmp/mariner/layer_tiles")
+        for (index, name) in enumerate(["a.png", "b.png", "c.png", "d.tmp"]):
+            self.fs.create_file(directory / name, contents="x" * 100)
+            os.utime(directory / name, ns=(index, index))
+        # b was used most recently, so a and c are the least recently used
+        os.utime(directory / "b.png", ns=(10, 10))
+
+        _evict_least_recently_used_tiles()
+        # d is still being written, so it doesn't count and is never evicted
+        expect(sorted(os.listdir(directory))).to_equal(["b.png", "c.png", "d.tmp"])
@@ -0,0 +1,75 @@
+import pathlib
+import threading
+from unittest import TestCase
+from unittest.mock import call, patch, MagicMock
+
+from pyexpect import expect
+
+from mariner.server.live_layer import LookAheadLayerRenderer, SharedPoller
+
+
+class LookAheadLayerRendererTest(TestCase):
+    @patch("mariner.server.live_layer.render_layer_png")
+    def test_next_layer_is_rendered_ahead_of_time(
+        self, render_layer_png_mock: MagicMock
+    ) -> None:
+        render_layer_png_mock.side_effect = lambda filename, layer: bytes([layer])
+        path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+        renderer = LookAheadLayerRenderer()
+        try:
+            expect(renderer.render(path, 3)).to_equal(bytes([3]))
+            expect(renderer.render(path, 4)).to_equal(bytes([4]))
+        finally:
+            renderer.close()
+
+        # layer 4 was rendered in the background while layer 3 was shown
+        render_layer_png_mock.assert_has_calls([call(path, 3), call(path, 4)])
+        expect(render_layer_png_mock.call_args_list.count(call(path, 4))).to_equal(1)
+
+    @patch("mariner.server.live_layer.render_layer_png")
+    def test_failed_look_ahead_is_retried(
+        self, render_layer_png_mock: MagicMock
+    ) -> None:
+        render_layer_png_mock.side_effect = [b"3", Exception(), b"4"]
+        path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+        renderer = LookAheadLayerRenderer()
+        try:
+            renderer.render(path, 3)
+            expect(renderer.render(path, 4)).to_equal(b"4")
+        finally:
+            renderer.close()
+
+
+class SharedPollerTest(TestCase):
+    def test_subscribers_share_a_single_thread(self) -> None:
+        polling_threads = set()
+
+        def poll() -> int:
+            polling_threads.add(threading.get_ident())
+            return 1
+
+        poller = SharedPoller(poll, 0.0)
+        with poller.subscribe() as first_version:
+            expect(poller.wait_for_change(first_version, 5.0)[1]).to_equal(1)
+            # the value was already polled, so it's returned right away
+            with poller.subscribe() as second_version:
+                expect(poller.wait_for_change(second_version, 5.0)[1]).to_equal(1)
+        expect(len(polling_threads)).to_equal(1)
+
+    def test_recoverable_errors_keep_the_last_value(self) -> None:
+        values = iter([1, ValueError(), ValueError(), 2])
+
+        def poll() -> int:
+            value = next(values, 2)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        poller = SharedPoller(poll, 0.0, recoverable_errors=(ValueError,))
+        with poller.subscribe() as version:
+            (version, value) = poller.wait_for_change(version, 5.0)
+            expect(value).to_equal(1)
+            (version, value) = poller.wait_for_change(version, 5.0)
+            expect(value).to_equal(2)
+            # nothing changes anymore, so waiting times out
+            expect(poller.wait_for_change(version, 0.01)).to_equal((version, 2))
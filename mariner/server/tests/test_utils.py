@@ -1,7 +1,27 @@
+import hashlib
+import os
+import pathlib
 from unittest import TestCase
 from unittest.mock import patch
 
-from mariner.server.utils import retry
+from pyfakefs.fake_filesystem_unittest import TestCase as FakeFilesystemTestCase
+
+from mariner import config
+from mariner.file_formats.utils import get_file_format
+from mariner.server.content_hash import compute_sampled_hash
+from mariner.server.utils import (
+    get_cached_integrity_report,
+    get_cached_layer_area_table,
+    get_cached_preview_path,
+    invalidate_cached_content,
+    invalidate_cached_file,
+    read_cached_integrity_report,
+    read_cached_layer_area_table,
+    read_cached_sliced_model_file_summary,
+    relink_cached_file,
+    retry,
+    share_cached_file,
+)
 
 
 class RetryTest(TestCase):
@@ -63,3 +83,184 @@ class RetryTest(TestCase):
         )
         self.assertEquals(self.num_attempts, 2)
         self.assertEquals(ret, 42)
+
+
+class CachedPreviewTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        self.fs.create_file("/mnt/usb_share/foobar.ctb", contents=ctb_file_contents)
+        self.path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+
+    def test_preview_is_rendered_once(self) -> None:
+        cache_path = get_cached_preview_path(self.path)
+        with open(cache_path, "rb") as file:
+            self.assertEqual(
+                hashlib.md5(file.read()).hexdigest(),
+                "ca98c806d42898ba70626e556f714928",
+            )
+
+        with patch("mariner.server.utils.get_file_format") as get_file_format_mock:
+            self.assertEqual(get_cached_preview_path(self.path), cache_path)
+        get_file_format_mock.assert_not_called()
+
+    def test_invalidating_the_preview(self) -> None:
+        cache_path = get_cached_preview_path(self.path)
+        invalidate_cached_file(self.path)
+        self.assertFalse(os.path.exists(cache_path))
+
+
+class CachedLayerAreaTableTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        self.fs.create_dir(config.get_cache_directory())
+        self.fs.create_file("/mnt/usb_share/foobar.ctb", contents=ctb_file_contents)
+        self.path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+
+    def test_layer_areas_are_only_returned_once_cached(self) -> None:
+        self.assertIsNone(get_cached_layer_area_table(self.path))
+        layer_area_table = read_cached_layer_area_table(self.path)
+        self.assertEqual(get_cached_layer_area_table(self.path), layer_area_table)
+
+
+class CachedIntegrityReportTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        self.fs.create_dir(config.get_cache_directory())
+        self.fs.create_file("/mnt/usb_share/foobar.ctb", contents=ctb_file_contents)
+        self.path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+
+    def test_layer_pixels_are_only_reported_once_checked(self) -> None:
+        integrity_report = get_cached_integrity_report(self.path)
+        self.assertTrue(integrity_report.is_valid())
+        self.assertFalse(integrity_report.checked_layer_pixels)
+
+        read_cached_integrity_report(self.path, check_layer_pixels=True)
+        integrity_report = get_cached_integrity_report(self.path)
+        self.assertTrue(integrity_report.is_valid())
+        self.assertTrue(integrity_report.checked_layer_pixels)
+
+        invalidate_cached_content(
+            compute_sampled_hash(self.path, os.stat(self.path).st_size)
+        )
+        self.assertFalse(get_cached_integrity_report(self.path).checked_layer_pixels)
+
+
+class ShareCachedFileTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        self.fs.create_dir(config.get_cache_directory())
+        self.fs.create_file("/mnt/usb_share/a.ctb", contents=ctb_file_contents)
+        self.fs.create_file("/mnt/usb_share/folder/b.ctb", contents=ctb_file_contents)
+        self.path = pathlib.Path("/mnt/usb_share/a.ctb")
+        self.copy_path = pathlib.Path("/mnt/usb_share/folder/b.ctb")
+
+    def test_copies_share_cached_entries(self) -> None:
+        read_cached_sliced_model_file_summary(self.path)
+        read_cached_integrity_report(self.path, check_layer_pixels=True)
+
+        with patch("mariner.server.utils.get_file_format") as get_file_format_mock:
+            self.assertEqual(
+                read_cached_sliced_model_file_summary(self.copy_path).filename,
+                "b.ctb",
+            )
+            self.assertTrue(
+                get_cached_integrity_report(self.copy_path).checked_layer_pixels
+            )
+        get_file_format_mock.assert_not_called()
+
+    def test_changed_copies_do_not_share_cached_entries(self) -> None:
+        read_cached_sliced_model_file_summary(self.path)
+        with open(self.copy_path, "ab") as file:
+            file.write(b"\0")
+        with patch(
+            "mariner.server.utils.get_file_format", wraps=get_file_format
+        ) as get_file_format_mock:
+            read_cached_sliced_model_file_summary(self.copy_path)
+        get_file_format_mock.assert_called_once_with(self.copy_path)
+
+    def test_copies_are_not_read_again(self) -> None:
+        read_cached_sliced_model_file_summary(self.path)
+        cache_path = get_cached_preview_path(self.path)
+        share_cached_file(self.path, self.copy_path)
+
+        with patch("mariner.server.utils.get_file_format") as get_file_format_mock:
+            self.assertEqual(
+                read_cached_sliced_model_file_summary(self.copy_path).filename,
+                "b.ctb",
+            )
+            copy_cache_path = get_cached_preview_path(self.copy_path)
+        get_file_format_mock.assert_not_called()
+        # both copies point to the same image
+        self.assertNotEqual(copy_cache_path, cache_path)
+        self.assertTrue(os.path.samefile(copy_cache_path, cache_path))
+
+        # the cache entries of the original are still there
+        invalidate_cached_file(self.copy_path)
+        self.assertTrue(os.path.exists(cache_path))
+        self.assertEqual(
+            read_cached_sliced_model_file_summary(self.path).filename, "a.ctb"
+        )
+
+
+class RelinkCachedFileTest(FakeFilesystemTestCase):
+    def setUp(self) -> None:
+        path = (
+            pathlib.Path(__file__).parent.parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with open(path, "rb") as file:
+            ctb_file_contents = file.read()
+        self.setUpPyfakefs()
+        self.fs.create_dir(config.get_cache_directory())
+        self.fs.create_file("/mnt/usb_share/foobar.ctb", contents=ctb_file_contents)
+        self.path = pathlib.Path("/mnt/usb_share/foobar.ctb")
+        self.new_path = pathlib.Path("/mnt/usb_share/folder/stairs.ctb")
+
+    def test_moved_files_are_not_read_again(self) -> None:
+        read_cached_sliced_model_file_summary(self.path)
+        get_cached_preview_path(self.path)
+        self.fs.create_dir("/mnt/usb_share/folder")
+        os.rename(self.path, self.new_path)
+        relink_cached_file(self.path, self.new_path)
+
+        with patch("mariner.server.utils.get_file_format") as get_file_format_mock:
+            self.assertEqual(
+                read_cached_sliced_model_file_summary(self.new_path).filename,
+                "stairs.ctb",
+            )
+            get_cached_preview_path(self.new_path)
+        get_file_format_mock.assert_not_called()
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+
+import png
+
+from mariner import config
+from mariner.exceptions import UnsupportedFileFormat
+from mariner.server.utils import get_cached_thumbnail_path, write_file_atomically
+
+
+THUMBNAIL_WIDTH: int = 128
+THUMBNAIL_HEIGHT: int = 80
+COLUMN_COUNT: int = 8
+
+# bump this whenever the layout of the sheets changes, so old ones aren't reused
+_SHEET_VERSION: int = 2
+
+
+@dataclass(frozen=True)
+class ThumbnailPosition:
+    filename: Path
+    x: int
+    y: int
+
+
+@dataclass(frozen=True)
+class ThumbnailSheet:
+    fingerprint: str
+    width: int
+    height: int
+    thumbnails: Sequence[ThumbnailPosition]
+
+
+def get_thumbnail_sheet_path(fingerprint: str) -> Path:
+    directory = Path(config.get_cache_directory()) / "thumbnail_sheets"
+    return directory / f"{fingerprint}.png"
+
+
+def _get_latest_sheet_path(key: str) -> Path:
+    directory = Path(config.get_cache_directory()) / "thumbnail_sheets"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return directory / f"{digest}.latest"
+
+
+def _get_fingerprint(filenames: Sequence[Path]) -> str:
+    # the fingerprint covers the size and modification time of every file, so a
+    # sheet is rebuilt as soon as any file in it changes
+    fingerprint = hashlib.sha1(
+        f"{_SHEET_VERSION}:{THUMBNAIL_WIDTH}x{THUMBNAIL_HEIGHT}\n".encode("utf-8")
+    )
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            line = f"{filename}:{stat.st_mtime_ns}:{stat.st_size}\n"
+        except FileNotFoundError:
+            line = f"{filename}:missing\n"
+        fingerprint.update(line.encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def _read_scaled_thumbnail(filename: Path) -> Optional[List[bytes]]:
+    try:
+        # the thumbnail is decoded from its cached PNG, which the file listings
+        # have usually rendered already, rather than from the sliced file itself
+        thumbnail_path = get_cached_thumbnail_path(filename)
+        (_, _, image_rows, _) = png.Reader(filename=str(thumbnail_path)).asRGB8()
+        rows = [bytes(row) for row in image_rows]
+    except (UnsupportedFileFormat, OSError):
+        return None
+    if not rows:
+        return None
+
+    # nearest neighbour scaling is good enough for thumbnails this small
+    source_width = len(rows[0]) // 3
+    column_indices = [
+        3 * (x * source_width // THUMBNAIL_WIDTH) + channel
+        for x in range(THUMBNAIL_WIDTH)
+        for channel in range(3)
+    ]
+    return [
+        bytes(rows[y * len(rows) // THUMBNAIL_HEIGHT][i] for i in column_indices)
+        for y in range(THUMBNAIL_HEIGHT)
+    ]
+
+
+def _iter_sheet_rows(
+    filenames: Sequence[Path], positions: List[ThumbnailPosition]
+) -> Iterator[bytes]:
+    # thumbnails are decoded one row of the grid at a time, so memory usage is
+    # bounded by the width of the sheet rather than by the number of files
+    blank_thumbnail = [bytes(3 * THUMBNAIL_WIDTH)] * THUMBNAIL_HEIGHT
+    for grid_row_start in range(0, len(filenames), COLUMN_COUNT):
+        grid_row_end = grid_row_start + COLUMN_COUNT
+        grid_row = filenames[grid_row_start:grid_row_end]
+        thumbnails = []
+        for (column, filename) in enumerate(grid_row):
+            thumbnail = _read_scaled_thumbnail(filename)
+            if thumbnail is None:
+                thumbnail = blank_thumbnail
+            else:
+                positions.append(
+                    ThumbnailPosition(
+                        filename=filename,
+                        x=column * THUMBNAIL_WIDTH,
+                        y=grid_row_start // COLUMN_COUNT * THUMBNAIL_HEIGHT,
+                    )
+                )
+            thumbnails.append(thumbnail)
+        padding = bytes(3 * THUMBNAIL_WIDTH * (COLUMN_COUNT - len(grid_row)))
+        for y in range(THUMBNAIL_HEIGHT):
+            yield b"".join(thumbnail[y] for thumbnail in thumbnails) + padding
+
+
+def _get_sheet_size(filenames: Sequence[Path]) -> Tuple[int, int]:
+    row_count = max(1, (len(filenames) + COLUMN_COUNT - 1) // COLUMN_COUNT)
+    return (COLUMN_COUNT * THUMBNAIL_WIDTH, row_count * THUMBNAIL_HEIGHT)
+
+
+def _remove_previous_sheet(key: str, fingerprint: str) -> None:
+    latest_path = _get_latest_sheet_path(key)
+    try:
+        with open(latest_path, "r") as file:
+            previous_fingerprint = file.read().strip()
+    except FileNotFoundError:
+        previous_fingerprint = None
+    if previous_fingerprint is not None and previous_fingerprint != fingerprint:
+        previous_sheet_path = get_thumbnail_sheet_path(previous_fingerprint)
+        for path in [previous_sheet_path, previous_sheet_path.with_suffix(".json")]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    write_file_atomically(
+        latest_path, lambda file: file.write(fingerprint.encode("utf-8"))
+    )
+
+
+def get_cached_thumbnail_sheet(filenames: Sequence[Path], key: str) -> ThumbnailSheet:
+    """
+    Returns a single PNG sprite sheet with a fixed-size thumbnail for each of the
+    given files, along with the position of each thumbnail within the sheet.
+    Files whose thumbnail cannot be read are left out of the index.
+
+    The key identifies what the sheet is for, such as the directory the files
+    are in. Only the latest sheet of each key is kept, so the previous one is
+    deleted once a new one is written.
+    """
+    fingerprint = _get_fingerprint(filenames)
+    sheet_path = get_thumbnail_sheet_path(fingerprint)
+    index_path = sheet_path.with_suffix(".json")
+    (width, height) = _get_sheet_size(filenames)
+
+    if os.path.exists(index_path) and os.path.exists(sheet_path):
+        with open(index_path, "r") as file:
+            index = json.load(file)
+        return ThumbnailSheet(
+            fingerprint=fingerprint,
+            width=width,
+            height=height,
+            thumbnails=[
+                ThumbnailPosition(
+                    filename=Path(entry["filename"]), x=entry["x"], y=entry["y"]
+                )
+                for entry in index
+            ],
+        )
+
+    positions: List[ThumbnailPosition] = []
+
+    def write_sheet(file: BinaryIO) -> None:
+        rows = _iter_sheet_rows(filenames, positions)
+        if not filenames:
+            rows = iter([bytes(3 * width)] * height)
+        png.Writer(width, height, greyscale=False, bitdepth=8).write(file, rows)
+
+    write_file_atomically(sheet_path, write_sheet)
+    index = [
+        {"filename": str(position.filename), "x": position.x, "y": position.y}
+        for position in positions
+    ]
+    write_file_atomically(
+        index_path, lambda file: file.write(json.dumps(index).encode("utf-8"))
+    )
+    _remove_previous_sheet(key, fingerprint)
+
+    return ThumbnailSheet(
+        fingerprint=fingerprint, width=width, height=height, thumbnails=positions
+    )
@@ -1,37 +1,273 @@
-import io
+import dataclasses
+import functools
+import hashlib
+import inspect
 import os
+import tempfile
 import time
-from typing import Callable, Type, TypeVar
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Optional, Type, TypeVar, cast
 
 import png
 from flask_caching import Cache
 
 from mariner import config
-from mariner.file_formats import SlicedModelFile
+from mariner.exceptions import UnsupportedLayerEncoding
+from mariner.file_formats import (
+    IntegrityReport,
+    LayerAreaTable,
+    PrintTimeline,
+    SlicedModelFile,
+    SlicedModelFileSummary,
+)
 from mariner.file_formats.utils import get_file_format
 from mariner.server.app import app
+from mariner.server.content_hash import compute_sampled_hash
 
 
 cache = Cache(app)
 
 
-@cache.memoize(timeout=0)
+def _get_content_key(read_cached: Callable, fingerprint: str, *args: Any) -> str:
+    return f"{read_cached.__module__}.{read_cached.__name__}:{fingerprint}:{args!r}"
+
+
+def _get_file_content_key(
+    read_cached: Callable, filename: Path, *args: Any
+) -> Optional[str]:
+    # entries are keyed by the same sampled fingerprint the file index keeps for
+    # every file, rather than by path, so that identical copies of a file share a
+    # single entry. it's worked out here rather than looked up in the index,
+    # which is itself built from these entries, and it only takes three reads.
+    try:
+        fingerprint = compute_sampled_hash(filename, os.stat(filename).st_size)
+    except OSError:
+        return None
+    return _get_content_key(read_cached, fingerprint, *args)
+
+
+TCached = TypeVar("TCached", bound=Callable[..., Any])
+
+
+def _memoize_by_content(read: TCached) -> TCached:
+    signature = inspect.signature(read)
+
+    @functools.wraps(read)
+    def read_cached(*args: Any, **kwargs: Any) -> Any:
+        bound_arguments = signature.bind(*args, **kwargs)
+        bound_arguments.apply_defaults()
+        (filename, *other_args) = bound_arguments.args
+        key = _get_file_content_key(read_cached, Path(filename), *other_args)
+        if key is None:
+            # the file is gone, which reading it is going to report
+            return read(filename, *other_args)
+        value = cache.get(key)
+        if value is None:
+            value = read(filename, *other_args)
+            cache.set(key, value, timeout=0)
+        # the filename is part of the metadata of sliced model files, and the
+        # entry may have been read from a copy with a different name
+        if isinstance(value, SlicedModelFileSummary):
+            value = dataclasses.replace(value, filename=Path(filename).name)
+        return value
+
+    return cast(TCached, read_cached)
+
+
+@_memoize_by_content
 def read_cached_sliced_model_file(filename: str) -> SlicedModelFile:
     assert os.path.isabs(filename)
     file_format = get_file_format(filename)
     return file_format.read(config.get_files_directory() / filename)
 
 
-@cache.memoize(timeout=0)
-def read_cached_preview(filename: str) -> bytes:
+@_memoize_by_content
+def read_cached_sliced_model_file_summary(filename: str) -> SlicedModelFileSummary:
+    assert os.path.isabs(filename)
+    file_format = get_file_format(filename)
+    return file_format.read_summary(config.get_files_directory() / filename)
+
+
+@_memoize_by_content
+def read_cached_layer_area_table(filename: str) -> Optional[LayerAreaTable]:
     assert os.path.isabs(filename)
-    bytes = io.BytesIO()
     file_format = get_file_format(filename)
-    preview_image: png.Image = file_format.read_preview(
-        config.get_files_directory() / filename
+    try:
+        return file_format.read_layer_area_table(
+            config.get_files_directory() / filename
+        )
+    except UnsupportedLayerEncoding:
+        return None
+
+
+@_memoize_by_content
+def read_cached_print_timeline(filename: str) -> PrintTimeline:
+    assert os.path.isabs(filename)
+    file_format = get_file_format(filename)
+    return file_format.simulate_print(config.get_files_directory() / filename)
+
+
+@_memoize_by_content
+def read_cached_integrity_report(
+    filename: str, check_layer_pixels: bool = False
+) -> IntegrityReport:
+    assert os.path.isabs(filename)
+    file_format = get_file_format(filename)
+    return file_format.validate(
+        config.get_files_directory() / filename, check_layer_pixels
+    )
+
+
+def _get_cached(read_cached: Callable, filename: Path, *args: Any) -> Any:
+    key = _get_file_content_key(read_cached, filename, *args)
+    return None if key is None else cache.get(key)
+
+
+def get_cached_integrity_report(filename: Path) -> IntegrityReport:
+    """
+    Returns the report of the cache warmer, which counts the pixels of every
+    layer, if it's already cached. Otherwise we only check that everything lies
+    within the file, since counting the pixels takes too long to do while
+    serving a request.
+    """
+    integrity_report = _get_cached(read_cached_integrity_report, filename, True)
+    if integrity_report is not None:
+        return integrity_report
+    return read_cached_integrity_report(filename)
+
+
+def get_cached_layer_area_table(filename: Path) -> Optional[LayerAreaTable]:
+    """
+    Returns the layer area table of a file only if it's already cached. Working
+    it out takes about a second for a typical file, which is too slow to do
+    while serving a request, so it's left to the cache warmer.
+    """
+    return _get_cached(read_cached_layer_area_table, filename)
+
+
+def get_cached_print_timeline(filename: Path) -> Optional[PrintTimeline]:
+    """
+    Returns the simulated print timeline of a file only if it's already cached.
+    Version 3 .ctb files have the moves of every layer stored next to its image,
+    so simulating them reads from all over the file, which is left to the cache
+    warmer as well.
+    """
+    return _get_cached(read_cached_print_timeline, filename)
+
+
+def write_file_atomically(path: Path, write: Callable[[BinaryIO], None]) -> None:
+    # the file is written to a temporary file first, so that concurrent readers
+    # never see a partially written file
+    os.makedirs(path.parent, exist_ok=True)
+    (fd, temporary_path) = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def _get_cache_file_path(directory: str, filename: Path, extension: str) -> Path:
+    key = hashlib.sha1(str(filename).encode("utf-8")).hexdigest()
+    return Path(config.get_cache_directory()) / directory / f"{key}{extension}"
+
+
+def _get_cached_image_path(
+    directory: str,
+    filename: Path,
+    read_image: Callable[[Type[SlicedModelFile], Path], png.Image],
+) -> Path:
+    assert os.path.isabs(filename)
+    cache_path = _get_cache_file_path(directory, filename, ".png")
+    if os.path.exists(cache_path):
+        return cache_path
+
+    file_format = get_file_format(str(filename))
+    image = read_image(file_format, config.get_files_directory() / filename)
+    write_file_atomically(cache_path, image.write)
+    return cache_path
+
+
+def get_cached_preview_path(filename: Path) -> Path:
+    """
+    Returns the path to a PNG file with the preview of the given sliced model
+    file, rendering it first if it isn't cached yet. The preview is streamed row
+    by row from the sliced file into the cache file, so it is never held in
+    memory as a whole.
+    """
+    return _get_cached_image_path(
+        "previews",
+        filename,
+        lambda file_format, path: file_format.read_preview(path),
+    )
+
+
+def get_cached_thumbnail_path(filename: Path) -> Path:
+    return _get_cached_image_path(
+        "thumbnails",
+        filename,
+        lambda file_format, path: file_format.read_thumbnail(path),
     )
-    preview_image.write(bytes)
-    return bytes.getvalue()
+
+
+def invalidate_cached_content(fingerprint: str) -> None:
+    """
+    Drops the entries shared by every file with the given fingerprint. The file
+    index calls this once no file with those contents is left.
+    """
+    for (read_cached, args) in [
+        (read_cached_sliced_model_file, ()),
+        (read_cached_sliced_model_file_summary, ()),
+        (read_cached_layer_area_table, ()),
+        (read_cached_integrity_report, (False,)),
+        (read_cached_integrity_report, (True,)),
+        (read_cached_print_timeline, ()),
+    ]:
+        cache.delete(_get_content_key(read_cached, fingerprint, *args))
+
+
+def invalidate_cached_file(filename: Path) -> None:
+    # the other entries are keyed by the contents of the file, so a file that
+    # changed simply doesn't match them anymore
+    for directory in ["previews", "thumbnails"]:
+        try:
+            os.remove(_get_cache_file_path(directory, filename, ".png"))
+        except FileNotFoundError:
+            pass
+
+
+def _copy_cached_file(filename: Path, new_filename: Path, move: bool) -> None:
+    # the other entries are keyed by the contents of the file, which copies and
+    # moved files share already
+    for directory in ["previews", "thumbnails"]:
+        cache_path = _get_cache_file_path(directory, filename, ".png")
+        new_cache_path = _get_cache_file_path(directory, new_filename, ".png")
+        try:
+            if move:
+                os.replace(cache_path, new_cache_path)
+            else:
+                # copies of a file share a single copy of its images
+                os.link(cache_path, new_cache_path)
+        except (FileNotFoundError, FileExistsError):
+            pass
+
+
+def relink_cached_file(old_filename: Path, new_filename: Path) -> None:
+    """
+    Moves whatever is cached for a file that was moved or renamed over to its new
+    path, so that it doesn't have to be read again.
+    """
+    _copy_cached_file(old_filename, new_filename, move=True)
+
+
+def share_cached_file(filename: Path, copy_filename: Path) -> None:
+    """
+    Gives an identical copy of a file the images cached for the file. Everything
+    else is keyed by the contents of the file, so the copy already shares it.
+    """
+    _copy_cached_file(filename, copy_filename, move=False)
 
 
 TReturn = TypeVar("TReturn")
@@ -1,17 +1,28 @@
 import pathlib
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import call, patch, MagicMock
 
+from mariner.exceptions import UnsupportedFileFormat
 from mariner.server import CacheBootstrapper
 
 
 class CacheBootstrapperTest(TestCase):
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.read_cached_sliced_model_file_summary")
     @patch("mariner.server.read_cached_sliced_model_file")
-    @patch("mariner.server.read_cached_preview")
+    @patch("mariner.server.get_cached_thumbnail_path")
+    @patch("mariner.server.get_cached_preview_path")
+    @patch("mariner.server.read_cached_layer_area_table")
     def test_ctb_metadata_cache(
         self,
-        read_cached_preview_mock: MagicMock,
+        read_cached_layer_area_table_mock: MagicMock,
+        get_cached_preview_path_mock: MagicMock,
+        get_cached_thumbnail_path_mock: MagicMock,
         read_cached_sliced_model_file_mock: MagicMock,
+        read_cached_sliced_model_file_summary_mock: MagicMock,
+        get_file_index_mock: MagicMock,
     ) -> None:
         files_directory = (
             pathlib.Path(__file__).parent.parent.absolute() / "file_formats" / "tests"
@@ -20,6 +31,15 @@ class CacheBootstrapperTest(TestCase):
         with patch("mariner.config.get_files_directory", return_value=files_directory):
             CacheBootstrapper().run()
 
+        read_cached_sliced_model_file_summary_mock.assert_has_calls(
+            [
+                call(files_directory / "stairs.fdg"),
+                call(files_directory / "pyramid.cbddlp"),
+                call(files_directory / "stairs.ctb"),
+            ],
+            any_order=True,
+        )
+
         read_cached_sliced_model_file_mock.assert_has_calls(
             [
                 call(files_directory / "stairs.fdg"),
@@ -29,7 +49,7 @@ class CacheBootstrapperTest(TestCase):
             any_order=True,
         )
 
-        read_cached_preview_mock.assert_has_calls(
+        get_cached_preview_path_mock.assert_has_calls(
             [
                 call(files_directory / "stairs.fdg"),
                 call(files_directory / "pyramid.cbddlp"),
@@ -37,3 +57,61 @@ class CacheBootstrapperTest(TestCase):
             ],
             any_order=True,
         )
+
+        get_cached_thumbnail_path_mock.assert_has_calls(
+            [
+                call(files_directory / "stairs.fdg"),
+                call(files_directory / "pyramid.cbddlp"),
+                call(files_directory / "stairs.ctb"),
+            ],
+            any_order=True,
+        )
+
+        read_cached_layer_area_table_mock.assert_has_calls(
+            [
+                call(files_directory / "stairs.fdg"),
+                call(files_directory / "pyramid.cbddlp"),
+                call(files_directory / "stairs.ctb"),
+            ],
+            any_order=True,
+        )
+        get_file_index_mock.return_value.sync.assert_called_once_with()
+
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.read_cached_sliced_model_file_summary")
+    @patch("mariner.server.read_cached_sliced_model_file")
+    @patch("mariner.server.get_cached_thumbnail_path")
+    @patch("mariner.server.get_cached_preview_path")
+    @patch("mariner.server.read_cached_layer_area_table")
+    def test_broken_files_are_skipped(
+        self,
+        read_cached_layer_area_table_mock: MagicMock,
+        get_cached_preview_path_mock: MagicMock,
+        get_cached_thumbnail_path_mock: MagicMock,
+        read_cached_sliced_model_file_mock: MagicMock,
+        read_cached_sliced_model_file_summary_mock: MagicMock,
+        get_file_index_mock: MagicMock,
+    ) -> None:
+        ctb_path = (
+            pathlib.Path(__file__).parent.parent.absolute()
+            / "file_formats"
+            / "tests"
+            / "stairs.ctb"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            files_directory = pathlib.Path(directory)
+            shutil.copy(ctb_path, files_directory / "a.ctb")
+            shutil.copy(ctb_path, files_directory / "b.ctb")
+
+            def read_file(path: pathlib.Path) -> None:
+                if path.name == "a.ctb":
+                    raise UnsupportedFileFormat(path.name)
+
+            read_cached_sliced_model_file_mock.side_effect = read_file
+            with patch(
+                "mariner.config.get_files_directory", return_value=files_directory
+            ):
+                CacheBootstrapper().run()
+
+        get_cached_preview_path_mock.assert_called_once_with(files_directory / "b.ctb")
+        get_file_index_mock.return_value.sync.assert_called_once_with()
@@ -0,0 +1,178 @@
+import pathlib
+from unittest import TestCase
+from unittest.mock import call, patch, MagicMock
+
+from mariner.file_watcher import FileEvent, FileEventType
+from mariner.server import CacheWarmer
+
+
+class CacheWarmerTest(TestCase):
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.invalidate_cached_file")
+    @patch("mariner.server.read_cached_sliced_model_file_summary")
+    @patch("mariner.server.read_cached_sliced_model_file")
+    @patch("mariner.server.get_cached_thumbnail_path")
+    @patch("mariner.server.get_cached_preview_path")
+    @patch("mariner.server.read_cached_layer_area_table")
+    @patch("mariner.server.read_cached_print_timeline")
+    @patch("mariner.server.read_cached_integrity_report")
+    def test_handle_events(
+        self,
+        read_cached_integrity_report_mock: MagicMock,
+        read_cached_print_timeline_mock: MagicMock,
+        read_cached_layer_area_table_mock: MagicMock,
+        get_cached_preview_path_mock: MagicMock,
+        get_cached_thumbnail_path_mock: MagicMock,
+        read_cached_sliced_model_file_mock: MagicMock,
+        read_cached_sliced_model_file_summary_mock: MagicMock,
+        invalidate_cached_file_mock: MagicMock,
+        get_file_index_mock: MagicMock,
+    ) -> None:
+        directory = pathlib.Path("/mnt/usb_share")
+        get_file_index_mock.return_value.is_file_current.return_value = False
+        get_file_index_mock.return_value.find_duplicates.return_value = []
+        CacheWarmer().handle_events(
+            [
+                FileEvent(type=FileEventType.CHANGED, path=directory / "a.ctb"),
+                FileEvent(type=FileEventType.CHANGED, path=directory / "a.ctb"),
+                FileEvent(type=FileEventType.CHANGED, path=directory / "b.txt"),
+                FileEvent(type=FileEventType.DELETED, path=directory / "c.ctb"),
+                FileEvent(type=FileEventType.CHANGED, path=directory / "d.CTB"),
+            ]
+        )
+
+        invalidate_cached_file_mock.assert_has_calls(
+            [
+                call(directory / "a.ctb"),
+                call(directory / "c.ctb"),
+                call(directory / "d.CTB"),
+            ]
+        )
+        read_cached_sliced_model_file_summary_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        read_cached_sliced_model_file_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        get_cached_thumbnail_path_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        get_cached_preview_path_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        read_cached_layer_area_table_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        read_cached_print_timeline_mock.assert_has_calls(
+            [call(directory / "a.ctb"), call(directory / "d.CTB")]
+        )
+        read_cached_integrity_report_mock.assert_has_calls(
+            [
+                call(directory / "a.ctb", check_layer_pixels=True),
+                call(directory / "d.CTB", check_layer_pixels=True),
+            ]
+        )
+        self.assertEqual(get_cached_preview_path_mock.call_count, 2)
+        get_file_index_mock.return_value.update_file.assert_has_calls(
+            [
+                call(directory / "a.ctb"),
+                call(directory / "b.txt"),
+                call(directory / "d.CTB"),
+            ]
+        )
+        get_file_index_mock.return_value.remove_path.assert_called_once_with(
+            directory / "c.ctb"
+        )
+
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.invalidate_cached_file")
+    @patch("mariner.server.read_cached_sliced_model_file_summary")
+    @patch("mariner.server.read_cached_sliced_model_file")
+    @patch("mariner.server.get_cached_thumbnail_path")
+    @patch("mariner.server.get_cached_preview_path")
+    @patch("mariner.server.read_cached_layer_area_table")
+    @patch("mariner.server.read_cached_print_timeline")
+    @patch("mariner.server.read_cached_integrity_report")
+    def test_handle_events_with_broken_file(
+        self,
+        read_cached_integrity_report_mock: MagicMock,
+        read_cached_print_timeline_mock: MagicMock,
+        read_cached_layer_area_table_mock: MagicMock,
+        get_cached_preview_path_mock: MagicMock,
+        get_cached_thumbnail_path_mock: MagicMock,
+        read_cached_sliced_model_file_mock: MagicMock,
+        read_cached_sliced_model_file_summary_mock: MagicMock,
+        invalidate_cached_file_mock: MagicMock,
+        get_file_index_mock: MagicMock,
+    ) -> None:
+        directory = pathlib.Path("/mnt/usb_share")
+        get_file_index_mock.return_value.find_duplicates.return_value = []
+        read_cached_sliced_model_file_mock.side_effect = [Exception(), None]
+        CacheWarmer().handle_events(
+            [
+                FileEvent(type=FileEventType.CHANGED, path=directory / "a.ctb"),
+                FileEvent(type=FileEventType.CHANGED, path=directory / "b.ctb"),
+            ]
+        )
+        get_cached_preview_path_mock.assert_called_once_with(directory / "b.ctb")
+
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.invalidate_cached_file")
+    @patch("mariner.server.share_cached_file")
+    @patch("mariner.server.read_cached_sliced_model_file_summary")
+    @patch("mariner.server.read_cached_sliced_model_file")
+    @patch("mariner.server.get_cached_thumbnail_path")
+    @patch("mariner.server.get_cached_preview_path")
+    @patch("mariner.server.read_cached_layer_area_table")
+    @patch("mariner.server.read_cached_print_timeline")
+    @patch("mariner.server.read_cached_integrity_report")
+    def test_handle_events_with_duplicate_file(
+        self,
+        read_cached_integrity_report_mock: MagicMock,
+        read_cached_print_timeline_mock: MagicMock,
+        read_cached_layer_area_table_mock: MagicMock,
+        get_cached_preview_path_mock: MagicMock,
+        get_cached_thumbnail_path_mock: MagicMock,
+        read_cached_sliced_model_file_mock: MagicMock,
+        read_cached_sliced_model_file_summary_mock: MagicMock,
+        share_cached_file_mock: MagicMock,
+        invalidate_cached_file_mock: MagicMock,
+        get_file_index_mock: MagicMock,
+    ) -> None:
+        directory = pathlib.Path("/mnt/usb_share")
+        get_file_index_mock.return_value.is_file_current.return_value = True
+        get_file_index_mock.return_value.find_duplicates.return_value = [
+            directory / "a.ctb",
+            directory / "b.ctb",
+        ]
+        CacheWarmer().handle_events(
+            [FileEvent(type=FileEventType.CHANGED, path=directory / "c.ctb")]
+        )
+        invalidate_cached_file_mock.assert_not_called()
+        # the copy gets the cache entries of the first file it's identical to
+        share_cached_file_mock.assert_called_once_with(
+            directory / "a.ctb", directory / "c.ctb"
+        )
+        read_cached_sliced_model_file_mock.assert_called_once_with(directory / "c.ctb")
+
+    @patch("mariner.server.get_file_index")
+    @patch("mariner.server.invalidate_cached_file")
+    def test_handle_events_with_deleted_directory(
+        self,
+        invalidate_cached_file_mock: MagicMock,
+        get_file_index_mock: MagicMock,
+    ) -> None:
+        directory = pathlib.Path("/mnt/usb_share")
+        get_file_index_mock.return_value.is_file_current.return_value = False
+        get_file_index_mock.return_value.remove_path.return_value = [
+            directory / "foo" / "a.ctb",
+            directory / "foo" / "notes.txt",
+        ]
+        CacheWarmer().handle_events(
+            [FileEvent(type=FileEventType.DELETED, path=directory / "foo")]
+        )
+        get_file_index_mock.return_value.remove_path.assert_called_once_with(
+            directory / "foo"
+        )
+        # only sliced files have anything cached for them
+        invalidate_cached_file_mock.assert_called_once_with(directory / "foo" / "a.ctb")
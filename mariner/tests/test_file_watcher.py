@@ -0,0 +1,169 @@
+import os
+import pathlib
+import tempfile
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from pyexpect import expect
+
+from mariner.file_watcher import (
+    FileEvent,
+    FileEventType,
+    InotifyFileWatcher,
+    PollingFileWatcher,
+    create_file_watcher,
+)
+
+
+def _inotify_available() -> bool:
+    try:
+        InotifyFileWatcher(pathlib.Path(tempfile.gettempdir())).close()
+    except OSError:
+        return False
+    return True
+
+
+class PollingFileWatcherTest(TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self.temp_directory.name)
+        self.sleep_patcher = patch("mariner.file_watcher.time.sleep")
+        self.sleep_patcher.start()
+
+    def tearDown(self) -> None:
+        self.sleep_patcher.stop()
+        self.temp_directory.cleanup()
+
+    def test_existing_files_are_not_reported(self) -> None:
+        (self.directory / "a.ctb").write_bytes(b"abc")
+        watcher = PollingFileWatcher(self.directory)
+        expect(watcher.read_events(timeout_secs=1.0)).to_equal([])
+
+    def test_new_and_deleted_files(self) -> None:
+        (self.directory / "a.ctb").write_bytes(b"abc")
+        watcher = PollingFileWatcher(self.directory)
+
+        os.makedirs(self.directory / "subdir")
+        (self.directory / "subdir" / "b.ctb").write_bytes(b"abc")
+        os.remove(self.directory / "a.ctb")
+
+        expect(watcher.read_events(timeout_secs=1.0)).to_equal(
+            [
+                FileEvent(type=FileEventType.DELETED, path=self.directory / "a.ctb"),
+                FileEvent(
+                    type=FileEventType.CHANGED,
+                    path=self.directory / "subdir" / "b.ctb",
+                ),
+            ]
+        )
+        expect(watcher.read_events(timeout_secs=1.0)).to_equal([])
+
+    def test_modified_file(self) -> None:
+        (self.directory / "a.ctb").write_bytes(b"abc")
+        watcher = PollingFileWatcher(self.directory)
+        (self.directory / "a.ctb").write_bytes(b"abcdef")
+        expect(watcher.read_events(timeout_secs=1.0)).to_equal(
+            [FileEvent(type=FileEventType.CHANGED, path=self.directory / "a.ctb")]
+        )
+
+
+@skipUnless(_inotify_available(), "inotify is not available")
+class InotifyFileWatcherTest(TestCase):
+    def setUp(self) -> None:
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.directory = pathlib.Path(self.temp_directory.name)
+        self.watcher = InotifyFileWatcher(self.directory)
+
+    def tearDown(self) -> None:
+        self.watcher.close()
+        self.temp_directory.cleanup()
+
+    def test_no_events(self) -> None:
+        expect(self.watcher.read_events(timeout_secs=0.0)).to_equal([])
+
+    def test_new_file(self) -> None:
+        (self.directory / "a.ctb").write_bytes(b"abc")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+            [FileEvent(type=FileEventType.CHANGED, path=self.directory / "a.ctb")]
+        )
+
+    def test_rename_and_delete(self) -> None:
+        (self.directory / "a.ctb").write_bytes(b"abc")
+        self.watcher.read_events(timeout_secs=1.0)
+
+        os.rename(self.directory / "a.ctb", self.directory / "b.ctb")
+        os.remove(self.directory / "b.ctb")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+            [
+                FileEvent(type=FileEventType.DELETED, path=self.directory / "a.ctb"),
+                FileEvent(type=FileEventType.CHANGED, path=self.directory / "b.ctb"),
+                FileEvent(type=FileEventType.DELETED, path=self.directory / "b.ctb"),
+            ]
+        )
+
+    def test_new_subdirectory(self) -> None:
+        os.makedirs(self.directory / "subdir")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal([])
+
+        (self.directory / "subdir" / "a.ctb").write_bytes(b"abc")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+            [
+                FileEvent(
+                    type=FileEventType.CHANGED,
+                    path=self.directory / "subdir" / "a.ctb",
+                )
+            ]
+        )
+
+    def test_moved_subdirectory(self) -> None:
+        os.makedirs(self.directory / "subdir")
+        (self.directory / "subdir" / "a.ctb").write_bytes(b"abc")
+        self.watcher.read_events(timeout_secs=1.0)
+
+        os.rename(self.directory / "subdir", self.directory / "renamed")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+            [
+                FileEvent(type=FileEventType.DELETED, path=self.directory / "subdir"),
+                FileEvent(
+                    type=FileEventType.CHANGED,
+                    path=self.directory / "renamed" / "a.ctb",
+                ),
+            ]
+        )
+
+        # files written afterwards are reported under the new path
+        (self.directory / "renamed" / "b.ctb").write_bytes(b"abc")
+        expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+            [
+                FileEvent(
+                    type=FileEventType.CHANGED,
+                    path=self.directory / "renamed" / "b.ctb",
+                )
+            ]
+        )
+
+    def test_subdirectory_moved_away(self) -> None:
+        os.makedirs(self.directory / "subdir")
+        (self.directory / "subdir" / "a.ctb").write_bytes(b"abc")
+        self.watcher.read_events(timeout_secs=1.0)
+
+        with tempfile.TemporaryDirectory() as other_directory:
+            moved_directory = pathlib.Path(other_directory) / "subdir"
+            os.rename(self.directory / "subdir", moved_directory)
+            expect(self.watcher.read_events(timeout_secs=1.0)).to_equal(
+                [FileEvent(type=FileEventType.DELETED, path=self.directory / "subdir")]
+            )
+
+            # it isn't watched anymore once it's outside of the files directory
+            (moved_directory / "b.ctb").write_bytes(b"abc")
+            expect(self.watcher.read_events(timeout_secs=0.1)).to_equal([])
+
+
+class CreateFileWatcherTest(TestCase):
+    def test_falls_back_to_polling(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            with patch(
+                "mariner.file_watcher.InotifyFileWatcher", side_effect=OSError()
+            ):
+                watcher = create_file_watcher(pathlib.Path(directory))
+            expect(isinstance(watcher, PollingFileWatcher)).to_equal(True)
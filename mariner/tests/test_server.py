@@ -1,9 +1,15 @@
+import base64
 import hashlib
 import io
+import json
 import os
 import pathlib
+import zipfile
+from itertools import chain, repeat
+from typing import Any
 from unittest.mock import patch, ANY, Mock
 
+import png
 from freezegun import freeze_time
 from pyexpect import expect
 from pyfakefs.fake_filesystem_unittest import TestCase
@@ -11,13 +17,32 @@ from werkzeug.datastructures import FileStorage
 
 from mariner import config
 from mariner.exceptions import UnexpectedPrinterResponse
+from mariner.file_formats import PrintSettingsPatch
 from mariner.printer import (
     ChiTuPrinter,
     PrinterState,
     PrintStatus,
 )
+from mariner.server.api import _get_layer_being_printed
 from mariner.server.app import app
-from mariner.server.utils import read_cached_sliced_model_file
+from mariner.server.file_index import FileIndex
+from mariner.server.live_layer import (
+    SharedPoller,
+    render_blank_png,
+    render_layer_png,
+)
+from mariner.server.utils import (
+    get_cached_thumbnail_path,
+    read_cached_integrity_report,
+    read_cached_layer_area_table,
+    read_cached_print_timeline,
+    read_cached_sliced_model_file,
+    read_cached_sliced_model_file_summary,
+)
+
+
+def _encode_cursor(payload: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
 
 
 class MarinerServerTest(TestCase):
@@ -65,9 +90,63 @@ class MarinerServerTest(TestCase):
             side_effect=read_cached_sliced_model_file.__wrapped__,
         )
         self._read_ctb_file_patcher.start()
+        self._read_ctb_file_summary_patcher = patch(
+            "mariner.server.api.read_cached_sliced_model_file_summary",
+            side_effect=read_cached_sliced_model_file_summary.__wrapped__,
+        )
+        self._read_ctb_file_summary_patcher.start()
+        self._read_layer_area_table_patcher = patch(
+            "mariner.server.api.get_cached_layer_area_table",
+            side_effect=read_cached_layer_area_table.__wrapped__,
+        )
+        self._read_layer_area_table_patcher.start()
+        self._read_integrity_report_patcher = patch(
+            "mariner.server.api.read_cached_integrity_report",
+            side_effect=read_cached_integrity_report.__wrapped__,
+        )
+        self._read_integrity_report_patcher.start()
+        self._get_integrity_report_patcher = patch(
+            "mariner.server.api.get_cached_integrity_report",
+            side_effect=read_cached_integrity_report.__wrapped__,
+        )
+        self._get_integrity_report_patcher.start()
+        self._read_print_timeline_patcher = patch(
+            "mariner.server.api.get_cached_print_timeline",
+            side_effect=read_cached_print_timeline.__wrapped__,
+        )
+        self._read_print_timeline_patcher.start()
+        # sqlite can't open databases in the fake filesystem
+        self.file_index = FileIndex(":memory:")
+        self._file_index_patcher = patch(
+            "mariner.server.api.get_file_index", return_value=self.file_index
+        )
+        self._file_index_patcher.start()
+        # every test gets a live layer poller of its own, which doesn't wait
+        # between polls
+        self.live_layer_poller = SharedPoller(
+            _get_layer_being_printed,
+            0.0,
+            recoverable_errors=(UnexpectedPrinterResponse,),
+        )
+        self._live_layer_poller_patcher = patch(
+            "mariner.server.api._live_layer_poller", self.live_layer_poller
+        )
+        self._live_layer_poller_patcher.start()
 
     def tearDown(self) -> None:
+        # the poller must be done with the printer before the mock goes away
+        polling_thread = self.live_layer_poller._thread
+        if polling_thread is not None:
+            polling_thread.join()
+        self._live_layer_poller_patcher.stop()
         self.printer_patcher.stop()
+        self._file_index_patcher.stop()
+        self._read_ctb_file_patcher.stop()
+        self._read_ctb_file_summary_patcher.stop()
+        self._read_layer_area_table_patcher.stop()
+        self._read_integrity_report_patcher.stop()
+        self._get_integrity_report_patcher.stop()
+        self._read_print_timeline_patcher.stop()
 
     def test_print_status_while_printing(self) -> None:
         self.printer_mock.get_selected_file.return_value = "foobar.ctb"
@@ -85,7 +164,8 @@ class MarinerServerTest(TestCase):
                 "layer_count": 400,
                 "current_layer": 130,
                 "print_time_secs": 5621,
-                "time_left_secs": 3808,
+                "time_left_secs": 3661,
+                "resin_used_percent": 41.52,
             }
         )
 
@@ -105,7 +185,8 @@ class MarinerServerTest(TestCase):
                 "layer_count": 400,
                 "current_layer": 130,
                 "print_time_secs": 5621,
-                "time_left_secs": 3808,
+                "time_left_secs": 3661,
+                "resin_used_percent": 41.52,
             }
         )
 
@@ -126,9 +207,45 @@ class MarinerServerTest(TestCase):
                 "current_layer": 1,
                 "print_time_secs": 5621,
                 "time_left_secs": 5621,
+                "resin_used_percent": 0.0,
+            }
+        )
+
+    def test_print_status_before_layer_areas_are_cached(self) -> None:
+        self.printer_mock.get_selected_file.return_value = "foobar.ctb"
+        self.printer_mock.get_print_status.return_value = PrintStatus(
+            state=PrinterState.PRINTING,
+            current_byte=256537,
+            total_bytes=832745,
+        )
+        with patch(
+            "mariner.server.api.get_cached_layer_area_table", return_value=None
+        ):
+            response = self.client.get("/api/print_status")
+        expect(response.get_json()).to_equal(
+            {
+                "state": "PRINTING",
+                "selected_file": "foobar.ctb",
+                "progress": 32.25,
+                "layer_count": 400,
+                "current_layer": 130,
+                "print_time_secs": 5621,
+                "time_left_secs": 3661,
             }
         )
 
+    def test_print_status_before_print_timeline_is_cached(self) -> None:
+        self.printer_mock.get_selected_file.return_value = "foobar.ctb"
+        self.printer_mock.get_print_status.return_value = PrintStatus(
+            state=PrinterState.PRINTING,
+            current_byte=256537,
+            total_bytes=832745,
+        )
+        with patch("mariner.server.api.get_cached_print_timeline", return_value=None):
+            response = self.client.get("/api/print_status")
+        # the time left is prorated by progress instead
+        expect(response.get_json()["time_left_secs"]).to_equal(3808)
+
     def test_print_status_while_idle(self) -> None:
         self.printer_mock.get_selected_file.return_value = "foobar.ctb"
         self.printer_mock.get_print_status.return_value = PrintStatus(
@@ -145,6 +262,61 @@ class MarinerServerTest(TestCase):
             }
         )
 
+    def test_live_layer(self) -> None:
+        self.printer_mock.get_selected_file.return_value = "foobar.ctb"
+        last_status = PrintStatus(
+            state=PrinterState.PRINTING,
+            current_byte=258322,
+            total_bytes=832745,
+        )
+        self.printer_mock.get_print_status.side_effect = chain(
+            [
+                PrintStatus(
+                    state=PrinterState.PRINTING,
+                    current_byte=256537,
+                    total_bytes=832745,
+                ),
+                UnexpectedPrinterResponse("ok"),
+            ],
+            repeat(last_status),
+        )
+        response = self.client.get("/api/live_layer")
+        expect(response.content_type).to_equal(
+            "multipart/x-mixed-replace; boundary=frame"
+        )
+        frames = iter(response.response)
+        for layer in [129, 130]:
+            (headers, png_bytes) = next(frames).split(b"\r\n\r\n", 1)
+            expect(headers.split(b"\r\n")[:2]).to_equal(
+                [b"--frame", b"Content-Type: image/png"]
+            )
+            expect(png_bytes[:-2]).to_equal(
+                render_layer_png(pathlib.Path("/mnt/usb_share/foobar.ctb"), layer)
+            )
+        response.close()
+
+    @patch("mariner.server.api.LIVE_LAYER_KEEPALIVE_SECS", 0.01)
+    def test_live_layer_keepalive(self) -> None:
+        self.printer_mock.get_selected_file.return_value = "foobar.ctb"
+        self.printer_mock.get_print_status.return_value = PrintStatus(
+            state=PrinterState.IDLE
+        )
+        response = self.client.get("/api/live_layer")
+        frames = iter(response.response)
+        # nothing is being printed, so a blank frame is sent every so often
+        for _ in range(2):
+            (_, png_bytes) = next(frames).split(b"\r\n\r\n", 1)
+            expect(png_bytes[:-2]).to_equal(render_blank_png())
+        response.close()
+
+    @patch("mariner.server.api.LIVE_LAYER_MAX_STREAM_SECS", 0.0)
+    def test_live_layer_streams_end(self) -> None:
+        self.printer_mock.get_print_status.return_value = PrintStatus(
+            state=PrinterState.IDLE
+        )
+        response = self.client.get("/api/live_layer")
+        expect(list(response.response)).to_equal([])
+
     def test_list_files(self) -> None:
         self.fs.create_dir("/mnt/usb_share/subdir/")
         with freeze_time("2020-03-15"):
@@ -244,10 +416,155 @@ class MarinerServerTest(TestCase):
             }
         )
 
+    def test_list_files_with_pagination(self) -> None:
+        self.fs.create_dir("/mnt/usb_share/subdir/")
+        with freeze_time("2020-03-15"):
+            self.fs.create_file("/mnt/usb_share/a.ctb", contents=self.ctb_file_contents)
+        with freeze_time("2020-03-17"):
+            self.fs.create_file("/mnt/usb_share/b.ctb", contents=self.ctb_file_contents)
+
+        # nothing has been read yet, so everything is pending
+        response = self.client.get("/api/list_files?limit=3")
+        response_json = response.get_json()
+        expect(response_json["directories"]).to_equal([{"dirname": "subdir"}])
+        expect(
+            [(file["filename"], file.get("pending")) for file in response_json["files"]]
+        ).to_equal([("._foobar.ctb", True), ("foobar.ctb", True), ("b.ctb", True)])
+
+        self.file_index.wait_for_pending_reads()
+        response = self.client.get(
+            "/api/list_files?limit=3&cursor=" + response_json["next_cursor"]
+        )
+        expect(response.get_json()).to_equal(
+            {
+                "directories": [],
+                "files": [
+                    {
+                        "filename": "a.ctb",
+                        "path": "a.ctb",
+                        "print_time_secs": 5621,
+                        "can_be_printed": True,
+                    }
+                ],
+                "next_cursor": None,
+            }
+        )
+
+    def test_list_files_as_ndjson(self) -> None:
+        self.fs.create_dir("/mnt/usb_share/subdir/")
+        self.client.get("/api/list_files")
+
+        response = self.client.get("/api/list_files?format=ndjson&limit=1")
+        expect(response.mimetype).to_equal("application/x-ndjson")
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        expect(lines[:2]).to_equal(
+            [
+                {"type": "directory", "dirname": "subdir"},
+                {
+                    "type": "file",
+                    "filename": "._foobar.ctb",
+                    "path": "._foobar.ctb",
+                    "can_be_printed": False,
+                },
+            ]
+        )
+        expect(lines[2]["type"]).to_equal("end")
+
+        response = self.client.get(
+            "/api/list_files?format=ndjson&cursor=" + lines[2]["next_cursor"]
+        )
+        expect(response.data.decode("utf-8").splitlines()).to_equal(
+            [
+                json.dumps(
+                    {
+                        "type": "file",
+                        "filename": "foobar.ctb",
+                        "path": "foobar.ctb",
+                        "can_be_printed": True,
+                        "print_time_secs": 5621,
+                    }
+                ),
+                json.dumps({"type": "end", "next_cursor": None}),
+            ]
+        )
+
+    def test_list_files_with_invalid_cursor(self) -> None:
+        for cursor in [
+            "garbage",
+            _encode_cursor({"order": "list_files", "value": [1, 2], "key": "a"}),
+            _encode_cursor({"order": "list_files", "value": {}, "key": "a"}),
+            _encode_cursor({"order": "list_files", "value": "1", "key": "a"}),
+            _encode_cursor({"order": "list_files", "value": 2 ** 64, "key": "a"}),
+            _encode_cursor({"order": "mtime_ns", "value": 1, "key": "a"}),
+            _encode_cursor(["list_files", 1, "a"]),
+        ]:
+            response = self.client.get(f"/api/list_files?cursor={cursor}")
+            expect(response.status_code).to_equal(400)
+
     def test_list_files_from_invalid_directory(self) -> None:
         response = self.client.get("/api/list_files?path=../foo/")
         expect(response.status_code).to_equal(400)
 
+    def test_search_files(self) -> None:
+        self.fs.create_file("/mnt/usb_share/foo/a.ctb", contents=self.ctb_file_contents)
+        self.file_index.sync()
+
+        response = self.client.get(
+            "/api/files/search?printer_name=ELEGOO MARS Pro&resolution=1440x2560"
+            + "&min_layer_height_mm=0.05&max_print_time_secs=6000"
+            + "&sort_by=path&order=asc&limit=1"
+        )
+        expect(response.status_code).to_equal(200)
+        response_json = response.get_json()
+        expect(response_json["files"]).to_equal(
+            [
+                {
+                    "filename": "a.ctb",
+                    "path": "foo/a.ctb",
+                    "mtime_ns": self.file_index.get_file(
+                        config.get_files_directory() / "foo/a.ctb"
+                    ).mtime_ns,
+                    "size": len(self.ctb_file_contents),
+                    "print_time_secs": 5621,
+                    "printer_name": "ELEGOO MARS Pro",
+                    "resolution": [1440, 2560],
+                    "layer_height_mm": 0.05,
+                    "layer_count": 400,
+                    "height_mm": 20.0,
+                }
+            ]
+        )
+
+        response = self.client.get(
+            "/api/files/search?sort_by=path&order=asc&limit=1&cursor="
+            + response_json["next_cursor"]
+        )
+        expect([file["path"] for file in response.get_json()["files"]]).to_equal(
+            ["foobar.ctb"]
+        )
+        expect(response.get_json()["next_cursor"]).to_equal(None)
+
+        response = self.client.get("/api/files/search?name=nothing")
+        expect(response.get_json()).to_equal({"files": [], "next_cursor": None})
+
+    def test_search_files_with_invalid_arguments(self) -> None:
+        for query_string in [
+            "sort_by=password",
+            "order=up",
+            "resolution=1440",
+            "limit=0",
+            "min_print_time_secs=1h",
+            "max_layer_height_mm=nan",
+            "cursor=garbage",
+            "cursor=" + _encode_cursor({"order": "mtime_ns", "value": [1], "key": "a"}),
+            "sort_by=path&cursor="
+            + _encode_cursor({"order": "path", "value": {"a": 1}, "key": "a"}),
+            "sort_by=height_mm&cursor="
+            + _encode_cursor({"order": "height_mm", "value": "1", "key": "a"}),
+        ]:
+            response = self.client.get(f"/api/files/search?{query_string}")
+            expect(response.status_code).to_equal(400)
+
     def test_command_start_printing(self) -> None:
         response = self.client.post(
             "/api/printer/command/start_print?filename=foobar.ctb"
@@ -303,6 +620,11 @@ class MarinerServerTest(TestCase):
                 "layer_height_mm": 0.05,
                 "resolution": [1440, 2560],
                 "print_time_secs": 5621,
+                "integrity": {
+                    "is_valid": True,
+                    "errors": [],
+                    "checked_layer_pixels": False,
+                },
             }
         )
 
@@ -322,6 +644,77 @@ class MarinerServerTest(TestCase):
                 "layer_height_mm": 0.05,
                 "resolution": [1440, 2560],
                 "print_time_secs": 5621,
+                "integrity": {
+                    "is_valid": True,
+                    "errors": [],
+                    "checked_layer_pixels": False,
+                },
+            }
+        )
+
+    def test_batch_file_details(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/functional/stairs.ctb", contents=self.ctb_file_contents
+        )
+
+        response = self.client.post(
+            "/api/file_details/batch",
+            json={
+                "filenames": [
+                    "foobar.ctb",
+                    "missing.ctb",
+                    "._foobar.ctb",
+                    "../../etc/passwd",
+                    "functional/stairs.ctb",
+                    "foobar.ctb",
+                ]
+            },
+        )
+        expect(response.status_code).to_equal(200)
+        files = response.get_json()["files"]
+        expect([file["path"] for file in files]).to_equal(
+            [
+                "foobar.ctb",
+                "missing.ctb",
+                "._foobar.ctb",
+                "../../etc/passwd",
+                "functional/stairs.ctb",
+                "foobar.ctb",
+            ]
+        )
+        expect(files[0]).to_equal(
+            self.client.get("/api/file_details?filename=foobar.ctb").get_json()
+        )
+        expect(files[5]).to_equal(files[0])
+        expect(files[4]["filename"]).to_equal("stairs.ctb")
+        expect([file["error"]["title"] for file in files[1:4]]).to_equal(
+            ["File Not Found", "Unsupported File Format", "Invalid Path"]
+        )
+
+    def test_batch_file_details_with_invalid_body(self) -> None:
+        for body in [
+            None,
+            {"filenames": "foobar.ctb"},
+            {"filenames": [1]},
+            {"filenames": ["foobar.ctb"] * 201},
+        ]:
+            response = self.client.post("/api/file_details/batch", json=body)
+            expect(response.status_code).to_equal(400)
+
+    def test_file_details_of_truncated_file(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/truncated.ctb", contents=self.ctb_file_contents[:-1000]
+        )
+
+        response = self.client.get("/api/file_details?filename=truncated.ctb")
+        expect(response.get_json()["integrity"]).to_equal(
+            {
+                "is_valid": False,
+                "errors": [
+                    "1 layers end past the end of the file (831745 bytes), "
+                    + "starting with layer 399"
+                ],
+                "checked_layer_pixels": False,
             }
         )
 
@@ -340,6 +733,177 @@ class MarinerServerTest(TestCase):
         response = self.client.get("/api/file_preview?filename=../../etc/passwd")
         expect(response.status_code).to_equal(400)
 
+    def test_file_thumbnail(self) -> None:
+        response = self.client.get("/api/file_thumbnail?filename=foobar.ctb")
+        expect(response.content_type).to_equal("image/png")
+        expect(hashlib.md5(response.get_data()).hexdigest()).to_equal(
+            "134dd2c8ed1ddbc53aee070c8f17c9cf"
+        )
+
+    def test_file_thumbnail_with_invalid_path(self) -> None:
+        response = self.client.get("/api/file_thumbnail?filename=../../etc/passwd")
+        expect(response.status_code).to_equal(400)
+
+    def test_layer_image(self) -> None:
+        response = self.client.get("/api/layer_image?filename=foobar.ctb&layer=399")
+        expect(response.status_code).to_equal(200)
+        expect(response.content_type).to_equal("image/png")
+        (width, height, rows, info) = png.Reader(bytes=response.get_data()).read()
+        expect((width, height)).to_equal((1440, 2560))
+        expect(info["greyscale"]).is_true()
+        expect(info["bitdepth"]).to_equal(8)
+
+    def test_layer_image_with_invalid_layer(self) -> None:
+        response = self.client.get("/api/layer_image?filename=foobar.ctb&layer=400")
+        expect(response.status_code).to_equal(400)
+        response = self.client.get("/api/layer_image?filename=foobar.ctb&layer=x")
+        expect(response.status_code).to_equal(400)
+
+    def test_layer_image_with_invalid_path(self) -> None:
+        response = self.client.get(
+            "/api/layer_image?filename=../../etc/passwd&layer=0"
+        )
+        expect(response.status_code).to_equal(400)
+
+    def test_layer_tiles(self) -> None:
+        response = self.client.get("/api/layer_tiles?filename=foobar.ctb")
+        expect(response.get_json()).to_equal(
+            {
+                "width": 1440,
+                "height": 2560,
+                "layer_count": 400,
+                "tile_size": 256,
+                "max_zoom": 4,
+            }
+        )
+
+    @patch("mariner.server.api.prefetch_layer_tiles")
+    def test_layer_tile(self, prefetch_layer_tiles_mock: Mock) -> None:
+        response = self.client.get(
+            "/api/layer_tile?filename=foobar.ctb&layer=10&zoom=0&x=0&y=0"
+        )
+        expect(response.status_code).to_equal(200)
+        expect(response.content_type).to_equal("image/png")
+        (width, height, rows, _) = png.Reader(bytes=response.get_data()).read()
+        expect((width, height)).to_equal((256, 256))
+        prefetch_layer_tiles_mock.assert_called_once_with(
+            pathlib.Path("/mnt/usb_share/foobar.ctb"), 10, 0, 0, 0
+        )
+
+    @patch("mariner.server.api.prefetch_layer_tiles")
+    def test_layer_tile_out_of_bounds(self, prefetch_layer_tiles_mock: Mock) -> None:
+        for query in ["layer=400&zoom=0&x=0&y=0", "layer=0&zoom=5&x=0&y=0"]:
+            response = self.client.get(f"/api/layer_tile?filename=foobar.ctb&{query}")
+            expect(response.status_code).to_equal(400)
+        response = self.client.get(
+            "/api/layer_tile?filename=foobar.ctb&layer=0&zoom=4&x=6&y=0"
+        )
+        expect(response.status_code).to_equal(400)
+        response = self.client.get("/api/layer_tile?filename=foobar.ctb&layer=0")
+        expect(response.status_code).to_equal(400)
+
+    def test_thumbnail_sheet(self) -> None:
+        self.fs.create_file("/mnt/usb_share/a.ctb", contents=self.ctb_file_contents)
+        self.fs.create_file("/mnt/usb_share/notes.txt", contents="dummy content")
+
+        response = self.client.get("/api/thumbnail_sheet")
+        data = response.get_json()
+        expect(data["width"]).to_equal(1024)
+        expect(data["height"]).to_equal(80)
+        expect(data["thumbnail_width"]).to_equal(128)
+        expect(data["thumbnail_height"]).to_equal(80)
+        expect(data["thumbnails"]).to_equal(
+            [
+                {"path": "a.ctb", "x": 128, "y": 0},
+                {"path": "foobar.ctb", "x": 256, "y": 0},
+            ]
+        )
+
+        response = self.client.get(data["url"].replace("api/", "/api/", 1))
+        expect(response.status_code).to_equal(200)
+        expect(response.content_type).to_equal("image/png")
+
+        # the sheet is cached until one of the files in it changes
+        expect(self.client.get("/api/thumbnail_sheet").get_json()).to_equal(data)
+        with freeze_time("2030-01-01"):
+            self.fs.create_file(
+                "/mnt/usb_share/b.ctb", contents=self.ctb_file_contents
+            )
+        expect(
+            self.client.get("/api/thumbnail_sheet").get_json()["url"]
+        ).not_to_equal(data["url"])
+        # and the sheet it replaced is deleted
+        response = self.client.get(data["url"].replace("api/", "/api/", 1))
+        expect(response.status_code).to_equal(404)
+
+    def test_thumbnail_sheet_with_zip_file(self) -> None:
+        # .ctb thumbnails have 5 bits per channel and .zip ones have 8, which
+        # all end up as 8 bits in the sheet
+        preview = io.BytesIO()
+        png.from_array([[255, 0, 0] * 2] * 2, "RGB").write(preview)
+        archive_data = io.BytesIO()
+        with zipfile.ZipFile(archive_data, "w") as archive:
+            archive.writestr("run.gcode", ";totalLayer:0\n")
+            archive.writestr("preview.png", preview.getvalue())
+        self.fs.create_file(
+            "/mnt/usb_share/cube.zip", contents=archive_data.getvalue()
+        )
+
+        response = self.client.get(
+            "/api/thumbnail_sheet?filename=cube.zip&filename=foobar.ctb"
+        )
+        data = response.get_json()
+        expect(data["thumbnails"]).to_equal(
+            [
+                {"path": "cube.zip", "x": 0, "y": 0},
+                {"path": "foobar.ctb", "x": 128, "y": 0},
+            ]
+        )
+        response = self.client.get(data["url"].replace("api/", "/api/", 1))
+        (_, _, rows, info) = png.Reader(bytes=response.data).read()
+        expect(info["bitdepth"]).to_equal(8)
+        first_row = bytes(next(iter(rows)))
+        expect(first_row[:3]).to_equal(bytes([255, 0, 0]))
+        # the background of the stairs.ctb thumbnail is 11 out of 31
+        expect(first_row[384:387]).to_equal(bytes([90, 90, 90]))
+
+    def test_thumbnail_sheet_uses_cached_thumbnails(self) -> None:
+        thumbnail_path = get_cached_thumbnail_path(
+            pathlib.Path("/mnt/usb_share/foobar.ctb")
+        )
+        with open(thumbnail_path, "wb") as file:
+            png.from_array([[0, 255, 0] * 4] * 4, "RGB").write(file)
+
+        response = self.client.get("/api/thumbnail_sheet?filename=foobar.ctb")
+        data = response.get_json()
+        response = self.client.get(data["url"].replace("api/", "/api/", 1))
+        (_, _, rows, _) = png.Reader(bytes=response.data).read()
+        expect(bytes(next(iter(rows)))[:3]).to_equal(bytes([0, 255, 0]))
+
+    def test_thumbnail_sheet_for_list_of_files(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/foo/a.ctb", contents=self.ctb_file_contents
+        )
+        response = self.client.get(
+            "/api/thumbnail_sheet?filename=foo/a.ctb&filename=foobar.ctb"
+        )
+        expect(response.get_json()["thumbnails"]).to_equal(
+            [
+                {"path": "foo/a.ctb", "x": 0, "y": 0},
+                {"path": "foobar.ctb", "x": 128, "y": 0},
+            ]
+        )
+
+    def test_thumbnail_sheet_with_invalid_path(self) -> None:
+        response = self.client.get("/api/thumbnail_sheet?path=../foo/")
+        expect(response.status_code).to_equal(400)
+        response = self.client.get("/api/thumbnail_sheet?filename=../../etc/passwd")
+        expect(response.status_code).to_equal(400)
+
+    def test_thumbnail_sheet_image_that_does_not_exist(self) -> None:
+        response = self.client.get("/api/thumbnail_sheet/abcdef.png")
+        expect(response.status_code).to_equal(404)
+
     def test_upload_file_without_a_file(self) -> None:
         response = self.client.post("/api/upload_file")
         expect(response.status_code).to_equal(400)
@@ -356,20 +920,25 @@ class MarinerServerTest(TestCase):
 
     def test_upload_file(self) -> None:
         data = {"file": (io.BytesIO(b"abcdef"), "myfile.ctb")}
-        with patch.object(FileStorage, "save") as save_file_mock:
+        with patch.object(FileStorage, "save") as save_file_mock, patch(
+            "mariner.server.api.read_cached_integrity_report"
+        ) as read_integrity_report_mock:
             response = self.client.post("/api/upload_file", data=data)
         expect(response.status_code).to_equal(200)
-        expect(response.get_json()).to_equal({"success": True})
+        expect(response.get_json()).to_equal({"success": True, "duplicates": []})
         save_file_mock.assert_called_once_with(
             str(config.get_files_directory() / "myfile.ctb")
         )
+        read_integrity_report_mock.assert_called_once_with(
+            config.get_files_directory() / "myfile.ctb"
+        )
 
     def test_upload_file_with_upper_case_extension(self) -> None:
         data = {"file": (io.BytesIO(b"abcdef"), "myfile.CtB")}
         with patch.object(FileStorage, "save") as save_file_mock:
             response = self.client.post("/api/upload_file", data=data)
         expect(response.status_code).to_equal(200)
-        expect(response.get_json()).to_equal({"success": True})
+        expect(response.get_json()).to_equal({"success": True, "duplicates": []})
         save_file_mock.assert_called_once_with(
             str(config.get_files_directory() / "myfile.CtB")
         )
@@ -379,11 +948,29 @@ class MarinerServerTest(TestCase):
         with patch.object(FileStorage, "save") as save_file_mock:
             response = self.client.post("/api/upload_file", data=data)
         expect(response.status_code).to_equal(200)
-        expect(response.get_json()).to_equal({"success": True})
+        expect(response.get_json()).to_equal({"success": True, "duplicates": []})
         save_file_mock.assert_called_once_with(
             str(config.get_files_directory() / "etc_passwd.ctb")
         )
 
+    def test_upload_file_with_a_duplicate(self) -> None:
+        # the cache bootstrapper would have indexed the existing files
+        self.file_index.sync()
+        # the upload itself is mocked, since werkzeug spools large uploads into
+        # temporary files that pyfakefs can't create
+        self.fs.create_file("/mnt/usb_share/copy.ctb", contents=self.ctb_file_contents)
+        data = {"file": (io.BytesIO(b"abcdef"), "copy.ctb")}
+        with patch.object(FileStorage, "save"):
+            response = self.client.post("/api/upload_file", data=data)
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()).to_equal(
+            {"success": True, "duplicates": ["foobar.ctb"]}
+        )
+
+        response = self.client.get("/api/file_details?filename=copy.ctb")
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()["filename"]).to_equal("copy.ctb")
+
     def test_delete_file(self) -> None:
         expect(os.path.exists(config.get_files_directory() / "mariner.ctb")).to_equal(
             False
@@ -412,6 +999,182 @@ class MarinerServerTest(TestCase):
         response = self.client.post("/api/delete_file?filename=../../etc/passwd")
         expect(response.status_code).to_equal(400)
 
+    def test_patch_file(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/mariner.ctb", contents=self.ctb_file_contents
+        )
+        with patch(
+            "mariner.file_formats.ctb.CTBFile.patch_print_settings"
+        ) as patch_print_settings_mock:
+            response = self.client.post(
+                "/api/patch_file?filename=mariner.ctb",
+                json={"exposure_secs": 2.5, "layer_range": [10, 20]},
+            )
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()).to_equal({"success": True})
+        patch_print_settings_mock.assert_called_once_with(
+            config.get_files_directory() / "mariner.ctb",
+            PrintSettingsPatch(exposure_secs=2.5, layer_range=(10, 20)),
+        )
+
+    def test_patch_file_updates_print_time(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/mariner.ctb", contents=self.ctb_file_contents
+        )
+        self.file_index.sync()
+        response = self.client.post(
+            "/api/patch_file?filename=mariner.ctb", json={"exposure_secs": 20.0}
+        )
+        expect(response.status_code).to_equal(200)
+        # the print time is simulated from the new exposure, and the listing
+        # doesn't have to wait for the file to be indexed again
+        response = self.client.get("/api/file_details?filename=mariner.ctb")
+        expect(response.get_json()["print_time_secs"]).to_equal(10149)
+        indexed_file = self.file_index.get_file(
+            config.get_files_directory() / "mariner.ctb"
+        )
+        expect(indexed_file.print_time_secs).to_equal(10149)
+
+    def test_patch_file_with_invalid_settings(self) -> None:
+        self.fs.create_file(
+            "/mnt/usb_share/mariner.ctb", contents=self.ctb_file_contents
+        )
+        for body in [
+            {"exposure_secs": -1},
+            {"exposure_secs": "2.5"},
+            {"print_time_secs": 100},
+            {"layer_range": [10]},
+        ]:
+            response = self.client.post(
+                "/api/patch_file?filename=mariner.ctb", json=body
+            )
+            expect(response.status_code).to_equal(400)
+        response = self.client.post(
+            "/api/patch_file?filename=mariner.ctb",
+            json={"exposure_secs": 2.5, "layer_range": [10, 500]},
+        )
+        expect(response.status_code).to_equal(400)
+        # the lift height can't be changed for a range of layers
+        response = self.client.post(
+            "/api/patch_file?filename=mariner.ctb",
+            json={"lift_height_mm": 6.0, "layer_range": [10, 20]},
+        )
+        expect(response.status_code).to_equal(400)
+        expect(
+            self.fs.get_object("/mnt/usb_share/mariner.ctb").byte_contents
+        ).to_equal(self.ctb_file_contents)
+
+    def test_patch_file_with_read_only_format(self) -> None:
+        archive_data = io.BytesIO()
+        with zipfile.ZipFile(archive_data, "w") as archive:
+            archive.writestr("run.gcode", ";totalLayer:0\n")
+        self.fs.create_file(
+            "/mnt/usb_share/cube.zip", contents=archive_data.getvalue()
+        )
+        response = self.client.post(
+            "/api/patch_file?filename=cube.zip", json={"exposure_secs": 2.5}
+        )
+        expect(response.status_code).to_equal(409)
+
+    def test_patch_file_with_invalid_path(self) -> None:
+        response = self.client.post(
+            "/api/patch_file?filename=../../etc/passwd", json={"exposure_secs": 1}
+        )
+        expect(response.status_code).to_equal(400)
+
+    def test_delete_files(self) -> None:
+        self.fs.create_file("/mnt/usb_share/foo/a.ctb", contents="dummy content")
+        self.fs.create_file("/mnt/usb_share/b.ctb", contents="dummy content")
+        self.file_index.sync()
+        response = self.client.post(
+            "/api/files/delete",
+            json={"paths": ["foo", "b.ctb", "missing.ctb", "../../etc/passwd"]},
+        )
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()).to_equal(
+            {
+                "results": [
+                    {"path": "foo", "success": True},
+                    {"path": "b.ctb", "success": True},
+                    {
+                        "path": "missing.ctb",
+                        "success": False,
+                        "error": {"title": "File Not Found", "description": ANY},
+                    },
+                    {
+                        "path": "../../etc/passwd",
+                        "success": False,
+                        "error": {"title": "Invalid Path", "description": ANY},
+                    },
+                ]
+            }
+        )
+        expect(os.path.exists("/mnt/usb_share/foo")).to_equal(False)
+        expect(os.path.exists("/mnt/usb_share/b.ctb")).to_equal(False)
+        expect(
+            self.file_index.get_file(config.get_files_directory() / "foo/a.ctb")
+        ).to_equal(None)
+
+    def test_move_files(self) -> None:
+        self.fs.create_dir("/mnt/usb_share/foo")
+        self.fs.create_file("/mnt/usb_share/bar/a.ctb", contents="dummy content")
+        self.file_index.sync()
+        response = self.client.post(
+            "/api/files/move",
+            json={"paths": ["foobar.ctb", "bar", "missing.ctb"], "destination": "foo"},
+        )
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()["results"][:2]).to_equal(
+            [
+                {"path": "foobar.ctb", "success": True, "new_path": "foo/foobar.ctb"},
+                {"path": "bar", "success": True, "new_path": "foo/bar"},
+            ]
+        )
+        expect(response.get_json()["results"][2]["success"]).to_equal(False)
+
+        response = self.client.get("/api/file_details?filename=foo/foobar.ctb")
+        expect(response.status_code).to_equal(200)
+        expect(response.get_json()["filename"]).to_equal("foobar.ctb")
+        expect(os.path.exists("/mnt/usb_share/foo/bar/a.ctb")).to_equal(True)
+        indexed_file = self.file_index.get_file(
+            config.get_files_directory() / "foo/bar/a.ctb"
+        )
+        expect(indexed_file is not None).to_equal(True)
+
+    def test_move_files_with_invalid_destination(self) -> None:
+        for destination in ["../../etc", "foobar.ctb", "missing", None]:
+            response = self.client.post(
+                "/api/files/move",
+                json={"paths": ["foobar.ctb"], "destination": destination},
+            )
+            expect(response.status_code).to_equal(400)
+        response = self.client.post("/api/files/move", json={"paths": "foobar.ctb"})
+        expect(response.status_code).to_equal(400)
+
+    def test_rename_files(self) -> None:
+        self.fs.create_file("/mnt/usb_share/b.ctb", contents="dummy content")
+        response = self.client.post(
+            "/api/files/rename",
+            json={
+                "renames": [
+                    {"path": "foobar.ctb", "name": "mariner.ctb"},
+                    {"path": "b.ctb", "name": "mariner.ctb"},
+                    {"path": "b.ctb", "name": "../b.ctb"},
+                ]
+            },
+        )
+        expect(response.status_code).to_equal(200)
+        expect(
+            [
+                (result["success"], result.get("error", {}).get("title"))
+                for result in response.get_json()["results"]
+            ]
+        ).to_equal(
+            [(True, None), (False, "File Already Exists"), (False, "Invalid Path")]
+        )
+        expect(os.path.exists("/mnt/usb_share/mariner.ctb")).to_equal(True)
+        expect(os.path.exists("/mnt/usb_share/foobar.ctb")).to_equal(False)
+
     def test_get_index(self) -> None:
         with patch(
             "mariner.server.render_template", return_value=""